@@ -4,8 +4,10 @@ import os
 import re
 import sys
 import argparse
+import multiprocessing as mp
 from collections import defaultdict
-from mycotools.lib.biotools import fa2dict, dict2fa, reverse_complement
+from mycotools.lib.biotools import fa2dict, dict2fa, reverse_complement, \
+    IndexedFasta
 from mycotools.lib.dbtools import mtdb, primaryDB
 from mycotools.lib.kontools import format_path, eprint, stdin2str
 
@@ -119,33 +121,78 @@ def dbmain(db, accs, error = True,
         ome = acc[:acc.find('_')]
         ome_data[ome].append(acc)
 
-    # populate the fasta dict with the accession information by referencing the
-    # mycotools proteome entry for each ome
-    fa_dict = {}
+    # populate the fasta dict with the accession information by seeking each
+    # record in the indexed mycotools proteome entry for each ome
     if coord_check:
-        for ome, ome_accs in ome_data.items():
-            try:
-                ome_fasta = fa2dict(db[ome]['faa'])
-            except KeyError: # if there is a missing ome
-                if error:
-                    raise KeyError('invalid ome: ' + ome)
-                else:
-                    eprint(spacer + ome + ' not in database', flush = True)
-            fa_dict = {**fa_dict, **extract_mtdb_accs(ome_fasta, ome_accs)}
+        extract_func = extract_mtdb_accs
     else:
-        for ome, ome_accs in ome_data.items():
-            try:
-                ome_fasta = fa2dict(db[ome]['faa'])
-            except KeyError: # if there is a missing ome
-                if error:
-                    raise KeyError
-                else:
-                    eprint(spacer + ome + ' not in database', flush = True)
-            fa_dict = {**fa_dict, **extract_mtdb_accs_exp(ome_fasta, ome_accs)}
+        extract_func = extract_mtdb_accs_exp
+    fa_dict = {}
+    for ome, ome_accs in ome_data.items():
+        try:
+            faa_path = db[ome]['faa']
+        except KeyError: # if there is a missing ome
+            if error:
+                raise KeyError('invalid ome: ' + ome)
+            else:
+                eprint(spacer + ome + ' not in database', flush = True)
+                continue
+        try:
+            ome_fasta = IndexedFasta(faa_path)
+        except ValueError: # irregular line lengths cannot be indexed
+            ome_fasta = fa2dict(faa_path)
+        fa_dict = {**fa_dict, **extract_func(ome_fasta, ome_accs)}
 
     return fa_dict
 
 
+def ome_acc2fa(ome, fa_path, accs, mtdb_coords = True):
+    """extract all `accs` requested from an ome's fasta, reading it once.
+    mtdb_coords uses dbmain's `acc[START:END]` convention, otherwise famain's
+    1-indexed `acc[START-END]`"""
+    if mtdb_coords:
+        try:
+            fasta = IndexedFasta(fa_path)
+        except ValueError: # irregular line lengths cannot be indexed
+            fasta = fa2dict(fa_path)
+        return ome, extract_mtdb_accs(fasta, accs)
+    return ome, extractHeaders(fa_path, accs)
+
+
+def bulk_acc2fa(q_accs, ome2fa, mtdb_coords = True, cpus = 1,
+                spacer = '\t'):
+    """takes in {query: {ome: [accessions]}} and {ome: fasta_path}; groups
+    the accessions of all queries by ome so each fasta is parsed once, then
+    returns {query: fa_dict}"""
+
+    ome_accs = defaultdict(dict) # insertion-ordered unique accessions
+    for q, ome_dict in q_accs.items():
+        for ome, accs in ome_dict.items():
+            for acc in accs:
+                ome_accs[ome][acc] = None
+
+    ome_cmds = []
+    for ome, accs in ome_accs.items():
+        if ome in ome2fa:
+            ome_cmds.append([ome, ome2fa[ome], list(accs), mtdb_coords])
+        else:
+            eprint(spacer + ome + ' not in database', flush = True)
+    with mp.get_context('spawn').Pool(processes = cpus) as pool:
+        ome_fas = {ome: fa for ome, fa in pool.starmap(ome_acc2fa, ome_cmds)}
+
+    q_fas = {}
+    for q, ome_dict in q_accs.items():
+        q_fas[q] = {}
+        for ome, accs in ome_dict.items():
+            if ome not in ome_fas:
+                continue
+            for acc in accs:
+                if acc in ome_fas[ome]:
+                    q_fas[q][acc] = ome_fas[ome][acc]
+
+    return q_fas
+
+
 def famain(accs, fa, ome = None):
     """takes in accessions, fasta, and retrieves accessions"""
 
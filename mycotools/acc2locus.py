@@ -8,7 +8,8 @@ import multiprocessing as mp
 from collections import defaultdict
 from mycotools.lib.kontools import eprint, format_path, file2list, stdin2str
 from mycotools.lib.dbtools import primaryDB, mtdb
-from mycotools.lib.biotools import gff2list, fa2dict, dict2fa, list2gff, gff3Comps
+from mycotools.lib.biotools import gff2list, fa2dict, dict2fa, list2gff, \
+    gff3Comps, AnnotationCache, load_annotation_cache
 from mycotools.acc2gff import grabGffAcc
 
 def prepGffOutput(hit_list, gff_path, cpu = 1):
@@ -187,9 +188,12 @@ def grab_between(prot_dict, accs):
 
 def main(gff_list, accs, plusminus = 10, mycotools = False,
          geneGff = False, nt = False, between = False):
+    """gff_list is either a gff2list() or a MycoTools AnnotationCache"""
 
     out_indices = {}
-    if mycotools:
+    if isinstance(gff_list, AnnotationCache):
+        cds_dict, acc2seqid = gff_list.cds_dict(accs)
+    elif mycotools:
         cds_dict, acc2seqid = compileCDS_mycotools(gff_list, accs)
     else:
         cds_dict, acc2seqid = compileCDS(gff_list, accs)
@@ -206,7 +210,17 @@ def main(gff_list, accs, plusminus = 10, mycotools = False,
                                                 plusminus)
 
     out_indices = {k: v for k, v in out_indices.items() if v}
-    if geneGff:
+    if geneGff and isinstance(gff_list, AnnotationCache):
+        geneGffs = {}
+        for acc in out_indices:
+            geneGffs[acc] = []
+            for gene in out_indices[acc]:
+                entry = gff_list.rna_row(gene)
+                if entry is None:
+                    raise KeyError('gene without RNA: ' + gene)
+                geneGffs[acc].append(entry)
+        return out_indices, geneGffs
+    elif geneGff:
         geneGffs_prep = {acc: {} for acc in out_indices}
         gene_sets = {acc: set(genes) for acc, genes in out_indices.items()}
         for entry in gff_list:
@@ -247,7 +261,8 @@ def mycotools_main(db, accs, plusminus = 10, cpus = 1, nt = False,
 
     db = db.set_index('ome')
     cmds = [
-        [gff2list(db[ome]['gff3']), accs, plusminus, True, False, nt, between] \
+        [load_annotation_cache(db[ome]['gff3']), accs, plusminus, True, 
+         False, nt, between] \
         for ome, accs in acc_dict.items()
         ]
     with mp.Pool(processes = cpus) as pool:
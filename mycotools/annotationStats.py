@@ -5,46 +5,30 @@
 import os
 import re
 import sys
-from itertools import chain
-from collections import defaultdict
-from mycotools.lib.biotools import gff2list, gff3Comps
+import numpy as np
+from mycotools.lib.biotools import gff2list, gff2table, gff3Comps
 from mycotools.lib.kontools import format_path, eprint
 
 
 def compile_alia(gff_path, output, ome = None):
-    gff = gff2list(gff_path)
-    prot_dict, exon_dict, mrna_dict, trna_dict, orna_dict, pseudogene_dict, gene_dict = \
-        defaultdict(list), defaultdict(list), defaultdict(list), \
-        defaultdict(list), defaultdict(list), defaultdict(list), \
-        defaultdict(list)
-    for entry in gff:
-        try:
-            alias = re.search(gff3Comps()['Alias'], entry['attributes'])[1]
-        except TypeError:
-            raise TypeError(f'entry without MTDB alias: {entry}')
-        if entry['type'].lower() == 'gene':
-            gene_dict[alias].append(sorted((entry['start'], entry['end'])))
-        elif entry['type'].lower() == 'cds':
-            prot_dict[alias].append(sorted((entry['start'], entry['end'])))
-        elif entry['type'].lower() == 'exon':
-            exon_dict[alias].append(sorted((entry['start'], entry['end'])))
-        elif entry['type'].lower() == 'mrna':
-            mrna_dict[alias].append(sorted((entry['start'], entry['end'])))
-        elif entry['type'].lower() == 'trna':
-            trna_dict[alias].append(sorted((entry['start'], entry['end'])))
-        elif 'RNA' in entry['type']:
-            orna_dict[alias].append(sorted((entry['start'], entry['end'])))
-        elif entry['type'] == 'pseudogene':
-            pseudogene_dict[alias].append(sorted((entry['start'], entry['end'])))
-
-    gene_lens = sorted([v[1] - v[0] for v in chain(*list(gene_dict.values()))])
-    prot_lens = sorted([v[1] - v[0] for v in chain(*list(prot_dict.values()))])
-    exon_lens = sorted([v[1] - v[0] for v in chain(*list(exon_dict.values()))])
-    mrna_lens = sorted([v[1] - v[0] for v in chain(*list(mrna_dict.values()))])
-    trna_lens = sorted([v[1] - v[0] for v in chain(*list(trna_dict.values()))])
-    orna_lens = sorted([v[1] - v[0] for v in chain(*list(orna_dict.values()))])
-    pseudogene_lens = sorted([v[1] - v[0] \
-                             for v in chain(*list(pseudogene_dict.values()))])
+    gff = gff2table(gff_path)
+    missing = np.nonzero(gff.alias == '')[0]
+    if len(missing):
+        raise TypeError(f'entry without MTDB alias: {gff[missing[0]]}')
+    lens = np.abs(gff.end - gff.start)
+
+    def type_lens(check):
+        codes = [i for i, v in enumerate(gff.types) if check(v)]
+        return sorted(lens[np.isin(gff.type, codes)].tolist())
+
+    std_types = {'gene', 'cds', 'exon', 'mrna', 'trna'}
+    gene_lens = type_lens(lambda x: x.lower() == 'gene')
+    prot_lens = type_lens(lambda x: x.lower() == 'cds')
+    exon_lens = type_lens(lambda x: x.lower() == 'exon')
+    mrna_lens = type_lens(lambda x: x.lower() == 'mrna')
+    trna_lens = type_lens(lambda x: x.lower() == 'trna')
+    orna_lens = type_lens(lambda x: 'RNA' in x and x.lower() not in std_types)
+    pseudogene_lens = type_lens(lambda x: x == 'pseudogene')
 
 
     gene_len = len(gene_lens)
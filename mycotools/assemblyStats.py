@@ -12,32 +12,32 @@ import sys
 import copy
 import multiprocessing as mp
 from mycotools.lib.dbtools import mtdb
-from mycotools.lib.biotools import fa2dict
+from mycotools.lib.biotools import iter_fasta
 from mycotools.lib.kontools import format_path, eprint
 
 
 def calcMask( contig_list ):
 
-    seq = ''.join([x['sequence'] for x in contig_list])
-    mask = seq.count('a')
-    mask += seq.count('t')
-    mask += seq.count('g')
-    mask += seq.count('c')
-
-    return mask
+    return sum(x['mask'] for x in contig_list)
 
 
 def sortContigs( assembly_path ):
-    '''Imports fasta, creates a list of dicts for each contig length and its name.
-       Sorts the list in descending order by length'''
+    '''Streams fasta, creates a list of dicts for each contig length, its name,
+       and its nucleotide counts. Sorts the list in descending order by length'''
 
     contigList = []
-    assembly = fa2dict( assembly_path )
-    for contig in assembly:
+    for contig, descrip, seq in iter_fasta( assembly_path ):
+        if not seq:
+            continue
+        low_seq = seq.lower()
+        gc = low_seq.count( 'g' ) + low_seq.count( 'c' )
         contigList.append( {
-            'len': len(assembly[contig]['sequence']), 
+            'len': len(seq), 
             'name': contig, 
-            'sequence': str(assembly[contig]['sequence'])
+            'gc': gc,
+            'gctot': gc + low_seq.count( 'a' ) + low_seq.count( 't' ),
+            'mask': seq.count('a') + seq.count('t') \
+                  + seq.count('g') + seq.count('c')
         } )
 
     sortedList = sorted(contigList, key = lambda i: i['len'], reverse = True)
@@ -54,13 +54,11 @@ def n50l50( sortedContigs ):
     total, total1000, bp1000, gc, gc1000, gctot, gctot1000 = 0, 0, 0, 0, 0, 0, 0
     for contig in sortedContigs:
         total += contig['len']
-        gc += contig['sequence'].lower().count( "g" ) + contig['sequence'].lower().count( 'c' )
-        gctot += contig['sequence'].lower().count( "g" ) + contig['sequence'].lower().count( 'c' ) + \
-           contig['sequence'].lower().count( 'a' ) + contig['sequence'].lower().count( 't' ) 
+        gc += contig['gc']
+        gctot += contig['gctot']
         if contig['len'] >= 1000:
-            gc1000 += contig['sequence'].lower().count( "g" ) + contig['sequence'].lower().count( 'c' )
-            gctot1000 += contig['sequence'].lower().count( "g" ) + contig['sequence'].lower().count( 'c' ) + \
-                contig['sequence'].lower().count( 'a' ) + contig['sequence'].lower().count( 't' ) 
+            gc1000 += contig['gc']
+            gctot1000 += contig['gctot']
             total1000 += contig['len']
             bp1000 += 1
             pass_fa.append( contig )
@@ -7,24 +7,37 @@ import sys
 import argparse
 from Bio.Seq import Seq
 from collections import defaultdict
-from mycotools.lib.biotools import fa2dict, dict2fa
+from mycotools.lib.biotools import fa2dict, dict2fa, IndexedFasta
 from mycotools.lib.kontools import sys_start, eprint, format_path
 
+def load_fa(fa_path):
+    """seek coordinates from an indexed fasta when possible"""
+    try:
+        return IndexedFasta(fa_path)
+    except ValueError: # irregular line lengths cannot be indexed
+        return fa2dict(fa_path)
+
 def extractCoords(fa_dict, seqid, coord_start = 0, coord_end = -1, sense = '+', fa_name = ''):
 
     new_fa, error = {}, ''
     name = seqid + '_' + str(coord_start) + '-' + str(coord_end) + '_' + sense
+    if isinstance(fa_dict, IndexedFasta):
+        seq = fa_dict.fetch(seqid, coord_start, coord_end)
+        seq_len = fa_dict.length(seqid)
+    else:
+        seq = fa_dict[seqid]['sequence'][coord_start:coord_end]
+        seq_len = len(fa_dict[seqid]['sequence'])
     if sense == '+':
         new_fa[name] = {
-            'sequence': fa_dict[seqid]['sequence'][coord_start:coord_end],
+            'sequence': seq,
             'description': ''
             }
     else:
         new_fa[name] = {
-            'sequence': str(Seq(fa_dict[seqid]['sequence'][coord_start:coord_end]).reverse_complement()),
+            'sequence': str(Seq(seq).reverse_complement()),
             'description': ''
             }
-    if coord_end > len(fa_dict[seqid]['sequence']):
+    if coord_end > seq_len:
         error = '\nNOTICE: end coordinate beyond contig edge: ' + fa_name + ' ' + seqid + ' ' + str(coord_end)
 
     return new_fa, error
@@ -49,7 +62,7 @@ def cli():
         else:
             fa_name = os.path.basename(fa_file)
 
-        fa = fa2dict(fa_file)
+        fa = load_fa(fa_file)
         if not fa:
             raise IndexError
         if len(args) < 3:
@@ -86,7 +99,7 @@ def cli():
             eprint('\nERROR: incorrectly formatted input', flush = True)
 
     for fa_file, concats in files_data.items():
-        fa = fa2dict(format_path(fa_file))
+        fa = load_fa(format_path(fa_file))
         if fa_file.endswith('/'):
             fa_name = os.path.basename(fa_file[:-1])
         else:
@@ -24,7 +24,8 @@ import hashlib
 import random
 import multiprocessing as mp
 import shutil
-from collections import Counter
+import threading
+from collections import Counter, OrderedDict
 try:
     from ete3 import Tree, faces, TreeStyle, NodeStyle, AttrFace
     from ete3.parser.newick import NewickError
@@ -32,8 +33,9 @@ except ImportError:
     raise ImportError('Install ete3 into your conda environment via `conda install ete3`')
 from mycotools.lib.dbtools import mtdb, primaryDB
 from mycotools.lib.kontools import eprint, format_path, findExecs, intro, outro, \
-    read_json, write_json, stdin2str, getColors, collect_files
-from mycotools.lib.biotools import fa2dict, dict2fa, gff2list, list2gff, gff3Comps
+    read_json, write_json, stdin2str, getColors, collect_files, schedule_dag
+from mycotools.lib.biotools import fa2dict, dict2fa, gff2list, list2gff, gff3Comps, \
+    load_annotation_cache
 from mycotools.acc2fa import dbmain as acc2fa
 from mycotools.fa2clus import write_data, ClusteringError, \
     ClusterParameterError, main as fa2clus, sort_iterations
@@ -43,8 +45,10 @@ from mycotools.gff2svg import main as gff2svg
 from mycotools.db2search import blast_main as db2search
 from mycotools.ome2name import main as ome2name
 #from mycotools.utils.og2mycodb import mycodbHGs, extract_ogs
-from mycotools.db2microsyntree import compile_homolog_groups
+from mycotools.db2microsyntree import load_hg_index
 os.environ['QT_QPA_PLATFORM'] = 'offscreen'
+palette_lock = threading.Lock()
+ann_caches = OrderedDict() # per process LRU of {(gff3, size, mtime): AnnotationCache}
 
 
 
@@ -108,11 +112,18 @@ def prep_gff(gff, prots, comps, hits = set(), par_dict = {}):
                 hits.add(protID)
     return par_dict, hits, RNA, gff
 
+def locus2svg(geneGff, svg_path, **kwargs):
+    """gff2svg via a temporary file, so queries drawing a shared locus
+    concurrently never expose a partial .svg"""
+    tmp_path = svg_path[:-4] + '.' + str(os.getpid()) + '.tmp.svg'
+    gff2svg(geneGff, tmp_path, **kwargs)
+    os.replace(tmp_path, svg_path)
+
 def rogue_locus(locusID, rnaGFF, wrk_dir, query2color, labels = True):
     with open(wrk_dir + 'genes/' + locusID + '.locus.genes', 'w') as out:
             out.write(list2gff(rnaGFF))
     svg_path = wrk_dir + 'svg/' + locusID + '.locus.svg'
-    gff2svg(
+    locus2svg(
         rnaGFF, svg_path, product_dict = query2color, labels = labels,
         prod_comp = r';SearchQuery=([^;]+$)', width = 10, null = 'na'
         )
@@ -273,6 +284,7 @@ def outgroup_mngr(
         for x in fa2clus_log['successes']):
         # was not able to refine upward
         run_max_seq = max_success['size'] - 1
+        run_min_seq, run_min_seq_var = min_seq, None
         if any(x['size'] < max_success['size'] \
             for x in fa2clus_log['successes']):
             # are there two successes to refine between?
@@ -322,7 +334,7 @@ def outgroup_mngr(
                 pass
 
     [fa2clus_log['successes'].append(x) for x in fa2clus_log['iterations'] \
-     if x['size'] > min_seq and x['size'] < max_seq]
+     if x['size'] > min_seq and x['size'] < max_seq and 'cluster' in x]
      # account for successes that were only acquired in the outgroup detection
     fa2clus_log['successes'] = sort_iterations(fa2clus_log['successes'])
 
@@ -391,6 +403,16 @@ def gene2hg2ome2hg(gene2hg):
     return ome_gene2hg
 
 
+def add_hits2ome_gene2hg(query_hits, ome_gene2hg, hg_index):
+    """Add {ome: {gene: hg}} from the HG index for omes of `query_hits`"""
+    for ome in {x[:x.find('_')] for x in query_hits}:
+        if ome not in ome_gene2hg:
+            try:
+                ome_gene2hg[ome] = hg_index.ome_gene2hg(ome)
+            except ValueError: # ome without HGs
+                continue
+
+
 def compileGenesByOme(inputs, wrk_dir):
     locusIDs, omeGenes = [], {}
     for query in inputs:
@@ -432,25 +454,42 @@ def compile_genesXome4queries(search_fas, conversion_dict, omes = set()):
 
 
 
+def cached_annotation(gff3, max_size = 16):
+    """load_annotation_cache() through a per process LRU of `max_size`
+    genomes, so a long-lived worker parses and indexes each GFF3 once across
+    queries. Entries are keyed on the GFF3's size and modification time"""
+    gff_stat = os.stat(gff3)
+    key = (gff3, gff_stat.st_size, gff_stat.st_mtime)
+    if key in ann_caches:
+        ann_caches.move_to_end(key)
+        return ann_caches[key]
+    ann_caches[key] = load_annotation_cache(gff3)
+    while len(ann_caches) > max_size:
+        ann_caches.popitem(last = False)
+    return ann_caches[key]
+
+
 def extract_locus_hg(gff3, ome, genesTograb, ogs, ome_gene2hg, 
                      plusminus, wrk_dir, labels = True):
+    """Returns ome, {locusID: locus GFF}, {locusID: [HGs not in `ogs`]}"""
     try:
-        gff_list = gff2list(gff3)
+        ann_cache = cached_annotation(gff3)
     except FileNotFoundError:
         eprint('\t\t\tWARNING: ' + ome + ' mycotoolsdb entry without GFF3', flush = True)
         return
     genesTograb = [x for x in genesTograb if not os.path.isfile(wrk_dir + 'svg/' + x + '.locus.svg')]
     try:
-        out_indices, geneGffs = acc2locus(gff_list, genesTograb, 
+        out_indices, geneGffs = acc2locus(ann_cache, genesTograb, 
                                           plusminus, mycotools = True, 
                                           geneGff = True, nt = True)
     except KeyError:
         eprint('\t\t\tWARNING: ' + ome + ' could not parse gff', flush = True)
         return
 
-    extractedGenes, new_hgs = {}, []
+    extractedGenes, new_hgs = {}, {}
     for locusID, genes in out_indices.items():
         startI, endI = None, None
+        new_hgs[locusID] = []
         for i, gene in enumerate(genes):
             try:
                 geneGffs[locusID][i]['attributes'] += ';HG=' + str(ome_gene2hg[gene])
@@ -458,7 +497,7 @@ def extract_locus_hg(gff3, ome, genesTograb, ogs, ome_gene2hg,
                 geneGffs[locusID][i]['attributes'] += ';HG=na'
                 continue
             if ome_gene2hg[gene] not in ogs:
-                new_hgs.append(ome_gene2hg[gene])
+                new_hgs[locusID].append(ome_gene2hg[gene])
             if gene == locusID or ome_gene2hg[gene] in ogs:
                 if startI is None:
                     startI = i
@@ -477,7 +516,7 @@ def extract_locus_hg(gff3, ome, genesTograb, ogs, ome_gene2hg,
 def extract_locus_svg_hg(extractedGenes, wrk_dir, hg2color, labels):
     for locusID, geneGff in extractedGenes.items():
         svg_path = wrk_dir + 'svg/' + locusID + '.locus.svg'
-        gff2svg(
+        locus2svg(
             geneGff, svg_path, product_dict = hg2color, prod_comp = r';HG=([^;]+$)', 
             width = 10, null = 'na', labels = labels, gen_new_colors = False
             )
@@ -485,13 +524,13 @@ def extract_locus_svg_hg(extractedGenes, wrk_dir, hg2color, labels):
 
 def extract_locus_gene(gff3, ome, accs, gene2query, plusminus, query2color, wrk_dir, labels = True):
     try:
-        gff_list = gff2list(gff3)
+        ann_cache = cached_annotation(gff3)
     except FileNotFoundError:
         eprint('\t\t\tWARNING: ' + ome + ' mycotoolsdb entry without GFF3', flush = True)
         return
     accs = [x for x in accs if not os.path.isfile(wrk_dir + 'svg/' + x + '.locus.svg')]
     try:
-        out_indices, geneGffs = acc2locus(gff_list, accs, 
+        out_indices, geneGffs = acc2locus(ann_cache, accs, 
                                           plusminus, mycotools = True, 
                                           geneGff = True, nt = True)
     except KeyError:
@@ -524,7 +563,7 @@ def extract_locus_gene(gff3, ome, accs, gene2query, plusminus, query2color, wrk_
 
     for locusID, geneGff in extractedGenes.items():
         svg_path = wrk_dir + 'svg/' + locusID + '.locus.svg'
-        gff2svg(
+        locus2svg(
             geneGff, svg_path, product_dict = query2color, labels = labels,
             prod_comp = r';SearchQuery=([^;]+$)', width = 8, null = 'na'
             )
@@ -741,82 +780,259 @@ def parseLog(logPath, new_log, out_dir):
     write_json(new_log, logPath)
 
 
-def crap_mngr(
-    db, query, query_hits, out_dir, wrk_dir, tre_dir, fast, 
-    tree_suffix, genes2query, plusminus, query2color, 
-    cpus = 1, verbose = False, hg = None, hgs = None, reoutput = True,
-    out_keys = [], labels = True, midpoint = True, ext = '.svg'
-    ):
+def pool_starmap(pool, func, cmds, cpus = 1):
+    """pool.starmap that keeps at most `cpus` of `cmds` in the shared `pool`
+    at once"""
+    slots = threading.BoundedSemaphore(max(cpus, 1))
+    def release(res):
+        slots.release()
+    results = []
+    for cmd in cmds:
+        slots.acquire()
+        results.append(pool.apply_async(func, cmd, callback = release,
+                                        error_callback = release))
+    return [x.get() for x in results]
 
-    db = db.set_index('ome')
-    info = tree_mngr(
-        query, out_dir, wrk_dir, tre_dir, fast, 
-        tree_suffix, cpus, verbose, reoutput
-        )
 
-    if info:
-        return
+def locus_mngr(
+    db, query_hits, wrk_dir, genes2query, plusminus, query2color,
+    hgs = None, labels = True, pool = None, cpus = 1
+    ):
+    """Extract the loci of {query: [hits]} and draw their synteny diagrams
+    in `pool`. Requests are batched by ome across queries, so each genome is
+    visited once per call. Homology group mode if `hgs` are provided"""
 
-    print('\t\tExtracting loci and generating synteny diagrams', flush = True)
-    extract_loci_cmds = []
-    if hg:
-        for ome, ome_genes2hg in genes2query.items():
-            ome_hits = [x for x in query_hits if x.startswith(ome + '_')]
-            if ome_hits:
-                extract_loci_cmds.append([db[ome]['gff3'], ome, ome_hits, hgs, ome_genes2hg, 
-                                          plusminus, wrk_dir, labels])
-        with mp.Pool(processes = cpus) as pool:
-            ex_locs_res = pool.starmap(extract_locus_hg, extract_loci_cmds)
+    if len(query_hits) == 1:
+        print('\t' + str(list(query_hits)[0]) + ': extracting loci and ' \
+            + 'generating synteny diagrams', flush = True)
+    else:
+        print('\tExtracting loci and generating synteny diagrams for ' \
+            + str(len(query_hits)) + ' queries', flush = True)
+    db = db.set_index('ome')
+    ome_hits = {}
+    for hits in query_hits.values():
+        for hit in hits:
+            ome = hit[:hit.find('_')]
+            if ome in genes2query:
+                if ome not in ome_hits:
+                    ome_hits[ome] = {}
+                ome_hits[ome][hit] = None
+
+    if hgs is not None:
+        extract_loci_cmds = [[db[ome]['gff3'], ome, list(hits), hgs, 
+                              genes2query[ome], plusminus, wrk_dir, labels] \
+                             for ome, hits in ome_hits.items()]
+        ex_locs_res = pool_starmap(pool, extract_locus_hg, extract_loci_cmds, cpus)
         ex_locs_res = [x for x in ex_locs_res if x]
-        etc_hgs, ex_locs = [], []
+        ex_locs, locus_hgs = [], {}
         for ome, ex_loc, new_hgs in ex_locs_res:
-            etc_hgs.extend(new_hgs)
             ex_locs.append(ex_loc)
-        new_hgs = [k for k,v in Counter(etc_hgs).items() if v > 1]
-        query2color = extend_color_palette(hgs + new_hgs, query2color)
-        with mp.Pool(processes = cpus) as pool:
-            pool.starmap(extract_locus_svg_hg, ((ex_loc, wrk_dir, query2color, labels) \
-                                                for ex_loc in ex_locs))
-        
+            locus_hgs.update(new_hgs)
+        with palette_lock: # the palette is shared by concurrent queries
+            for hits in query_hits.values():
+                etc_hgs = [hg for hit in hits for hg in locus_hgs.get(hit, [])]
+                new_hgs = [k for k,v in Counter(etc_hgs).items() if v > 1]
+                query2color = extend_color_palette(hgs + new_hgs, query2color)
+            hg2color = dict(query2color)
+        pool_starmap(pool, extract_locus_svg_hg, 
+                     [[ex_loc, wrk_dir, hg2color, labels] for ex_loc in ex_locs],
+                     cpus)
     else:
-        for ome, ome_genes2query in genes2query.items():
-            ome_hits = [x for x in query_hits if x.startswith(ome + '_')]
-            if ome_hits:
-                extract_loci_cmds.append([db[ome]['gff3'], ome, ome_hits, ome_genes2query, 
-                                          plusminus, query2color, wrk_dir, labels])
-        with mp.Pool(processes = cpus) as pool:
-            pool.starmap(extract_locus_gene, extract_loci_cmds)
-    
-    print('\t\tMapping synteny diagrams on phylogeny', flush = True)
+        extract_loci_cmds = [[db[ome]['gff3'], ome, list(hits), genes2query[ome],
+                              plusminus, query2color, wrk_dir, labels] \
+                             for ome, hits in ome_hits.items()]
+        pool_starmap(pool, extract_locus_gene, extract_loci_cmds, cpus)
+
+    return query2color
+
+
+def map_mngr(
+    db, query, tre_dir, tree_suffix, out_dir, hg = None, out_keys = [],
+    midpoint = True, ext = '.svg'
+    ):
+    """Render the synteny diagrams of `query` onto its phylogeny, rooted
+    on `out_keys` if available"""
+
+    print('\t' + str(query) + ': mapping synteny diagrams on phylogeny', 
+          flush = True)
+    db = db.set_index('ome')
     tree_file = tre_dir + query + tree_suffix
     with open(tree_file, 'r') as raw:
         raw_tree = raw.read()
-#    name_tree = ome2name(db, raw_tree, True, True, True, True, False)
 
     if out_keys:
-#        root_key = ome2name(
- #           db, random.choice(out_keys), True, True, True, True, False
-  #          )
         root_key = random.choice(out_keys)
-        try:
-            svgs2tree(
-                query, hg, raw_tree, db, tree_file,
-                out_dir, root_key, midpoint = midpoint,
-                ext = ext #svg_dir, out_dir
-                )
-        except NewickError:
-            eprint('\t\t\tERROR: newick malformatted', flush = True)
     else:
-        try:
-            svgs2tree(
-                query, hg, raw_tree, db, tree_file,
-                out_dir, midpoint = midpoint, ext = ext #svg_dir, out_dir
+        root_key = None
+    try:
+        svgs2tree(
+            query, hg, raw_tree, db, tree_file,
+            out_dir, root_key, midpoint = midpoint, ext = ext
+            )
+    except NewickError:
+        eprint('\t\t\tERROR: newick malformatted', flush = True)
+
+
+def clus_mngr(
+    db, query, min_seq, max_size, clus_dir, wrk_dir, clus_cons = 0.4,
+    clus_var = 0.65, cluster = False, outgroups = False, interval = 0.1,
+    algorithm = 'mmseqs easy-linclust', verbose = False, cpus = 1
+    ):
+    """Cluster the homologs of `query` into a module within `max_size` if
+    `cluster`, then detect an outgroup if `outgroups`. Returns 
+    (hits, outgroup hits) or False if no module was acquired"""
+
+    overshot, out_keys = False, []
+    if cluster:
+        print('\t' + str(query) + ': sequence clustering', flush = True)
+        res, overshot, fa2clus_log = run_fa2clus(
+            clus_dir + str(query) + '.fa', db, query, min_seq, max_size,
+            clus_dir, query, clus_cons, clus_var, cpus = cpus,
+            verbose = verbose, interval = interval, algorithm = algorithm
+            )
+        if not res:
+            eprint('\t' + str(query) + ': ERROR: query had no significant hits',
+                   flush = True)
+            return False
+
+    if outgroups and not overshot:
+        if os.path.isfile(clus_dir + query + '.fa'):
+            print('\t' + str(query) + ': outgroup detection', flush = True)
+            in_keys, all_keys = outgroup_mngr(
+                db, query, min_seq, max_size, clus_dir, wrk_dir,
+                clus_cons = clus_cons, cpus = cpus, interval = interval,
+                verbose = False
                 )
-        except NewickError:
-            eprint('\t\t\tERROR: newick malformatted', flush = True)
+            out_keys = list(set(all_keys).difference(set(in_keys)))
+            print('\t' + str(query) + ': ' + str(len(in_keys)) \
+                + ' gene ingroup, ' + str(len(out_keys)) + ' gene outgroup',
+                  flush = True)
+            return list(all_keys), out_keys
+        else:
+            eprint('\t' + str(query) + ': WARNING: could not detect ' \
+                 + 'outgroup for root', flush = True)
+
+    return list(fa2dict(wrk_dir + query + '.fa').keys()), out_keys
+
+
+def crap_dag(
+    db, fas4trees, fas4clus, out_dir, wrk_dir, tre_dir, clus_dir, fast,
+    genes2query, plusminus, query2color, min_seq, max_size,
+    clus_cons = 0.4, clus_var = 0.65, clus_cpus = None, cpus = 1,
+    verbose = False, reoutput = True, outgroups = False, interval = 0.1,
+    clus_meth = 'mmseqs easy-linclust', labels = True, midpoint = True,
+    ext = '.svg', hg_index = None, input_hgs = {}
+    ):
+    """Schedule every query's clustering/outgroup detection, fa2tree, locus
+    extraction, and tree mapping as one DAG within `cpus`, so one query's
+    tree building overlaps other queries' clustering and loci. Loci of a
+    query are extracted once its tree is built, and are skipped with its
+    tree mapping if the tree fails; tree mapping renders on the main 
+    thread. Loci of queries that need no clustering are extracted in one
+    batch by ome once their trees are built, and all locus work shares one
+    worker pool, whose processes cache annotations across queries. `hg_index` switches to 
+    homology group mode, where `genes2query` is filled with {ome: {gene: hg}}
+    as queries reach their loci"""
+
+    if fast:
+        tree_suffix = '.fa.mafft.clipkit.treefile'
+    else:
+        tree_suffix = '.fa.mafft.clipkit.contree'
+    if not clus_cpus:
+        clus_cpus = cpus
+    db = db.set_index('ome') # build the shared index before threading
+    hgs = list(input_hgs.values())
+    for dir_ in [clus_dir, clus_dir + 'working/', clus_dir + 'dmnd/',
+                 tre_dir, tre_dir + 'working/', tre_dir + 'working/conv/']:
+        if not os.path.isdir(dir_): # avoid concurrent mkdir races
+            os.mkdir(dir_)
+
+    states = {query: (list(fa.keys()), []) for query, fa in fas4trees.items()}
+    def clus_task(query, cluster, cpus = 1):
+        res = clus_mngr(
+            db, query, min_seq, max_size, clus_dir, wrk_dir, clus_cons,
+            clus_var, cluster, outgroups, interval, clus_meth, verbose, cpus
+            )
+        if res:
+            states[query] = res
+        return bool(res)
+
+    failed_trees = set()
+    def tree_task(query, cpus = 1):
+        print('\t' + str(query) + ': phylogeny reconstruction', flush = True)
+        if tree_mngr(
+            query, out_dir, wrk_dir, tre_dir, fast, tree_suffix,
+            cpus, verbose, reoutput
+            ):
+            failed_trees.add(query)
+            # a batched query's failure cannot skip the other queries' loci
+            return query in batch
+        return True
+
+    def locus_task(queries, cpus = 1):
+        query_hits = {query: states[query][0] for query in queries \
+                      if query not in failed_trees}
+        if not query_hits:
+            return True
+        if hg_index:
+            for hits in query_hits.values():
+                add_hits2ome_gene2hg(hits, genes2query, hg_index)
+        locus_mngr(
+            db, query_hits, wrk_dir, genes2query, plusminus, query2color,
+            hgs if hg_index else None, labels, pool, cpus
+            )
+        return True
+
+    def map_task(query, cpus = 1):
+        if query in failed_trees:
+            return False
+        if hg_index:
+            hg = input_hgs[re.sub(r'\.outgroup$', '', query)]
+        else:
+            hg = None
+        map_mngr(
+            db, query, tre_dir, tree_suffix, out_dir, hg, states[query][1],
+            midpoint = midpoint, ext = ext
+            )
+        return True
+
+    # weights approximate relative runtime by sequence count for critical
+    # path prioritization
+    tasks, batch = {}, []
+    for query, fa in {**fas4trees, **fas4clus}.items():
+        size, deps = len(fa), []
+        if query in fas4clus or outgroups:
+            tasks[(query, 'clus')] = {
+                'func': clus_task, 'args': [query, query in fas4clus],
+                'threads': clus_cpus, 'weight': size
+                }
+            deps = [(query, 'clus')]
+            tasks[(query, 'locus')] = {
+                'func': locus_task, 'args': [[query]], 
+                'deps': [(query, 'tree')], 'threads': cpus, 'weight': 1
+                }
+            locus = (query, 'locus')
+        else: # hits are known, batch their loci
+            batch.append(query)
+            locus = (None, 'locus')
+        tasks[(query, 'tree')] = {
+            'func': tree_task, 'args': [query], 'deps': deps,
+            'threads': cpus, 'weight': min(size, max_size)
+            }
+        tasks[(query, 'map')] = {
+            'func': map_task, 'args': [query], 'main': True,
+            'deps': [(query, 'tree'), locus], 'weight': 1
+            }
+    if batch:
+        tasks[(None, 'locus')] = {
+            'func': locus_task, 'args': [batch], 'threads': cpus,
+            'deps': [(query, 'tree') for query in batch], 'weight': len(batch)
+            }
+
+    with mp.get_context('spawn').Pool(processes = cpus) as pool:
+        return schedule_dag(tasks, cpus = cpus)
+
 
-    return query2color
-    
 def hg_main(
     db, input_genes, hg_file, fast = True, out_dir = None,
     clus_cons = 0.05, clus_var = 0.65, min_seq = 3, max_size = 250, cpus = 1,
@@ -835,9 +1051,8 @@ def hg_main(
     print('\tCompiling homologs', flush = True)
 #    og_info_dict = mycodbHGs(omes = set(db['ome']))
  #   hg2gene, gene2hg = extract_ogs(og_info_dict, ogtag)
-    ome2i, gene2hg, i2ome, hg2gene = compile_homolog_groups(hg_file, wrk_dir,
-                                                            useableOmes = set(db.keys())) 
-    input_hgs = input_genes2input_hgs(input_genes, gene2hg)
+    hg_index = load_hg_index(hg_file, wrk_dir, useableOmes = set(db.keys()))
+    input_hgs = input_genes2input_hgs(input_genes, hg_index.gene2hg)
     input_hg2gene = {v: k for k, v in input_hgs.items()} # create hashes for transitioning
 
     todel, hits = [], set()
@@ -860,8 +1075,12 @@ def hg_main(
     hg_fas = {}
     if not all(os.path.isfile(f'{faa_dir}{hg}.faa') for gene, hg in input_hgs.items()):
         print('\tPreparing homolog fastas', flush = True)
+        # only send each task the MTDB rows of its homologs' omes
+        hg2gene = {hg: hg_index.get_genes(hg) for hg in set(input_hgs.values())}
         compile_hg_fa_cmds = [
-            [db, hg2gene[hg], gene] for gene, hg in input_hgs.items() \
+            [mtdb({ome: db[ome] for ome in {x[:x.find('_')] for x in hg2gene[hg]} \
+                   if ome in db}, index = 'ome'),
+             hg2gene[hg], gene] for gene, hg in input_hgs.items() \
              if not os.path.isfile(wrk_dir + gene + '.fa')
             ]
         with mp.Pool(processes = cpus) as pool:
@@ -896,85 +1115,15 @@ def hg_main(
         print('\nRunning clustering on ' + str(len(fas4clus)) + ' fastas', flush = True)
 
     print('\nCRAP', flush = True)
-    ome_gene2hg = gene2hg2ome2hg(gene2hg)
-    if fast:
-        tree_suffix = '.fa.mafft.clipkit.treefile'
-    else:
-        tree_suffix = '.fa.mafft.clipkit.contree'
-    fas4trees = {k: v for k, v in sorted(fas4trees.items(), key = lambda x: len(x[1]))}
-    for query, query_fa in fas4trees.items():
-        out_keys = None
-        query_hits = list(query_fa.keys())
-        print('\tQuery: ' + str(query), flush = True)
-        if outgroups:
-            print('\t\tOutgroup detection', flush = True)
-            if os.path.isfile(clus_dir + query + '.fa'):
-                if not os.path.isfile(wrk_dir + query + '.outgroup.fa'):
-                    in_keys, all_keys = outgroup_mngr(
-                        db, query, min_seq, max_size, clus_dir, wrk_dir,
-                        clus_cons = clus_cons, cpus = cpus, interval = interval,
-                        verbose = False
-                        )
-                out_query = query + '.outgroup'
-                query_hits = all_keys
-                out_keys = list(set(all_keys).difference(set(in_keys)))
-                print('\t\t\t' + str(len(in_keys)) + ' gene ingroup', 
-                      flush = True)
-                if out_keys:
-                    print('\t\t\t' + str(len(out_keys)) + ' gene outgroup', 
-                          flush = True)
-            else:
-                eprint(
-                    '\t\t\tWARNING: Could not detect outgroup for root',
-                    flush = True
-                    )            
-        HG = input_hgs[re.sub(r'\.outgroup$','',query)] # bulletproof against outgroups
-        hg2color = crap_mngr(
-            db, query, query_hits, out_dir, wrk_dir, tre_dir, fast, tree_suffix, 
-            ome_gene2hg, plusminus, hg2color, cpus, verbose, HG, list(input_hgs.values()),
-            reoutput = reoutput, out_keys = out_keys, labels = labels,
-            midpoint = midpoint, ext = ext
-            )
-
-    for query in fas4clus:
-        print('\tQuery: ' + str(query), flush = True)
-        print('\t\tSequence clustering', flush = True)
-        out_keys = None
-        res, overshot, fa2clus_log = run_fa2clus(
-            clus_dir + query + '.fa', db, query, min_seq, max_size, clus_dir,
-            query, clus_cons, clus_var, cpus = cpus, verbose = verbose, 
-            interval = interval, algorithm = clus_meth
-            )
-        if not res:
-            print('\t\t\tERROR: query had no significant hits',
-                  flush = True)
-            continue
-        if outgroups and not overshot:
-            print('\t\tOutgroup detection', flush = True)
-            if not os.path.isfile(wrk_dir + query + '.outgroup.fa'):
-                in_keys, all_keys = outgroup_mngr(
-                    db, query, min_seq, max_size, clus_dir, wrk_dir,
-                    clus_cons = clus_cons, cpus = cpus,
-                    interval = interval, verbose = False
-                    )
-            out_query = query + '.outgroup'
-            query_hits = all_keys
-            out_keys = list(set(all_keys).difference(in_keys))
-            print('\t\t\t' + str(len(in_keys)) + ' gene ingroup', 
-                  flush = True)
-            if out_keys:
-                print('\t\t\t' + str(len(out_keys)) + ' gene outgroup', 
-                      flush = True)
-        else:
-            query_fa = fa2dict(wrk_dir + query + '.fa')
-            query_hits = list(query_fa.keys())
-        HG = input_hgs[re.sub(r'\.outgroup$','',query)] # bulletproof against outgroups
-        hg2color = crap_mngr(
-            db, query, query_hits, out_dir, wrk_dir, tre_dir, fast, tree_suffix,
-            ome_gene2hg, plusminus, hg2color, cpus, verbose, HG, 
-            list(input_hgs.values()), reoutput = reoutput, labels = labels,
-            out_keys = out_keys, midpoint = midpoint, ext = ext
-            )
+    ome_gene2hg = {} # populated from the HG index for omes with hits
+    crap_dag(
+        db, fas4trees, fas4clus, out_dir, wrk_dir, tre_dir, clus_dir, fast,
+        ome_gene2hg, plusminus, hg2color, min_seq, max_size, clus_cons,
+        clus_var, cpus = cpus, verbose = verbose, reoutput = reoutput,
+        outgroups = outgroups, interval = interval, clus_meth = clus_meth,
+        labels = labels, midpoint = midpoint, ext = ext, 
+        hg_index = hg_index, input_hgs = input_hgs
+        )
 
 
 def search_main(
@@ -1084,94 +1233,14 @@ def search_main(
         print('\tRunning clustering on ' + str(len(fas4clus)) + ' fastas', flush = True)
 
     print('\nCRAP', flush = True)
-    if fast:
-        tree_suffix = '.fa.mafft.clipkit.treefile'
-    else:
-        tree_suffix = '.fa.mafft.clipkit.contree'
-    fas4trees = {k: v for k, v in sorted(fas4trees.items(), key = lambda x: len(x[1]))}
-    for query, query_fa in fas4trees.items():
-        out_keys = None
-        query_hits = list(query_fa.keys())
-        print('\tQuery: ' + str(query), flush = True)
-        if outgroups:
-            print('\t\tOutgroup detection', flush = True)
-            if os.path.isfile(clus_dir + query + '.fa'):
-                if not os.path.isfile(wrk_dir + query + '.outgroup.fa'):
-                    in_keys, all_keys = outgroup_mngr(
-                        db, query, min_seq, max_size, clus_dir, wrk_dir,
-                        clus_cons = clus_cons, cpus = cpus, 
-                        interval = interval, verbose = False
-                        )
-                out_query = query + '.outgroup'
-                query_hits = all_keys
-                out_keys = list(set(all_keys).difference(set(in_keys)))
-                print('\t\t\t' + str(len(in_keys)) + ' gene ingroup', 
-                      flush = True)
-                if out_keys:
-                    print('\t\t\t' + str(len(out_keys)) + ' gene outgroup', 
-                          flush = True)
-            else:
-                eprint(
-                    '\t\t\tWARNING: could not detect outgroup for root', 
-                    flush = True
-                    )
-        crap_mngr(
-            db, query, query_hits, out_dir, wrk_dir, tre_dir, 
-            fast, tree_suffix, genes2query, plusminus, query2color, 
-            cpus = cpus, verbose = verbose, reoutput = reoutput,
-            out_keys = out_keys, labels = labels, midpoint = midpoint,
-            ext = ext
-            )
-
-    if fas4clus:
-        if cpus > 5:
-            clus_cpus = 5
-        else:
-            clus_cpus = cpus
-
-    for query in fas4clus:
-        print('\tQuery: ' + str(query), flush = True)
-        print('\t\tSequence clustering', flush = True)
-        out_keys = None
-        query_hits = list(query_fa.keys())
-
-        res, overshot, fa2clus_log = run_fa2clus(
-            clus_dir + str(query) + '.fa', 
-            db, query, min_seq, max_size, 
-            clus_dir, query, clus_cons, clus_var, cpus = clus_cpus, 
-            verbose = verbose, interval = interval, algorithm = clus_meth,
-            )
-        if not res:
-             print('\t\t\tFAILED: query had no significant hits',
-                  flush = True)
-             continue
-
-        if outgroups and not overshot:
-            print('\t\tOutgroup detection', flush = True)
-            if not os.path.isfile(wrk_dir + query + '.outgroup.fa'):
-            # WILL RAISE AN ERROR IF THIS EXISTS BECAUSE ALL_KEYS DOESNT
-                in_keys, all_keys = outgroup_mngr(
-                    db, query, min_seq, max_size, clus_dir, wrk_dir,
-                    clus_cons = clus_cons, cpus = cpus, 
-                    interval = interval, verbose = False
-                    )
-            query_hits = all_keys
-            out_query = query + '.outgroup'
-            out_keys = list(set(all_keys).difference(set(in_keys)))
-            print('\t\t\t' + str(len(in_keys)) + ' gene ingroup', 
-                  flush = True)
-            if out_keys:
-                print('\t\t\t' + str(len(out_keys)) + ' gene outgroup', 
-                          flush = True)
-        else:
-            query_fa = fa2dict(wrk_dir + query + '.fa')
-        crap_mngr(
-            db, query, query_hits, out_dir, wrk_dir, tre_dir, 
-            fast, tree_suffix, genes2query, plusminus, query2color, 
-            cpus = cpus, verbose = verbose, reoutput = reoutput,
-            out_keys = out_keys, labels = labels, midpoint = midpoint,
-            ext = ext
-            )
+    crap_dag(
+        db, fas4trees, fas4clus, out_dir, wrk_dir, tre_dir, clus_dir, fast,
+        genes2query, plusminus, query2color, min_seq, max_size, clus_cons,
+        clus_var, clus_cpus = min(cpus, 5), cpus = cpus, verbose = verbose,
+        reoutput = reoutput, outgroups = outgroups, interval = interval,
+        clus_meth = clus_meth, labels = labels, midpoint = midpoint,
+        ext = ext
+        )
 
 
 def cli():
@@ -4,18 +4,21 @@ import os
 import sys
 import shutil
 import argparse
+import hashlib
+import tempfile
 import subprocess
 import numpy as np
+from scipy import sparse
 import multiprocessing as mp
 from tqdm import tqdm
-from itertools import combinations
 from collections import defaultdict, Counter
+from collections.abc import Mapping
 from mycotools.db2files import soft_main as symlink_files
 from mycotools.lib.kontools import format_path, mkOutput, \
                                    findExecs, intro, outro, \
-                                   eprint
+                                   eprint, checksum, read_json, write_json
 from mycotools.lib.dbtools import mtdb, primaryDB
-from mycotools.lib.biotools import gff2list
+from mycotools.lib.biotools import load_annotation_cache
 
 
 def run_mmseqs(db, wrk_dir, algorithm = 'mmseqs easy-cluster', 
@@ -123,153 +126,394 @@ def parse_1to1(hg_file, useableOmes = set()):
     return ome_num, gene2hg, i2ome, hg2gene
 
 
-def compile_homolog_groups(hg_file, wrk_dir = None,
-                           useableOmes = set()):
+class HGIndex():
+    """
+    Memory-mapped binary index of a homology group file for a set of omes,
+    stored as .npy arrays in `idx_dir`:
+    gene2hg.genes/gene2hg.hgs - sorted genes and their HG codes (Gene2HG);
+    hg_ids/hg_offsets/hg_members - HGs in file order with the gene codes
+    of each HG at hg_members[hg_offsets[i]:hg_offsets[i+1]];
+    omes/ome_starts/ome_ends - i2ome and each ome's sorted gene range.
+    meta.json records the homology group file's size, modification time, and
+    checksum for validation
+    """
+
+    def __init__(self, idx_dir):
+        self.idx_dir = idx_dir
+        self.gene2hg = Gene2HG.open(idx_dir + 'gene2hg')
+        self.genes, self.hgs = self.gene2hg.genes, self.gene2hg.hgs
+        for arr in ['hg_ids', 'hg_offsets', 'hg_members', 'omes', 
+                    'ome_starts', 'ome_ends']:
+            setattr(self, arr, 
+                    np.load(idx_dir + arr + '.npy', mmap_mode = 'r'))
+        self.hg2i = None
+        self.format = read_json(idx_dir + 'meta.json').get('format')
+
+    @classmethod
+    def write(cls, idx_dir, hg_info, hg_checksum, hg_stat, 
+              hg_format = 'orthofinder'):
+        ome_num, gene2hg, i2ome, hg2gene = hg_info
+        if not os.path.isdir(idx_dir):
+            os.makedirs(idx_dir)
+        Gene2HG.write(gene2hg, idx_dir + 'gene2hg')
+        genes = np.load(idx_dir + 'gene2hg.genes.npy', mmap_mode = 'r')
+
+        gene2code = {x: i for i, x in enumerate(sorted(gene2hg.keys()))}
+        hg_offsets, members = [0], []
+        for genes_list in hg2gene.values():
+            members.extend([gene2code[x] for x in genes_list])
+            hg_offsets.append(len(members))
+        np.save(idx_dir + 'hg_ids.npy', 
+                np.array(list(hg2gene.keys()), dtype = np.int64))
+        np.save(idx_dir + 'hg_offsets.npy', np.array(hg_offsets, dtype = np.int64))
+        np.save(idx_dir + 'hg_members.npy', np.array(members, dtype = np.int64))
+
+        # genes of an ome are contiguous in the sorted gene array
+        ome_arr = np.array([x.encode() for x in i2ome], dtype = bytes)
+        np.save(idx_dir + 'omes.npy', ome_arr)
+        np.save(idx_dir + 'ome_starts.npy', np.searchsorted(
+            genes, np.array([x.encode() + b'_' for x in i2ome], dtype = bytes)
+            ).astype(np.int64))
+        np.save(idx_dir + 'ome_ends.npy', np.searchsorted(
+            genes, np.array([x.encode() + b'`' for x in i2ome], dtype = bytes)
+            ).astype(np.int64))
+        write_json({'checksum': hg_checksum, 'size': hg_stat.st_size,
+                    'mtime': hg_stat.st_mtime, 'format': hg_format,
+                    'genes': len(gene2hg),
+                    'hgs': len(hg2gene), 'omes': len(i2ome)},
+                   idx_dir + 'meta.json')
+        return cls(idx_dir)
+
+    @classmethod
+    def open(cls, idx_dir, hg_stat, hg_checksum):
+        """Open the index if it was built from a file of `hg_stat`'s size
+        and modification time. If only the modification time changed, the
+        checksum is compared via `hg_checksum()` and the time is updated"""
+        try:
+            meta = read_json(idx_dir + 'meta.json')
+            if meta['size'] != hg_stat.st_size:
+                return None
+            elif meta['mtime'] != hg_stat.st_mtime:
+                if meta['checksum'] != hg_checksum():
+                    return None
+                meta['mtime'] = hg_stat.st_mtime
+                try:
+                    write_json(meta, idx_dir + 'meta.json')
+                except OSError: # unwritable directory
+                    pass
+            return cls(idx_dir)
+        except (FileNotFoundError, KeyError, ValueError):
+            pass
+        return None
+
+    def get_hg(self, gene, default = None):
+        """gene -> HG"""
+        return self.gene2hg.get(gene, default)
+
+    def get_genes(self, hg):
+        """HG -> [genes]"""
+        if self.hg2i is None:
+            self.hg2i = {x: i for i, x in enumerate(self.hg_ids.tolist())}
+        i = self.hg2i[hg]
+        codes = self.hg_members[self.hg_offsets[i]:self.hg_offsets[i+1]]
+        return [x.decode() for x in self.genes[codes].tolist()]
+
+    def ome_gene2hg(self, ome):
+        """{gene: HG} of an ome's genes"""
+        i = self.omes.tolist().index(ome.encode())
+        start, end = self.ome_starts[i], self.ome_ends[i]
+        return {x.decode(): y for x, y in zip(self.genes[start:end].tolist(),
+                                              self.hgs[start:end].tolist())}
+
+    def to_dicts(self):
+        """compile_homolog_groups() output: 
+        ome_num = {ome: number}, gene2hg = {gene: HG}, i2ome = [omes],
+        hg2gene = {HG: [genes]}"""
+        genes = [x.decode() for x in self.genes.tolist()]
+        i2ome = [x.decode() for x in self.omes.tolist()]
+        ome_num = {ome: i for i, ome in enumerate(i2ome)}
+        members, offsets = self.hg_members.tolist(), self.hg_offsets.tolist()
+        # genes are ordered as parsed: by HG, then within each HG
+        hgs = self.hgs.tolist()
+        gene2hg = {genes[x]: hgs[x] for x in members}
+        hg2gene = {hg: [genes[x] for x in members[offsets[i]:offsets[i+1]]] \
+                   for i, hg in enumerate(self.hg_ids.tolist())}
+        return ome_num, gene2hg, i2ome, hg2gene
+
+
+def write_homolog_groups(hg2gene, out_path):
+    with open(out_path, 'w') as out:
+        for hg, genes in hg2gene.items():
+            out.write(str(hg) + '\t' + ' '.join(genes) + '\n')
+
+
+def parse_homolog_groups(hg_file, wrk_dir = None, useableOmes = set()):
+    """Parse OrthoFinder or "gene\thg" input, the latter is rewritten as
+    homolog_groups.tsv in `wrk_dir`. Returns hg_info, format"""
     try:
-        hg_info = parse_orthofinder(hg_file, useableOmes)
+        return parse_orthofinder(hg_file, useableOmes), 'orthofinder'
     except ValueError:
         hg_info = parse_1to1(hg_file, useableOmes)
-        hg2genes = hg_info[-1]
-        with open(wrk_dir + 'homolog_groups.tsv', 'w') as out:
-            for hg, genes in hg2genes.items():
-                out.write(str(hg) + '\t' + ' '.join(genes) + '\n')
+        write_homolog_groups(hg_info[-1], wrk_dir + 'homolog_groups.tsv')
+        return hg_info, '1to1'
+
+
+def load_hg_index(hg_file, wrk_dir = None, useableOmes = set()):
+    """Open the HGIndex of `hg_file` for `useableOmes`, parsing the file
+    and building the index if it is absent or the file's checksum changed.
+    Indices are stored in `hg_file`.hgidx/, or in `wrk_dir` if that is not
+    writable. The file is only checksummed if its modification time changed
+    without its size, or to record a new index"""
+
+    hg_stat, checksums = os.stat(hg_file), {}
+    def hg_checksum():
+        if 'md5' not in checksums:
+            checksums['md5'] = checksum(hg_file, 'md5')
+        return checksums['md5']
+
+    omes_hash = hashlib.md5(
+        ' '.join(sorted(useableOmes)).encode()
+        ).hexdigest()
+    idx_dirs = [hg_file + '.hgidx/' + omes_hash + '/']
+    if wrk_dir:
+        idx_dirs.append(wrk_dir + os.path.basename(hg_file) + '.hgidx/' \
+                      + omes_hash + '/')
+    for idx_dir in idx_dirs:
+        hg_index = HGIndex.open(idx_dir, hg_stat, hg_checksum)
+        if hg_index:
+            # 1to1 input is expected to be rewritten in the working directory
+            if hg_index.format == '1to1' and wrk_dir \
+                and not os.path.isfile(wrk_dir + 'homolog_groups.tsv'):
+                write_homolog_groups(hg_index.to_dicts()[-1], 
+                                     wrk_dir + 'homolog_groups.tsv')
+            return hg_index
+
+    hg_info, hg_format = parse_homolog_groups(hg_file, wrk_dir, useableOmes)
+    if wrk_dir and os.path.abspath(hg_file) \
+        == os.path.abspath(wrk_dir + 'homolog_groups.tsv'):
+        hg_stat = os.stat(hg_file) # rewritten in place
+        checksums.clear()
+    for idx_dir in idx_dirs:
+        try:
+            return HGIndex.write(idx_dir, hg_info, hg_checksum(), hg_stat,
+                                 hg_format)
+        except OSError: # unwritable directory
+            continue
+    raise OSError('could not write homology group index for ' + hg_file)
+
+
+def compile_homolog_groups(hg_file, wrk_dir = None,
+                           useableOmes = set()):
+    return load_hg_index(hg_file, wrk_dir, useableOmes).to_dicts()
 
-    return hg_info
 
+_gene2hg_cache = {} # Gene2HGs opened by this process
 
-def compile_cds(gff_list, ome, gene2hg):
+
+class Gene2HG(Mapping):
+    """
+    Read-only gene -> HG mapping backed by a sorted accession array and a
+    parallel HG code array in memory-mapped .npy files (`prefix`.genes.npy,
+    `prefix`.hgs.npy). Pickles as its prefix, so pool workers open the
+    arrays once instead of receiving the gene2hg dict with every task
+    """
+
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self.genes = np.load(prefix + '.genes.npy', mmap_mode = 'r')
+        self.hgs = np.load(prefix + '.hgs.npy', mmap_mode = 'r')
+
+    @classmethod
+    def write(cls, gene2hg, prefix):
+        genes = sorted(gene2hg.keys())
+        np.save(prefix + '.genes.npy', 
+                np.array([x.encode() for x in genes], dtype = bytes))
+        np.save(prefix + '.hgs.npy',
+                np.array([gene2hg[x] for x in genes], dtype = np.int64))
+        return cls.open(prefix)
+
+    @classmethod
+    def open(cls, prefix):
+        if prefix not in _gene2hg_cache:
+            _gene2hg_cache[prefix] = cls(prefix)
+        return _gene2hg_cache[prefix]
+
+    def __reduce__(self):
+        return (Gene2HG.open, (self.prefix,))
+
+    def __getitem__(self, gene):
+        q = gene.encode()
+        i = np.searchsorted(self.genes, q)
+        if i < len(self.genes) and self.genes[i] == q:
+            return int(self.hgs[i])
+        raise KeyError(gene)
+
+    def __iter__(self):
+        return (x.decode() for x in self.genes)
+
+    def __len__(self):
+        return len(self.genes)
+
+    def codes(self, genes, default = -1):
+        """Vectorized lookup of a list of genes, `default` if absent"""
+        if not len(genes) or not len(self.genes):
+            return np.full(len(genes), default, dtype = np.int64)
+        q = np.array([x.encode() for x in genes], dtype = bytes)
+        i = np.searchsorted(self.genes, q)
+        i[i == len(self.genes)] = 0
+        found = self.genes[i] == q
+        return np.where(found, self.hgs[i], default).astype(np.int64)
+
+
+def hg_codes(gene2hg, genes):
+    """HG code array of `genes` (-1 = no HG) from a dict or Gene2HG"""
+    if isinstance(gene2hg, Gene2HG):
+        return gene2hg.codes(genes)
+    return np.array([gene2hg.get(x, -1) for x in genes], dtype = np.int64)
+
+
+def encode_pairs(hg_a, hg_b):
+    """Encode HG pairs as 64-bit integers: hg_a << 32 | hg_b"""
+    return (np.asarray(hg_a, dtype = np.int64) << 32) \
+         | np.asarray(hg_b, dtype = np.int64)
+
+
+def decode_pairs(pairs):
+    """Decode 64-bit HG pairs into hg_a and hg_b arrays"""
+    pairs = np.asarray(pairs, dtype = np.int64)
+    return pairs >> 32, pairs & 0xFFFFFFFF
+
+
+def compile_cds(ann_cache, gene2hg):
     """ 
-    Inputs the gff_list and organism ome code. Compiles CDS entries for loci parsing and outputs:
-    cds_dict = {contig: {protein: [[CDSstart, CDSstop]] } }
-    Sorts the cds_dict for each protein from smallest to largest
+    Inputs the ome's AnnotationCache. Compiles CDS entries for loci
+    parsing and outputs:
+    hg_dict = {contig: [HG0, HG1, None, ...]}
+    ordering the proteins of each contig from smallest to largest coordinate
     """
 
-    cds_dict, fail = defaultdict(dict), False
-    for entry in gff_list:
-        if entry['type'] == 'CDS':
-            prot_prep_i0 = entry['attributes'].index(';Alias=') # grab the
-            # mycotools accession index
-            try: # grab the end of the Alias by grabbing the index for a ';',
-            # that is after the accession tag's occurrence.
-            # then add that to the start of the accession tag and add one to
-            # remove that semicolon. If there is a value error, the accession 
-            # is at the end of the attributes (gff col 8 (?))
-                prot_prep_i1 = entry['attributes'][prot_prep_i0+1:].index(';') + prot_prep_i0+1
-            except ValueError:
-                prot_prep_i1 = len(entry['attributes'])
-            prot = entry['attributes'][prot_prep_i0:prot_prep_i1].replace(';Alias=','')
-            # obtain the protein accession
-            if prot not in cds_dict[entry['seqid']] and prot: # add the protein
-            # to the cds_dict entry
-                cds_dict[entry['seqid']][prot] = []
-            elif not prot: # if there isn't a valid accession it may mean the
-            # mycotools curation did not work or the user did not curate
-            # correctly 
-                print(entry['attributes'], prot_prep_i0, prot_prep_i1)
-                if not fail:
-                    print('\tWARNING: ' + ome + ' has proteins in gff with no Alias', flush = True)
-                fail = True
-                continue
-            cds_dict[entry['seqid']][prot].extend([int(entry['start']),
-                int(entry['end'])]) # add the coordinates
-
-    hg_dict = {}
-    for contig in cds_dict:
-        for prot in cds_dict[contig]:
-            cds_dict[contig][prot].sort() # sort the coordinates of the proteins
-            # lowest to highest
-        cds_dict[contig] = list(sorted(cds_dict[contig].keys(), key = lambda k:
-            cds_dict[contig][k][0])) # sort the proteins in the contigs lowest
-            # to highest coordinates
-        hg_dict[contig] = []
-        for prot in cds_dict[contig]:
-            try:
-                hg_dict[contig].append(gene2hg[prot])
-            except KeyError:
-                hg_dict[contig].append(None)
+    return {contig: [gene2hg.get(x) for x in genes] \
+            for contig, genes in ann_cache.contig_genes().items()}
+
+
+def window_pairs(hg_arrs, window):
+    """
+    Inputs a list of per-contig HG code arrays (-1 = no HG) ordered by
+    coordinate. Outputs the sorted, unique encoded pairs of distinct HGs
+    that share a sliding window, i.e. are at most `window` genes apart on a
+    contig with at least `window` genes
+    """
+
+    hg_arrs = [x for x in hg_arrs if len(x) >= window]
+    if not hg_arrs:
+        return np.array([], dtype = np.int64)
+    # pad contigs with null HGs so no offset pairs genes across contigs
+    pad = np.full(window, -1, dtype = np.int64)
+    hgs = np.concatenate([y for x in hg_arrs for y in (x, pad)])
+
+    pairs = []
+    for offset in range(1, window + 1):
+        hg_a, hg_b = hgs[:-offset], hgs[offset:]
+        valid = (hg_a > -1) & (hg_b > -1) & (hg_a != hg_b)
+        hg_a, hg_b = hg_a[valid], hg_b[valid]
+        pairs.append(np.unique(
+            encode_pairs(np.minimum(hg_a, hg_b), np.maximum(hg_a, hg_b))
+            ))
 
-    return hg_dict
+    return np.unique(np.concatenate(pairs))
 
 
 def parse_loci(
     gff_path, ome, gene2hg, window = 6
     ):
-    """obtain a set of tuples of HG pairs {(OG0, OG1)...}"""
+    """obtain a sorted array of unique encoded HG pairs (see encode_pairs)"""
 
-    gff_list = gff2list(gff_path) # open here to improve pickling
-    hg_dict = compile_cds(gff_list, os.path.basename(gff_path).replace('.gff3',''),
-                          gene2hg)
-    pairs = []
-    for scaf, hgs in hg_dict.items(): # for each contig
-        windows = [sorted(set([x for x in hgs[i:i+window+1] \
-                               if x is not None])) \
-                   for i in range(len(hgs) - window + 1)]
-        for w in windows:
-            pairs.extend([x for x in combinations(w, 2)])
-
-    out_pairs = set(pairs) # unique pairs of OGs
-    return ome, out_pairs
+    ann_cache = load_annotation_cache(gff_path) # open here to improve pickling
+    hg_arrs = [hg_codes(gene2hg, genes) \
+               for genes in ann_cache.contig_genes().values()]
+    return ome, window_pairs(hg_arrs, window)
 
 
 def compile_loci(
     db, ome2i, gene2hg, window, cpus = 1
     ):
 
-    loci_hash_cmds = [
-        [v['gff3'], ome,
-        gene2hg, window]
-        for ome, v in db.items() \
-        if ome in ome2i
-        ]
-    with mp.get_context('fork').Pool(processes = cpus) as pool:
-        loci_hashes = pool.starmap(parse_loci, tqdm(loci_hash_cmds, total = len(ome2i)))
-    pool.join()
-    pairs = {}
-    pairs = {x[0]: x[1] for x in loci_hashes if x[1]}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # workers open the memory-mapped lookup once rather than unpickling
+        # gene2hg for every task
+        tmp_g2h = not isinstance(gene2hg, Gene2HG)
+        if tmp_g2h:
+            gene2hg = Gene2HG.write(gene2hg, tmp_dir + '/gene2hg')
+        loci_hash_cmds = [
+            [v['gff3'], ome,
+            gene2hg, window]
+            for ome, v in db.items() \
+            if ome in ome2i
+            ]
+        with mp.get_context('fork').Pool(processes = cpus) as pool:
+            loci_hashes = pool.starmap(parse_loci, tqdm(loci_hash_cmds, total = len(ome2i)))
+        pool.join()
+        if tmp_g2h:
+            _gene2hg_cache.pop(gene2hg.prefix, None)
+    pairs = {x[0]: x[1] for x in loci_hashes if len(x[1])}
 
     return pairs
 
 
-def form_cooccur_array(cooccur_dict, ome2i):
-
-    count, hgx2i, size_dict, cooccur_arrays, i2hgx = 0, {}, {}, {}, {}
-    cooccur_dict = {k: tuple(sorted(v)) for k, v in sorted(cooccur_dict.items(), key = lambda x: len(x[0]))}
-    cooccur_arrays = np.zeros([len(ome2i), len(cooccur_dict)], dtype = np.int32)
-
-    old_len = len(list(cooccur_dict.keys())[0])
-    for i, hgx in enumerate(list(cooccur_dict.keys())):
-        i2hgx[i] = hgx
-        hgx2i[hgx] = i
-        for ome in cooccur_dict[hgx]:
-#            cooccur_arrays[ome, i] = hgx_dict[ome][hgx]
-            cooccur_arrays[ome2i[ome], i] = 1
+def form_cooccur_array(ome_arr, pair_arr, n_omes, min_omes):
+    """
+    Inputs parallel arrays of ome indices and encoded HG pairs. Counts the
+    omes with each pair and outputs a sparse CSC presence matrix (omes x
+    pairs) of the pairs in more than `min_omes` omes, the encoded pair of
+    each column, and the number of omes per column
+    """
 
-    return i2hgx, hgx2i, cooccur_dict, cooccur_arrays
+    hgpairs, inverse, counts = np.unique(
+        pair_arr, return_inverse = True, return_counts = True
+        )
+    keep = counts > min_omes
+    pair2col = np.full(len(hgpairs), -1, dtype = np.int64)
+    pair2col[keep] = np.arange(np.count_nonzero(keep))
+    cols = pair2col[inverse]
+    present = cols > -1
+
+    cooccur_array = sparse.csc_matrix(
+        (np.ones(np.count_nonzero(present), dtype = np.uint8),
+        (ome_arr[present], cols[present])),
+        shape = (n_omes, np.count_nonzero(keep))
+        )
+    cooccur_array.sort_indices()
 
+    return cooccur_array, hgpairs[keep], counts[keep]
 
 
 def form_cooccur_structures(pairs, min_omes, ome2i, cc_arr_path = None):
     """
-    Imports the out_dicts from parse_loci and creates index vectors that bear
-    the ome_num's with a given  cooccurence. e.g. cooccur_dict[(og1, og2)] = [1, 2, 3]
+    Imports the encoded HG pair arrays from parse_loci and creates a sparse
+    presence matrix of the pairs found in more than `min_omes` omes.
+    Outputs the matrix (omes x pairs), the encoded pair of each column, and
+    the number of omes with each pair
     """
 
-    cooccur_dict = defaultdict(list)
-    for ome in pairs:
-        for key in pairs[ome]:
-            new_key = tuple(sorted(key))
-            cooccur_dict[new_key].append(ome)
+    omes = [ome for ome in pairs if ome in ome2i]
+    if omes:
+        pair_arr = np.concatenate([pairs[ome] for ome in omes])
+        ome_arr = np.repeat(
+            np.array([ome2i[ome] for ome in omes], dtype = np.int64),
+            [len(pairs[ome]) for ome in omes]
+            )
+    else:
+        pair_arr = ome_arr = np.array([], dtype = np.int64)
+
+    return form_cooccur_array(ome_arr, pair_arr, len(ome2i), min_omes)
 
-    cooccur_dict = {
-        x: tuple(cooccur_dict[x]) for x in cooccur_dict \
-        if len(cooccur_dict[x]) > min_omes
-        }
-            
-    i2hgpair, hgpair2i, cooccur_dict, cooccur_array = form_cooccur_array(
-        cooccur_dict, ome2i
-        )   
-            
-    return cooccur_array, dict(cooccur_dict), hgpair2i, i2hgpair
+
+def cooccur_array2dict(cooccur_array, hgpairs):
+    """{(hg_a, hg_b): (ome_i0, ome_i1, ...)} from the sparse presence matrix"""
+    indptr, indices = cooccur_array.indptr, cooccur_array.indices
+    hg_as, hg_bs = decode_pairs(hgpairs)
+    return {(hg_a, hg_b): tuple(indices[indptr[i]:indptr[i+1]].tolist()) \
+            for i, (hg_a, hg_b) in enumerate(zip(hg_as.tolist(), hg_bs.tolist()))}
 
 
 def id_near_schgs(hg2gene, omes, max_hgs = 10000, max_median = 2, max_mean = 2):
@@ -302,33 +546,38 @@ def id_near_schgs(hg2gene, omes, max_hgs = 10000, max_median = 2, max_mean = 2):
     return near_schgs
 
 
-def extract_nschg_pairs(nschgs, hgpair2i, m_arr):
-    nschg_set = set(nschgs)
-    nschg_pairs = [i for hgpair, i in hgpair2i.items() \
-                   if any(x in nschg_set for x in hgpair)]
-    nschgs_arr = np.array(nschg_pairs)
-    valid_arr = m_arr[:, nschgs_arr]
-    return valid_arr
+def extract_nschg_pairs(nschgs, hgpairs, m_arr):
+    """Subset the presence matrix to the columns of pairs with a near single
+    copy HG"""
+    hg_as, hg_bs = decode_pairs(hgpairs)
+    nschgs_arr = np.array(list(nschgs), dtype = np.int64)
+    valid_cols = np.nonzero(
+        np.isin(hg_as, nschgs_arr) | np.isin(hg_bs, nschgs_arr)
+        )[0]
+    return m_arr[:, valid_cols]
 
 
-def align_microsynt_np(m_arr, i2ome, hg2gene, hgpair2i, wrk_dir, nschgs = None):
+def align_microsynt_np(m_arr, i2ome, hg2gene, hgpairs, wrk_dir, nschgs = None):
     if not nschgs:
         nschgs = id_near_schgs(hg2gene, set(i2ome), max_hgs = 100,
                            max_median = 4, max_mean = 3)
-    trm_arr = extract_nschg_pairs(nschgs, hgpair2i, m_arr)
+    trm_arr = extract_nschg_pairs(nschgs, hgpairs, m_arr).tocsr()
+    # stream the binary alignment one ome row at a time
+    row = np.empty(trm_arr.shape[1], dtype = np.uint8)
     with open(wrk_dir + 'microsynt.align.phy', 'w') as out:
         out.write(f'{trm_arr.shape[0]} {trm_arr.shape[1]}\n')
-        [out.write(f'{i2ome[i]} {"".join([str(x) for x in trm_arr[i]])}\n') \
-                   for i in range(trm_arr.shape[0])]
+        for i in range(trm_arr.shape[0]):
+            row.fill(ord('0'))
+            row[trm_arr.indices[trm_arr.indptr[i]:trm_arr.indptr[i+1]]] = ord('1')
+            out.write(f'{i2ome[i]} {row.tobytes().decode()}\n')
     return wrk_dir + 'microsynt.align.phy'
 
 
 def remove_nulls(cc_arr):
-    sum_arr = np.sum(cc_arr, axis = 1) # sum all ome rows
-    null_i_list = list(np.where(sum_arr == 0)[0])
+    """Remove omes (rows) without any pairs from the sparse matrix"""
+    null_i_list = list(np.where(cc_arr.getnnz(axis = 1) == 0)[0])
     del_list = sorted(null_i_list, reverse = True)
-    for i in sorted(null_i_list, reverse = True):
-        cc_arr = np.delete(cc_arr, i, axis = 0)
+    cc_arr = cc_arr[np.nonzero(cc_arr.getnnz(axis = 1))[0], :]
     return cc_arr, del_list
 
 
@@ -440,13 +689,12 @@ def main(db, hg_file, out_dir, wrk_dir, algorithm,
     
     seed_len = sum([len(ome2pairs[x]) for x in ome2pairs])
     print('\t\t' + str(seed_len) + ' initial HG-pairs', flush = True)
-    cooccur_array, cooccur_dict, hgpair2i, i2hgpair = \
+    cooccur_array, hgpairs, ome_counts = \
         form_cooccur_structures(ome2pairs, 2, ome2i, cc_arr_path)
-    max_omes = max([len(cooccur_dict[x]) for x in cooccur_dict])
+    max_omes = ome_counts.max()
     print('\t\t' + str(max_omes) + ' maximum organisms with HG-pair', flush = True)
-    cooccur_array[cooccur_array > 0] = 1
-    cooccur_array.astype(np.uint8)
-    print('\t\t' + str(sys.getsizeof(cooccur_array)/1000000) + ' MB', flush = True)
+    print('\t\t' + str((cooccur_array.data.nbytes + cooccur_array.indices.nbytes \
+                      + cooccur_array.indptr.nbytes)/1000000) + ' MB', flush = True)
     cooccur_array, del_omes = remove_nulls(cooccur_array)
     for i in del_omes:
         print(f'\t\t\t{i2ome[i]} removed for lacking overlap')
@@ -457,8 +705,6 @@ def main(db, hg_file, out_dir, wrk_dir, algorithm,
         out.write(
             '\n'.join([k + '\t' + str(v) for k, v in ome2i.items()])
             )
-    cooccur_dict = {k: tuple(sorted([ome2i[x] for x in v])) \
-                    for k, v in cooccur_dict.items()}
     if return_post_compile:
         return ome2i, gene2hg, i2ome, hg2gene, None, None
 
@@ -468,6 +714,7 @@ def main(db, hg_file, out_dir, wrk_dir, algorithm,
 #    elif not os.path.isfile(tree_path):
  #       cooccur_array = np.load(cc_arr_path + '.npy')
 
+    # ome2pairs = {ome_i: encoded HG pair array}, decode with decode_pairs()
     ome2pairs = {ome2i[ome]: v for ome, v in ome2pairs.items() \
                  if ome in ome2i}
     microsynt_dict = {}
@@ -486,12 +733,15 @@ def main(db, hg_file, out_dir, wrk_dir, algorithm,
         # create microsynteny distance matrix and make tree
         print('\tPreparing microsynteny alignment', flush = True)
         align_file = align_microsynt_np(cooccur_array, i2ome, hg2gene,
-                                        hgpair2i, wrk_dir, nschgs)
+                                        hgpairs, wrk_dir, nschgs)
         print('\tBuilding microsynteny tree', flush = True)
         run_tree(align_file, wrk_dir, constraint = constraint, iqtree = 'iqtree',
                  model = 'GTR2+FO+ASC+R5', verbose = False, cpus = cpus)
         # too bulky to justify keeping
-        os.remove(cc_arr_path + '.npy')
+        if os.path.isfile(cc_arr_path + '.npy'):
+            os.remove(cc_arr_path + '.npy')
+
+    cooccur_dict = cooccur_array2dict(cooccur_array, hgpairs)
 
     return ome2i, gene2hg, i2ome, hg2gene, ome2pairs, cooccur_dict
 
@@ -15,109 +15,245 @@
 import os
 import re
 import sys
+import json
 import copy
+import shutil
+import hashlib
+import tempfile
 import datetime
 import argparse
 import subprocess
+import numpy as np
+import pandas as pd
 import multiprocessing as mp
 from io import StringIO
 from collections import defaultdict
+from contextlib import contextmanager
 from mycotools.db2files import soft_main as db2files
-from mycotools.lib.kontools import intro, outro, collect_files, multisub, \
-    findExecs, untardir, eprint, format_path, mkOutput, tardir, inject_args, stdin2str
+from mycotools.lib.kontools import intro, outro, collect_files, multisub, schedule_subs, \
+    findExecs, untardir, eprint, format_path, mkOutput, tardir, inject_args, stdin2str, \
+    checksum, read_json, write_json, file_lock
 from mycotools.lib.dbtools import primaryDB, mtdb
 from mycotools.lib.biotools import dict2fa, fa2dict
 #from mycotools.extractHmmsearch import main as exHmm
-from mycotools.acc2fa import dbmain as acc2fa_db, famain as acc2fa_fa
-from mycotools.utils.extractHmmsearch import main as exHmm
+from mycotools.acc2fa import bulk_acc2fa
+from mycotools.utils.extractHmmsearch import parse_domtblout
 from mycotools.utils.extractHmmAcc import grabAccs, main as absHmm
 
 
-def compile_hmm_cmd(db, hmm_path, output, ome_set = set(), cpu = 1):
+def compile_hmm_cmd(db, hmm_path, output, ome_set = set(), cpu = 1,
+                    report = False):
     """
-    Inputs: mycotools db, hmm_path, output directory, set of omes to ignore.
+    Inputs: mycotools db, hmm_path, output directory, set of omes to ignore,
+    threads per search (int or {ome: int}), write full-text `report`
     Outputs: tuples of arguments for hmmsearches
     """
 
     cmd_tuples = [ ]
     for ome, row in db.items():
         if ome not in ome_set:
-            output_path = output + ome + '.out'
-            cmd = (('hmmsearch', '-o', output_path + '.tmp', 
-                   '--cpu', str(cpu),
+            output_path = output + ome + '.domtbl'
+            threads = cpu[ome] if isinstance(cpu, dict) else cpu
+            if report:
+                report_args = ('-o', output + ome + '.out',)
+            else:
+                report_args = ('-o', os.devnull, '--noali',)
+            cmd = (('hmmsearch',) + report_args \
+                 + ('--domtblout', output_path + '.tmp', 
+                   '--cpu', str(threads),
                    hmm_path, row['faa'],
                    '&&',), ('mv', output_path + '.tmp', output_path,),) 
             cmd_tuples.append(cmd)
 
     return cmd_tuples
 
-def compileextractHmmCmd(db, args, output):
-    """
-    Inputs: mycotools db, argparse arguments, and output path
-    Outputs: tuples of arguments for `run_ex_hmm`
-    """
 
-    cmd_tuples = []
-    for ome, row in db.items():
-        hmmsearch_out = output + ome + '.out'
-        cmd_tuples.append((args, hmmsearch_out, output,))
+def calibrate_hmmsearch(hmm_path, faa, wrk_dir, cpu, binary = 'hmmsearch',
+                        hmms = 10, seqs = 2000):
+    """Benchmark `binary` with the first `hmms` of `hmm_path` against the
+    first `seqs` of `faa` at 1 and up to 4 threads. Outputs
+    {'serial': Amdahl serial fraction, 'rate': seconds per HMM per byte},
+    cached in `wrk_dir`"""
 
-    return tuple(cmd_tuples)
+    calib_path = wrk_dir + 'hmmsearch.calib.json'
+    threads = max(min(cpu, 4), 1)
+    if os.path.isfile(calib_path):
+        calib = read_json(calib_path)
+        if calib.get('threads') == threads:
+            return calib
 
+    hmm_tmp, faa_tmp = wrk_dir + 'calib.hmm', wrk_dir + 'calib.faa'
+    with open(hmm_path, 'r') as raw, open(hmm_tmp, 'w') as out:
+        count = 0
+        for line in raw:
+            out.write(line)
+            if line.startswith('//'):
+                count += 1
+                if count >= hmms:
+                    break
+    with open(faa, 'r') as raw, open(faa_tmp, 'w') as out:
+        count = 0
+        for line in raw:
+            if line.startswith('>'):
+                count += 1
+                if count > seqs:
+                    break
+            out.write(line)
+
+    times = []
+    for t in [1, threads]:
+        start = datetime.datetime.now()
+        subprocess.call([binary, '-o', os.devnull, '--cpu', str(t),
+                         hmm_tmp, faa_tmp],
+                        stdout = subprocess.DEVNULL, 
+                        stderr = subprocess.DEVNULL)
+        times.append((datetime.datetime.now() - start).total_seconds())
+    size = os.path.getsize(faa_tmp)
+    os.remove(hmm_tmp)
+    os.remove(faa_tmp)
+
+    if threads > 1 and times[0] > 0:
+        serial = (times[1]/times[0] - 1/threads)/(1 - 1/threads)
+        serial = min(max(serial, 0), 1)
+    else:
+        serial = 1
+    calib = {'threads': threads, 'serial': serial,
+             'rate': times[0]/(max(hmms, 1) * max(size, 1))}
+    write_json(calib, calib_path)
+
+    return calib
+
+
+def hmm_threads(sizes, hmm_count, cpu, calib):
+    """Threads for each hmmsearch of proteome `sizes` (bytes) against
+    `hmm_count` HMMs: each job receives the fewest threads whose Amdahl
+    speedup brings it within the ideal makespan of all jobs on `cpu`"""
+
+    speedup = lambda t: 1/(calib['serial'] + (1 - calib['serial'])/t)
+    work = [calib['rate'] * hmm_count * x for x in sizes]
+    if not work:
+        return []
+    span = sum(work) / max(cpu, 1)
+    threads = []
+    for w in work:
+        t = 1
+        while t < cpu and w / speedup(t) > span:
+            t += 1
+        threads.append(t)
+
+    return threads
+
+
+def shard_proteomes(db, shard_dir, shards = 1):
+    """Concatenate the proteomes of `db` into `shards` of similar total size
+    (largest first, into the smallest shard). Outputs {'shards': [[omes]],
+    'counts': {ome: sequences}}, reused when `shard_dir` holds the same omes"""
+
+    manifest_path = shard_dir + 'shards.json'
+    omes = {ome: [row['faa'], os.path.getsize(row['faa'])] \
+            for ome, row in db.items()}
+    if os.path.isfile(manifest_path):
+        manifest = read_json(manifest_path)
+        if manifest['omes'] == omes \
+            and all(os.path.isfile(f'{shard_dir}shard{i}.faa') \
+                    for i in range(len(manifest['shards']))):
+            return manifest
+    for shard in collect_files(shard_dir, '*'):
+        os.remove(shard) # stale shards and reports
+
+    shard_omes, shard_sizes = [[] for x in range(shards)], [0 for x in range(shards)]
+    for ome, (faa, size) in sorted(omes.items(), key = lambda x: x[1][1],
+                                   reverse = True):
+        i = shard_sizes.index(min(shard_sizes))
+        shard_omes[i].append(ome)
+        shard_sizes[i] += size
+    shard_omes = [x for x in shard_omes if x]
+
+    counts = {}
+    for i, s_omes in enumerate(shard_omes):
+        with open(f'{shard_dir}shard{i}.faa.tmp', 'w') as out:
+            for ome in s_omes:
+                count = 0
+                with open(omes[ome][0], 'r') as raw:
+                    for line in raw:
+                        if line.startswith('>'):
+                            count += 1
+                        out.write(line)
+                counts[ome] = count
+        os.rename(f'{shard_dir}shard{i}.faa.tmp', f'{shard_dir}shard{i}.faa')
+    manifest = {'omes': omes, 'shards': shard_omes, 'counts': counts}
+    write_json(manifest, manifest_path)
 
-def run_ex_hmm(args, hmmsearch_out, output):
+    return manifest
 
-    ome = os.path.basename(hmmsearch_out).replace('.out', '')
 
-    try:
-        with open(hmmsearch_out, 'r') as raw:
-            data = raw.read()
-    except FileNotFoundError:
-        eprint('\tWARNING: ' + ome + ' failed', flush = True)
-        return ome, False
-    if len(data) > 100: # check for data # check for data
-        hmm_data = exHmm(data, args[0], args[1], args[2], args[3], args[4],
-                         header = False)
-        out_dict = {}
-        for q, data in hmm_data.items(): # parse alignment info
-            hit_info = [x.split('\t') for x in data[1].rstrip().split('\n')]
-            out_dict[q] = tuple([(x[0], int(x[9]), int(x[10]),) for x in hit_info])
-            # hit_accession, coordinate start, coordinate end
-        # does this overwrite other hits?
-        return ome, out_dict
-    else:
-        eprint('\tWARNING: ' + ome + ' empty results', flush = True)
-        return ome, False
-
-    
-def comp_hmm_acc2fa(db, q_dict, coords = True):
+def compile_hmm_shard_cmd(shard_dir, hmm_path, shards, z, cpu = 1):
+    """hmmsearch --tblout/--domtblout of each shard with a fixed `z` 
+    database size, so E-values rescale to each ome"""
 
     cmd_tuples = []
-    fa_dict = {ome: row['faa'] for ome, row in db.items()}
-    for q in q_dict:
-        cmd_tuples.append((db, q_dict[q], 
-                           q, coords,))
+    for i in range(shards):
+        prefix = f'{shard_dir}shard{i}'
+        if os.path.isfile(prefix + '.domtbl'):
+            continue
+        cmd_tuples.append((('hmmsearch', '-o', os.devnull, '--noali', 
+                            '--tblout', prefix + '.tbl.tmp',
+                            '--domtblout', prefix + '.domtbl.tmp',
+                            '-Z', str(z), '--cpu', str(cpu), hmm_path,
+                            prefix + '.faa', '&&',),
+                           ('mv', prefix + '.tbl.tmp', prefix + '.tbl', '&&',),
+                           ('mv', prefix + '.domtbl.tmp', prefix + '.domtbl',),))
 
     return cmd_tuples
 
 
-def hmm_acc2fa(db, q_files, q, coords = False):
+def run_shard_hmm(args, domtbl, counts, z):
+    """Parse a shard's --domtblout into [(ome, {query: hits})], rescaling 
+    E-values from the fixed `z` to each ome's sequence count"""
 
-    accs = []
-    if coords:
-        for ome, hit_data in q_files.items():
-            t_accs = [f'{x[0]}[{x[1]}:{x[2]}]' for x in hit_data]
-            accs.extend(t_accs)
-    else:
-        for ome, hit_data in q_files.items():
-            t_accs = [x[0] for x in hit_data]
-            accs.extend(t_accs)
+    if not os.path.isfile(domtbl):
+        eprint('\tWARNING: ' + os.path.basename(domtbl) + ' failed', flush = True)
+        return []
+    e_scale = {ome: count/z for ome, count in counts.items()}
+    hmm_data = parse_domtblout(domtbl, accession = args[0], best = args[1], 
+                               threshold = args[2], evalue = args[3],
+                               bitscore = args[4], group = \
+                               lambda x: x[:x.find('_')],
+                               e_scale = defaultdict(lambda: 1, e_scale))
+
+    return [(ome, q_dict) for ome, q_dict in hmm_data.items()]
+
+def run_domtbl_hmm(args, domtbl):
+    """Parse an ome's --domtblout into (ome, {query: hits})"""
+
+    ome = os.path.basename(domtbl).replace('.domtbl', '')
+    if not os.path.isfile(domtbl):
+        eprint('\tWARNING: ' + ome + ' failed', flush = True)
+        return ome, False
+    hmm_data = parse_domtblout(domtbl, accession = args[0], best = args[1],
+                               threshold = args[2], evalue = args[3],
+                               bitscore = args[4])
+    if not hmm_data.get(None):
+        eprint('\tWARNING: ' + ome + ' empty results', flush = True)
+        return ome, False
+
+    return ome, hmm_data[None]
 
-    return q, acc2fa_db(db, accs)
-#    fa_str = dict2fa(acc2fa_db(db, accs))
     
- #   with open( output, 'w' ) as out:
-  #      out.write( fa_str )
+def comp_hmm_acc2fa(q_dict, coords = True):
+    """{query: {ome: [accessions]}} of hmmsearch hits"""
+
+    q_accs = {}
+    for q, ome_dict in q_dict.items():
+        q_accs[q] = {}
+        if coords:
+            for ome, hit_data in ome_dict.items():
+                q_accs[q][ome] = [f'{x[0]}[{x[1]}:{x[2]}]' for x in hit_data]
+        else:
+            for ome, hit_data in ome_dict.items():
+                q_accs[q][ome] = [x[0] for x in hit_data]
+
+    return q_accs
 
 
 def compile_mafft_cmds(output, faa_dir):
@@ -192,9 +328,40 @@ def compile_hmm_queries(hmm_paths, hmm_out):
     return queries
 
 
+def run_hmm_shards(db, hmm_path, ome_dir, exHmm_args, verbose = False, 
+                   cpu = 1):
+    """Search `hmm_path` against one proteome shard per CPU and split the
+    --domtblout hits by ome. Outputs [(ome, {query: hits})]"""
+
+    shard_dir = ome_dir + 'shards/'
+    if not os.path.isdir(shard_dir):
+        os.mkdir(shard_dir)
+    manifest = shard_proteomes(db, shard_dir, shards = min(cpu, len(db)))
+    z = max(min(manifest['counts'].values(), default = 1), 1)
+    shard_tuples = compile_hmm_shard_cmd(shard_dir, hmm_path, 
+                                         len(manifest['shards']), z)
+    shard_res = schedule_subs(shard_tuples, processes = cpu, cpus = cpu,
+                              sizes = [x[0][-2] for x in shard_tuples],
+                              injectable = True, verbose = verbose)
+    for i, res in enumerate(shard_res):
+        if res['exit']:
+            eprint('\tERROR: ' + str(shard_tuples[i]) \
+                 + f' ({res["time"]:.1f}s)', flush = True)
+
+    print('\nExtracting hmmsearch output', flush = True)
+    shard_args = [(exHmm_args, f'{shard_dir}shard{i}.domtbl',
+                   {ome: manifest['counts'][ome] for ome in omes}, z) \
+                  for i, omes in enumerate(manifest['shards'])]
+    with mp.get_context('spawn').Pool(processes = cpu) as pool:
+        shard_hits = pool.starmap(run_shard_hmm, shard_args)
+
+    return [x for hits in shard_hits for x in hits]
+
+
 def hmmer_main(db, hmm_paths, output, accessions, max_hits, query_cov,
                coords = False, evalue = 0.01, bitscore = 0,
-               binary = 'hmmsearch', verbose = False, cpu = 1):
+               binary = 'hmmsearch', verbose = False, cpu = 1, shard = False,
+               report = False):
 
     ome_dir = output + 'omes/'
     faa_dir = output + 'fastas/'
@@ -218,8 +385,8 @@ def hmmer_main(db, hmm_paths, output, accessions, max_hits, query_cov,
             if not os.path.isdir(ome_dir):
                 untardir(output + 'omes.tar.gz')
         # check what reports have been generated
-        omes = collect_files(ome_dir, 'out')
-        ome_set = set(os.path.basename(x).replace('.out', '') for x in omes)
+        omes = collect_files(ome_dir, 'domtbl')
+        ome_set = set(os.path.basename(x).replace('.domtbl', '') for x in omes)
     else:
         print('\thmmsearch -> hits.faa DONE', flush = True)
 
@@ -228,31 +395,49 @@ def hmmer_main(db, hmm_paths, output, accessions, max_hits, query_cov,
         if not os.path.isdir(ome_dir):
             os.mkdir(ome_dir)
 
-        # run hmmer
-        par_runs = round(((cpu - 1)/2) - 0.5)
-        if par_runs < 1:
-            par_cpus = 1
-            par_runs = 1
-        else:
-            par_cpus = 2
-        hmmsearch_tuples = compile_hmm_cmd(db, hmm_out, 
-                                         ome_dir, 
-                                         ome_set = ome_set,
-                                         cpu = par_cpus)
-        hmmsearch_codes = multisub(hmmsearch_tuples, processes = par_runs,
-                                   injectable = True, verbose = verbose)
-        for i, code in enumerate(hmmsearch_codes):
-            if code:
-                eprint('\tERROR: ' \
-                        + str(hmmsearch_tuples[i]),
-                        flush = True)
-
-        # extract results
-        print('\nExtracting hmmsearch output', flush = True)
+        # calibrate threads per hmmsearch from HMM count and proteome sizes
+        run_omes = [ome for ome in db if ome not in ome_set]
+        sizes = {ome: os.path.getsize(db[ome]['faa']) for ome in run_omes}
         exHmm_args = [accessions, max_hits, query_cov, evalue, bitscore]
-        exHmm_tuples = compileextractHmmCmd(db, exHmm_args, ome_dir)
-        with mp.get_context('spawn').Pool(processes = cpu) as pool:
-            hmmAligns = pool.starmap(run_ex_hmm, exHmm_tuples)
+        if shard:
+            hmmAligns = run_hmm_shards(db, hmm_out, ome_dir, exHmm_args,
+                                       verbose = verbose, cpu = cpu)
+        else:
+            if run_omes:
+                calib = calibrate_hmmsearch(hmm_out, 
+                                            db[max(sizes, key = sizes.get)]['faa'], 
+                                            output, cpu, binary = binary)
+                threads = hmm_threads([sizes[x] for x in run_omes], 
+                                      len(queries), cpu, calib)
+                par_cpus = {ome: threads[i] for i, ome in enumerate(run_omes)}
+                if verbose:
+                    eprint(f'\tSerial fraction: {calib["serial"]:.2f}; ' \
+                         + f'threads/search: {min(threads)}-{max(threads)}',
+                           flush = True)
+            else:
+                par_cpus = {}
+            hmmsearch_tuples = compile_hmm_cmd(db, hmm_out, 
+                                             ome_dir, 
+                                             ome_set = ome_set,
+                                             cpu = par_cpus, report = report)
+            hmmsearch_res = schedule_subs(hmmsearch_tuples, processes = cpu,
+                                          cpus = cpu, 
+                                          threads = [par_cpus[x] for x in run_omes],
+                                          sizes = [sizes[x] for x in run_omes],
+                                          injectable = True, verbose = verbose)
+            for i, res in enumerate(hmmsearch_res):
+                if res['exit']:
+                    eprint('\tERROR: ' \
+                            + str(hmmsearch_tuples[i]) \
+                            + f' ({res["time"]:.1f}s)',
+                            flush = True)
+
+            # extract results
+            print('\nExtracting hmmsearch output', flush = True)
+            exHmm_tuples = [(exHmm_args, ome_dir + ome + '.domtbl',) \
+                            for ome in db]
+            with mp.get_context('spawn').Pool(processes = cpu) as pool:
+                hmmAligns = pool.starmap(run_domtbl_hmm, exHmm_tuples)
 
         mp.Process(target=tardir, args=[ome_dir])
         print( '\nCompiling fastas' , flush = True)
@@ -264,16 +449,15 @@ def hmmer_main(db, hmm_paths, output, accessions, max_hits, query_cov,
 #                    align = hit[query][1]
                     q_dict[query][ome] = hit_info
 
-        acc2fa_tuples = comp_hmm_acc2fa(db, q_dict, coords = coords)
-        with mp.get_context('spawn').Pool(processes = cpu) as pool:
-            fa_info = pool.starmap(hmm_acc2fa, acc2fa_tuples)        
-        fa_dicts = {q: fd for q, fd in fa_info}
+        q_accs = comp_hmm_acc2fa(q_dict, coords = coords)
+        fa_dicts = bulk_acc2fa(q_accs, {ome: row['faa'] for ome, row in db.items()},
+                               cpus = cpu)
 
         return fa_dicts
 
 
 def compileBlastCmd( ome, biofile, out_dir, blast_scaf ):
-    return blast_scaf + ['-out', out_dir + ome + '.tsv', \
+    return blast_scaf + ['-out', out_dir + ome + '.tsv.tmp', \
         '-subject', biofile]
 
 def comp_blast_tups( 
@@ -308,33 +492,44 @@ def comp_blast_tups(
     return blast_cmds
 
 def compileDiamondCmd(ome, dmnd_db, out_dir, blast_scaf):
-    return blast_scaf + ['--out', out_dir + ome + '.tsv', \
-        '--subject', dmnd_db]
+    return blast_scaf + ['--out', out_dir + ome + '.tsv.tmp', \
+        '--db', dmnd_db]
 
-def comp_diamond_tups( 
-    seq_db, diamond, blast_type, seq_type, out_dir, 
-    biotype, query, hsps = None, max_hits = None,
-    evalue = None, coverage = None, search_args = []
+def diamond_scaf(
+    diamond, blast_type, query, hsps = None, max_hits = None,
+    evalue = None, coverage = None, search_args = [], threads = None
     ):
-
-    if not os.path.isdir(out_dir + 'dmnd/'):
-        os.mkdir(out_dir + 'dmnd/')
     blast_scaf = [
-        diamond, blast_type, '-query', query,
+        diamond, blast_type, '--query', query,
         ]
+    if threads:
+        blast_scaf.extend(['--threads', str(threads)])
     if evalue:
         blast_scaf.extend(['--evalue', str(evalue)])
     if hsps:
-        blast_scaf.extend(['--max_hsps', str(hsps)])
-    if max_hits:
-        blast_scaf.extend(['--max_target_seqs', str(max_hits)])
+        blast_scaf.extend(['--max-hsps', str(hsps)])
+    if max_hits is not None:
+        blast_scaf.extend(['--max-target-seqs', str(max_hits)])
     if coverage:
         blast_scaf.extend(['--query-cover', str(coverage)])
     if search_args:
         blast_scaf.extend(search_args)
-    blast_scaf.extend('--outfmt', '6', 'qseqid', 'sseqid', 'pident',
-        'ppos', 'sstart', 'send', 'evalue', 'bitscore')
+    blast_scaf.extend(['--outfmt', '6', 'qseqid', 'sseqid', 'pident',
+        'ppos', 'sstart', 'send', 'evalue', 'bitscore'])
+    return blast_scaf
+
+def comp_diamond_tups( 
+    seq_db, diamond, blast_type, seq_type, out_dir, 
+    biotype, query, hsps = None, max_hits = None,
+    evalue = None, coverage = None, search_args = [], threads = 1
+    ):
 
+    if not os.path.isdir(out_dir + 'dmnd/'):
+        os.mkdir(out_dir + 'dmnd/')
+    blast_scaf = diamond_scaf(diamond, blast_type, query, hsps = hsps,
+                              max_hits = max_hits, evalue = evalue,
+                              coverage = coverage, search_args = search_args,
+                              threads = threads)
 
     blast_cmds, db_cmds = [], []
     for i, ome in enumerate(seq_db['ome']):
@@ -350,6 +545,548 @@ def comp_diamond_tups(
     return db_cmds, blast_cmds
 
 
+def read_merged_dmnd(db_path, manifest):
+    """{ome: residues} of a merged DIAMOND db built from the files of 
+    `manifest`, otherwise None"""
+    if not os.path.isfile(db_path + '.dmnd'):
+        return None
+    try:
+        db_manifest = read_json(db_path + '.json')
+        if {k: v[:3] for k, v in db_manifest.items()} == manifest:
+            return {k: v[3] for k, v in db_manifest.items()}
+    except (FileNotFoundError, ValueError, IndexError, AttributeError):
+        pass
+    return None
+
+
+def make_merged_dmnd(db_path, ome2fa, manifest, diamond, db_dir, cpus = 1):
+    """Build a merged DIAMOND db of {ome: fasta} under a temporary name in
+    `db_dir` and swap it in. Returns {ome: residues} or None upon failure"""
+
+    print(f'\nBuilding DIAMOND db of {len(ome2fa)} omes', flush = True)
+    tmp_dir = tempfile.mkdtemp(dir = db_dir, prefix = '.mtdb_')
+    try:
+        makedb = subprocess.Popen([diamond, 'makedb', '--db', tmp_dir + '/db',
+                                   '-p', str(cpus)], stdin = subprocess.PIPE,
+                                  stdout = subprocess.DEVNULL)
+        residues = {}
+        for ome, fa in ome2fa.items():
+            residues[ome] = 0
+            with open(fa, 'rb') as raw:
+                for line in raw:
+                    makedb.stdin.write(line)
+                    if not line.startswith(b'>'):
+                        residues[ome] += len(line.strip())
+            makedb.stdin.write(b'\n')
+        makedb.stdin.close()
+        if makedb.wait():
+            eprint('\tERROR: diamond makedb failed', flush = True)
+            return None
+        os.replace(tmp_dir + '/db.dmnd', db_path + '.dmnd')
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors = True)
+    write_json({ome: v + [residues[ome]] for ome, v in manifest.items()},
+               db_path + '.json')
+    return residues
+
+
+def evict_merged_dmnd(db_dir, keep = None, max_dbs = 5):
+    """Remove the least recently used merged DIAMOND dbs of `db_dir` beyond
+    `max_dbs`, except `keep`. Dbs locked by other runs are skipped"""
+
+    dbs = []
+    for entry in os.scandir(db_dir):
+        if entry.name.startswith('mtdb_') and entry.name.endswith('.dmnd'):
+            try:
+                dbs.append((entry.stat().st_mtime, entry.path[:-5]))
+            except FileNotFoundError: # removed by another run
+                continue
+
+    removed = 0
+    for mtime, db_path in sorted(dbs, reverse = True)[max_dbs:]:
+        if db_path == keep:
+            continue
+        with file_lock(db_path + '.lock', blocking = False) as locked:
+            if not locked:
+                continue
+            for ext in ['.dmnd', '.json']:
+                try:
+                    os.remove(db_path + ext)
+                except FileNotFoundError:
+                    pass
+            removed += 1
+    return removed
+
+
+@contextmanager
+def merged_dmnd_db(seq_db, diamond, db_dir, biotype = 'faa', cpus = 1,
+                   max_dbs = 5):
+    """Build or reuse one cached DIAMOND db of `seq_db`'s proteomes, named
+    by the ome set. MTDB accessions are ome-prefixed, so hits map back to
+    omes. Builds hold an exclusive lock on the db and the least recently
+    used of more than `max_dbs` dbs are removed. The db is share-locked for
+    the context, which yields the db path and {ome: residues}, or None, 
+    None upon failure"""
+
+    ome2fa = {ome: row[biotype] for ome, row in seq_db.set_index('ome').items() \
+              if row[biotype]}
+    omes_hash = hashlib.md5('\n'.join(f'{ome}\t{fa}' \
+                            for ome, fa in sorted(ome2fa.items())).encode()).hexdigest()
+    db_path = f'{db_dir}mtdb_{omes_hash}'
+    manifest = {ome: [fa, os.path.getsize(fa), os.path.getmtime(fa)] \
+                for ome, fa in ome2fa.items()}
+
+    for attempt in range(3):
+        built = False
+        with file_lock(db_path + '.lock'):
+            residues = read_merged_dmnd(db_path, manifest)
+            if residues is None:
+                residues = make_merged_dmnd(db_path, ome2fa, manifest, 
+                                            diamond, db_dir, cpus)
+                if residues is None:
+                    break
+                built = True
+            else: # recently used dbs are retained
+                os.utime(db_path + '.dmnd')
+        if built:
+            evict_merged_dmnd(db_dir, db_path, max_dbs)
+        with file_lock(db_path + '.lock', shared = True):
+            # the db may have been evicted while unlocked
+            if read_merged_dmnd(db_path, manifest) is not None:
+                yield db_path, residues
+                return
+    yield None, None
+
+
+def split_ome_reports(report, report_dir, omes, evalue_scales = {},
+                      evalue = None, max_hits = None):
+    """Split a merged search report into temporary per-ome reports by
+    subject prefix. E-values are multiplied by the ome's `evalue_scales`
+    and filtered by `evalue`, then the top `max_hits` subjects of each
+    query are retained per ome"""
+    ome_res = {ome: [] for ome in omes}
+    ome_hits = defaultdict(set)
+    with open(report, 'r') as raw:
+        for line in raw:
+            data = line.split('\t')
+            query, subject = data[0], data[1]
+            ome = subject[:subject.find('_')]
+            if ome not in ome_res:
+                continue
+            if ome in evalue_scales:
+                hit_evalue = float(data[6]) * evalue_scales[ome]
+                if evalue is not None and hit_evalue > evalue:
+                    continue
+                data[6] = f'{hit_evalue:.3g}'
+                line = '\t'.join(data)
+            # reports are sorted by score per query, as are DIAMOND's targets
+            hits = ome_hits[(query, ome)]
+            if subject not in hits:
+                if max_hits and len(hits) >= max_hits:
+                    continue
+                hits.add(subject)
+            ome_res[ome].append(line)
+    for ome, res in ome_res.items():
+        with open(report_dir + ome + '.tsv.tmp', 'w') as out:
+            out.write(''.join(res))
+
+
+def merged_dmnd_search(
+    seq_db, diamond, blast_type, report_dir, query, hsps = None,
+    evalue = None, coverage = None, search_args = [], cpus = 1
+    ):
+    """Search one cached DIAMOND db of all omes with a single multithreaded
+    run and split the report into per-ome reports. E-values and target
+    limits are applied per ome, as if each ome were searched alone"""
+
+    db_dir = format_path('$MYCOGFF3/../db/')
+    if not os.access(db_dir, os.W_OK):
+        db_dir = report_dir
+    # the per-ome target limit is applied when splitting the report
+    max_hits, search_args = 25, list(search_args) # DIAMOND's default
+    for flag in ['-k', '--max-target-seqs']:
+        if flag in search_args:
+            i = search_args.index(flag)
+            max_hits = int(search_args[i + 1])
+            del search_args[i:i + 2]
+    if evalue is None:
+        evalue = 0.001 # DIAMOND's default
+
+    out_file = report_dir + 'merged.out'
+    with merged_dmnd_db(seq_db, diamond, db_dir, cpus = cpus) \
+        as (db_path, residues):
+        if not db_path:
+            return 1
+        # E-values are scored against the smallest ome and rescaled to each
+        # ome's size, so every per-ome E-value passes the search threshold
+        dbsize = max(min(residues.values(), default = 1), 1)
+        evalue_scales = {ome: x / dbsize for ome, x in residues.items()}
+        search_cmd = diamond_scaf(diamond, blast_type, query, hsps = hsps,
+                                  max_hits = 0, evalue = evalue, 
+                                  coverage = coverage, search_args = search_args,
+                                  threads = cpus) \
+                   + ['--dbsize', str(dbsize), '--db', db_path, 
+                      '--out', out_file + '.tmp']
+        search_exit = subprocess.call(search_cmd)
+    if search_exit:
+        eprint('\tERROR: diamond search failed', flush = True)
+        return search_exit
+    split_ome_reports(out_file + '.tmp', report_dir, list(seq_db['ome']),
+                      evalue_scales = evalue_scales, evalue = evalue,
+                      max_hits = max_hits)
+    os.remove(out_file + '.tmp')
+    return 0
+
+
+mmseqs_exts = ['', '.index', '.dbtype', '_h', '_h.index', '_h.dbtype',
+               '.lookup', '.source']
+
+def mmseqs_searchdb_path(biotype):
+    """Managed merged mmseqs search db of MTDB `biotype` files"""
+    return format_path('$MYCOGFF3/../db/') + 'mtdb_' + biotype
+
+
+def read_searchdb_manifest(db_path):
+    """Manifest of omes in a managed search db:
+    {'next_key': int, 'omes': {ome: {'path', 'size', 'mtime', 'md5', 'keys'}}}"""
+    try:
+        return read_json(db_path + '.json')
+    except FileNotFoundError:
+        return {'next_key': 0, 'omes': {}}
+
+
+def write_searchdb_manifest(manifest, db_path):
+    write_json(manifest, db_path + '.json.tmp')
+    os.replace(db_path + '.json.tmp', db_path + '.json')
+
+
+def searchdb_current(ome_info, fa_path):
+    """Check if the fasta an ome was added from is unchanged; the checksum
+    is only computed if the modification time changed"""
+    if ome_info['path'] != fa_path:
+        return False
+    try:
+        stat = os.stat(fa_path)
+    except FileNotFoundError:
+        return False
+    if stat.st_size != ome_info['size']:
+        return False
+    elif stat.st_mtime == ome_info['mtime']:
+        return True
+    return checksum(fa_path, 'md5') == ome_info['md5']
+
+
+def mv_mmseqs_db(src, dst):
+    for ext in mmseqs_exts:
+        if os.path.isfile(src + ext):
+            os.replace(src + ext, dst + ext)
+        elif os.path.isfile(dst + ext) or os.path.islink(dst + ext):
+            os.remove(dst + ext)
+
+
+def rm_mmseqs_db(db_path):
+    for ext in mmseqs_exts:
+        if os.path.isfile(db_path + ext) or os.path.islink(db_path + ext):
+            os.remove(db_path + ext)
+
+
+def shift_mmseqs_keys(db_path, shift):
+    """Offset the entry keys of a sequence db, its header db, and lookup"""
+    for key_file in [db_path + '.index', db_path + '_h.index', 
+                     db_path + '.lookup']:
+        if not os.path.isfile(key_file):
+            continue
+        with open(key_file, 'r') as raw:
+            data = [x.rstrip().split('\t') for x in raw if x.rstrip()]
+        with open(key_file, 'w') as out:
+            for d in data:
+                out.write('\t'.join([str(int(d[0]) + shift)] + d[1:]) + '\n')
+
+
+def lookup2key_ranges(db_path):
+    """{ome: [first_key, last_key]} from an mmseqs lookup file"""
+    key_ranges = {}
+    with open(db_path + '.lookup', 'r') as raw:
+        for line in raw:
+            key, acc = line.split('\t')[:2]
+            ome, key = acc[:acc.find('_')], int(key)
+            if ome not in key_ranges:
+                key_ranges[ome] = [key, key]
+            elif key > key_ranges[ome][1]:
+                key_ranges[ome][1] = key
+    return key_ranges
+
+
+def write_keys(key_ranges, key_path):
+    with open(key_path, 'w') as out:
+        for start, end in sorted(key_ranges):
+            out.write('\n'.join(str(x) for x in range(start, end + 1)) + '\n')
+
+
+def subset_lookup(db_path, out_path, omes):
+    with open(db_path + '.lookup', 'r') as raw, \
+        open(out_path + '.lookup', 'w') as out:
+        for line in raw:
+            acc = line.split('\t')[1]
+            if acc[:acc.find('_')] in omes:
+                out.write(line)
+
+
+def createsubdb_mmseqs(db_path, out_path, key_ranges, mmseqs = 'mmseqs',
+                       link = False):
+    """Subset a sequence db and its header db to the keys of `key_ranges`.
+    `link` only writes the subset index, soft-linking the data"""
+    write_keys(key_ranges, out_path + '.keys')
+    mode = str(int(link))
+    exits = [subprocess.call([mmseqs, 'createsubdb', out_path + '.keys',
+                              db_path + ext, out_path + ext, 
+                              '--subdb-mode', mode],
+                             stdout = subprocess.DEVNULL) \
+             for ext in ['', '_h']]
+    os.remove(out_path + '.keys')
+    return any(exits)
+
+
+def update_mmseqs_searchdb(db, biotype, mmseqs = 'mmseqs', db_path = None,
+                           prune = True):
+    """Incrementally update the managed merged mmseqs search db with the
+    `biotype` files of `db`. Omes with changed files are replaced and, if
+    `prune`, omes absent from `db` are removed. Updates hold an exclusive
+    lock on the db and build under run-specific names before swapping in.
+    Returns the db path and manifest, or None upon failure"""
+
+    if not db_path:
+        db_path = mmseqs_searchdb_path(biotype)
+    ome2fa = {ome: row[biotype] for ome, row in db.set_index('ome').items() \
+              if row[biotype]}
+    with file_lock(db_path + '.lock') as locked:
+        if not locked:
+            eprint('\tERROR: could not lock merged search db', flush = True)
+            return None
+        return merge_mmseqs_searchdb(db_path, ome2fa, mmseqs, prune)
+
+
+def merge_mmseqs_searchdb(db_path, ome2fa, mmseqs = 'mmseqs', prune = True):
+    """Apply {ome: fasta} to a managed search db; the caller holds its lock"""
+
+    manifest = read_searchdb_manifest(db_path)
+    if not os.path.isfile(db_path + '.dbtype'):
+        manifest = {'next_key': 0, 'omes': {}}
+
+    torm = {ome for ome, info in manifest['omes'].items() \
+            if (ome in ome2fa and not searchdb_current(info, ome2fa[ome])) \
+            or (prune and ome not in ome2fa)}
+    toadd = [ome for ome in ome2fa \
+             if ome not in manifest['omes'] or ome in torm]
+    if not torm and not toadd:
+        return db_path, manifest
+
+    tmp_base = f'{db_path}.{os.getpid()}'
+    cur_path = db_path if manifest['omes'] else None
+    if torm:
+        print(f'\tRemoving {len(torm)} omes from merged search db', flush = True)
+        for ome in torm:
+            del manifest['omes'][ome]
+        if manifest['omes']:
+            if createsubdb_mmseqs(db_path, tmp_base + '.sub', 
+                                  [x['keys'] for x in manifest['omes'].values()],
+                                  mmseqs):
+                eprint('\tERROR: mmseqs createsubdb failed', flush = True)
+                rm_mmseqs_db(tmp_base + '.sub')
+                return None
+            subset_lookup(db_path, tmp_base + '.sub', set(manifest['omes']))
+            cur_path = tmp_base + '.sub'
+        else:
+            cur_path = None
+
+    if toadd:
+        print(f'\tAdding {len(toadd)} omes to merged search db', flush = True)
+        add_exit = subprocess.call([mmseqs, 'createdb'] \
+                                 + [ome2fa[ome] for ome in toadd] \
+                                 + [tmp_base + '.add', '--shuffle', '0'],
+                                   stdout = subprocess.DEVNULL)
+        if add_exit:
+            eprint('\tERROR: mmseqs createdb failed', flush = True)
+            for tmp_path in ['.sub', '.add']:
+                rm_mmseqs_db(tmp_base + tmp_path)
+            return None
+        shift_mmseqs_keys(tmp_base + '.add', manifest['next_key'])
+        key_ranges = lookup2key_ranges(tmp_base + '.add')
+        for ome in toadd:
+            stat = os.stat(ome2fa[ome])
+            manifest['omes'][ome] = {
+                'path': ome2fa[ome], 'size': stat.st_size, 
+                'mtime': stat.st_mtime, 'md5': checksum(ome2fa[ome], 'md5'),
+                'keys': key_ranges.get(ome, [manifest['next_key'], 
+                                              manifest['next_key'] - 1])
+                }
+        manifest['next_key'] = max([manifest['next_key']] \
+                                 + [x[1] + 1 for x in key_ranges.values()])
+        if cur_path:
+            concat_exits = [subprocess.call([mmseqs, 'concatdbs', cur_path + ext,
+                                            tmp_base + '.add' + ext, 
+                                            tmp_base + '.new' + ext,
+                                            '--preserve-keys', '1'],
+                                            stdout = subprocess.DEVNULL) \
+                            for ext in ['', '_h']]
+            if any(concat_exits):
+                eprint('\tERROR: mmseqs concatdbs failed', flush = True)
+                for tmp_path in ['.sub', '.add', '.new']:
+                    rm_mmseqs_db(tmp_base + tmp_path)
+                return None
+            with open(tmp_base + '.new.lookup', 'w') as out:
+                for lookup in [cur_path + '.lookup', tmp_base + '.add.lookup']:
+                    with open(lookup, 'r') as raw:
+                        shutil.copyfileobj(raw, out)
+            rm_mmseqs_db(tmp_base + '.add')
+        else:
+            mv_mmseqs_db(tmp_base + '.add', tmp_base + '.new')
+        cur_path = tmp_base + '.new'
+
+    # readers wait on the lock; the manifest is dropped first so an 
+    # interrupted swap is rebuilt rather than trusted
+    if os.path.isfile(db_path + '.json'):
+        os.remove(db_path + '.json')
+    if cur_path:
+        mv_mmseqs_db(cur_path, db_path)
+    else:
+        rm_mmseqs_db(db_path)
+    rm_mmseqs_db(tmp_base + '.sub')
+    write_searchdb_manifest(manifest, db_path)
+
+    return db_path, manifest
+
+
+def refresh_mmseqs_searchdbs(db, mmseqs = 'mmseqs'):
+    """Update existing managed search dbs to the omes of `db`"""
+    for biotype in ['faa', 'fna']:
+        db_path = mmseqs_searchdb_path(biotype)
+        if os.path.isfile(db_path + '.json') and shutil.which(mmseqs):
+            print(f'\nUpdating {biotype} mmseqs search db', flush = True)
+            update_mmseqs_searchdb(db, biotype, mmseqs, db_path)
+
+
+@contextmanager
+def mmseqs_searchdb(seq_db, biotype, db_dir, mmseqs = 'mmseqs'):
+    """Obtain a merged search db for `seq_db` from the managed db of the
+    primary MTDB, extending it with missing omes; an index-only subset is
+    made in `db_dir` for a subset of its omes. Other omes are merged into
+    a run-specific db. The managed db is share-locked for the context so
+    it is not swapped while in use"""
+
+    out_path = db_dir + 'searchdb'
+    ome2fa = {ome: row[biotype] for ome, row in seq_db.set_index('ome').items() \
+              if row[biotype]}
+    try:
+        prim_db = mtdb(primaryDB()).set_index('ome')
+        managed = all(ome in prim_db and prim_db[ome][biotype] == fa \
+                      for ome, fa in ome2fa.items())
+    except (FileNotFoundError, KeyError, TypeError):
+        managed = False
+
+    if managed:
+        managed = update_mmseqs_searchdb(seq_db, biotype, mmseqs, prune = False)
+    if managed:
+        db_path = managed[0]
+        with file_lock(db_path + '.lock', shared = True):
+            # the db may have been pruned since it was updated
+            manifest = read_searchdb_manifest(db_path)
+            if all(manifest['omes'].get(ome, {}).get('path') == fa \
+                   for ome, fa in ome2fa.items()):
+                rm_mmseqs_db(out_path)
+                if set(manifest['omes']) == set(ome2fa):
+                    yield db_path
+                    return
+                if not createsubdb_mmseqs(db_path, out_path, 
+                                          [manifest['omes'][x]['keys'] \
+                                           for x in ome2fa],
+                                          mmseqs, link = True):
+                    subset_lookup(db_path, out_path, set(ome2fa))
+                    yield out_path
+                    return
+            eprint('\tWARNING: could not subset merged search db', flush = True)
+            rm_mmseqs_db(out_path)
+
+    if not os.path.isfile(out_path + '.dbtype'):
+        print('\nMerging search dbs', flush = True)
+        subprocess.call([mmseqs, 'createdb'] + list(ome2fa.values()) \
+                      + [out_path, '--shuffle', '0'], 
+                        stdout = subprocess.DEVNULL)
+    yield out_path
+
+
+def query_report(out_dir, query):
+    return out_dir + os.path.basename(query) + '.tsv'
+
+
+def mmseqs_querydb(queries, db_dir, mmseqs = 'mmseqs'):
+    """Build one query db from query fastas and/or mmseqs (profile) dbs.
+    Query i is file number i of the lookup, i.e. the qsetid of its hits"""
+
+    out_path = db_dir + 'querydb'
+    rm_mmseqs_db(out_path)
+    if not any(os.path.isfile(q + '.dbtype') for q in queries):
+        return subprocess.call([mmseqs, 'createdb'] + list(queries) \
+                             + [out_path, '--shuffle', '0'],
+                               stdout = subprocess.DEVNULL), out_path
+
+    # copy each query's db with disjoint keys and concatenate
+    next_key, lookup = 0, []
+    for i, q in enumerate(queries):
+        q_path = f'{db_dir}query{i}'
+        rm_mmseqs_db(q_path)
+        if os.path.isfile(q + '.dbtype'):
+            for ext in mmseqs_exts:
+                if os.path.isfile(q + ext):
+                    shutil.copy(q + ext, q_path + ext)
+        elif subprocess.call([mmseqs, 'createdb', q, q_path, '--shuffle', '0'],
+                             stdout = subprocess.DEVNULL):
+            return 1, out_path
+        shift_mmseqs_keys(q_path, next_key)
+        with open(q_path + '_h', 'rb') as raw:
+            headers = raw.read()
+        with open(q_path + '_h.index', 'r') as raw:
+            for line in raw:
+                key, offset, length = [int(x) for x in line.split('\t')]
+                header = headers[offset:offset+length].decode().split()
+                lookup.append([key, header[0] if header else str(key), i])
+                next_key = max(next_key, key + 1)
+        if i:
+            if any(subprocess.call([mmseqs, 'concatdbs', out_path + ext,
+                                    q_path + ext, out_path + '.tmp' + ext,
+                                    '--preserve-keys', '1'],
+                                   stdout = subprocess.DEVNULL) \
+                   for ext in ['', '_h']):
+                return 1, out_path
+            rm_mmseqs_db(out_path)
+            mv_mmseqs_db(out_path + '.tmp', out_path)
+            rm_mmseqs_db(q_path)
+        else:
+            mv_mmseqs_db(q_path, out_path)
+
+    with open(out_path + '.lookup', 'w') as out:
+        out.write('\n'.join('\t'.join(str(y) for y in x) for x in lookup) + '\n')
+    with open(out_path + '.source', 'w') as out:
+        out.write('\n'.join(f'{i}\t{os.path.basename(q)}' \
+                            for i, q in enumerate(queries)) + '\n')
+    return 0, out_path
+
+
+def split_mmseqs_results(results_file, out_dir, queries):
+    """Split a batched convertalis report by its leading qsetid column into
+    per-query reports"""
+
+    q_res = [[] for q in queries]
+    with open(results_file, 'r') as raw:
+        for line in raw:
+            qsetid, data = line.split('\t', 1)
+            q_res[int(qsetid)].append(data)
+    for q, res in zip(queries, q_res):
+        with open(query_report(out_dir, q) + '.tmp', 'w') as out:
+            out.write(''.join(res))
+        os.replace(query_report(out_dir, q) + '.tmp', query_report(out_dir, q))
+    os.remove(results_file)
+
 
 # concat, search, parse
 def run_mmseq(
@@ -357,55 +1094,23 @@ def run_mmseq(
     coverage = None, search_args = [], cpus = 1,
     iterations = 3
     ):
-    db_dir = format_path('$MYCOGFF3/../db')
-    
     if not os.path.isdir(f'{out_dir}db/'):
         os.mkdir(f'{out_dir}db/')
-    db_dir = format_path('$MYCOGFF3/../db/')
-    createdb_cmds = []
-    db_path = f'{out_dir}db/searchdb'
-    
-    # make mmseqs dbs for those that dont exist
-    for i, ome in enumerate(seq_db['ome']):
-        db_path = f'{db_dir}{ome}_{biotype}'
-        out_file = out_dir + ome + '.tsv'
-        if not os.path.isfile(db_path + '.dbtype'):
-            # will fail at fastas that dont have sequences on one line
-            createdb_cmds.append((mmseqs, 'createdb', seq_db[biotype][i], db_path,
-                                  '--createdb-mode', '1', '--shuffle', '0'))
-
-    if createdb_cmds:
-        print(f'\nCreating {len(createdb_cmds)} mmseqs search dbs', flush = True)
-        createdb_outs = multisub(createdb_cmds, processes = cpus, verbose = 2) 
-
-    #if len(query) > 1:
-   #     if not os.path.isfile(f'{out_dir}db/query.dbtype'):
-  #          mergedbs_cmd = ['mmseqs', 'mergedbs']
- #           mergedbs_cmd.extend([q for q in query])
-#            mergedbs_cmd.append('--prefixes')
-           # mergedbs_cmd.extend([os.path.basename(q) for q in query])
-     #       mergedbs_cmd.insert(3, f'{out_dir}db/querydb')
-      #      mergedbs_out = subprocess.call(mergedbs_cmd)
-        #query = [f'{out_dir}db/query'] # need to adjust check
-        
-
-    # create a concatenated mmseqs db for the search target
-    if not os.path.isfile(f'{out_dir}db/searchdb.dbtype'):
-        mergedbs_cmd = ['mmseqs', 'mergedbs']
-        mergedbs_cmd.extend([f'{db_dir}{ome}_{biotype}' for ome in seq_db['ome']])
-        mergedbs_cmd.insert(3, f'{out_dir}db/searchdb')
-        print('\nMerging search dbs', flush = True)
-        mergedbs_out = subprocess.call(mergedbs_cmd) #, stderr = subprocess.DEVNULL,
-#                                        stdout = subprocess.DEVNULL)
-    
-    print('\nSearching', flush = True)
-    for i, q in enumerate(query):
-        out_file = f'{out_dir}{q}.tsv'
-        if os.path.isfile(out_file):
-            continue
-        print('\t' + q, flush = True)
-        search_cmd = [mmseqs, 'search', q, f'{out_dir}db/searchdb', 
-                      out_file + '.tmp', f'{out_dir}tmp/', 
+    # the managed search db cannot be swapped until the search completes
+    with mmseqs_searchdb(seq_db, biotype, f'{out_dir}db/', mmseqs) as search_db:
+        # search all incomplete queries at once so the target is indexed once 
+        queries = [q for q in query if not os.path.isfile(query_report(out_dir, q))]
+        if not queries:
+            return
+        print(f'\nSearching {len(queries)} queries', flush = True)
+        query_exit, query_db = mmseqs_querydb(queries, f'{out_dir}db/', mmseqs)
+        if query_exit:
+            eprint('\tERROR: query db creation failed', flush = True)
+            sys.exit(10)
+
+        aln_file = f'{out_dir}db/search'
+        search_cmd = [mmseqs, 'search', query_db, search_db, 
+                      aln_file, f'{out_dir}tmp/', 
                       '--remove-tmp-files', '1',
                       '--threads', str(cpus*2), '--num-iterations', str(iterations)]
         search_cmd.extend(search_args)
@@ -413,57 +1118,133 @@ def run_mmseq(
             search_cmd.extend(['-c', str(coverage)])
 
         search_out = subprocess.call(search_cmd) #, stderr = subprocess.DEVNULL,
-#                                     stdout = subprocess.DEVNULL)
-        results_cmd = [mmseqs, 'convertalis', q, f'{out_dir}db/searchdb',
-                       out_file + '.tmp', out_file,                        
+    #                                 stdout = subprocess.DEVNULL)
+        if search_out:
+            eprint('\tERROR: mmseqs search failed', flush = True)
+            sys.exit(10)
+        results_cmd = [mmseqs, 'convertalis', query_db, search_db,
+                       aln_file, aln_file + '.tsv',
                        '--format-output',
-                       'qset,target,pident,tstart,tend,evalue,bits']
+                       'qsetid,qset,target,pident,tstart,tend,evalue,bits']
         results_out = subprocess.call(results_cmd, stderr = subprocess.DEVNULL,
                                       stdout = subprocess.DEVNULL)
+        if results_out:
+            eprint('\tERROR: mmseqs convertalis failed', flush = True)
+            sys.exit(10)
+        split_mmseqs_results(aln_file + '.tsv', out_dir, queries)
+        for aln_file in os.listdir(f'{out_dir}db/'):
+            if aln_file == 'search' or aln_file.startswith('search.'):
+                os.remove(f'{out_dir}db/{aln_file}')
+
+hit_cols = ['query', 'subject', 'pident', 'ppos', 'start', 'end', 
+            'evalue', 'bitscore']
+hit_dtypes = {'query': str, 'subject': str, 'start': str, 'end': str,
+              'pident': np.float64, 'ppos': np.float64, 
+              'evalue': np.float64, 'bitscore': np.float64}
+
+def read_hits(file_, ppos = True):
+    """Read a tabular search report into typed columns: blast/diamond
+    `hit_cols`, or without ppos for mmseqs"""
+    cols = hit_cols if ppos else [x for x in hit_cols if x != 'ppos']
+    try:
+        return pd.read_csv(file_, sep = '\t', header = None, names = cols,
+                           usecols = range(len(cols)), dtype = hit_dtypes,
+                           engine = 'c')
+    except (FileNotFoundError, pd.errors.EmptyDataError):
+        return pd.DataFrame({x: pd.Series(dtype = hit_dtypes[x]) for x in cols})
+
+
+def filter_hits(hits, bitscore = 0, pident = 0, evalue = 0, 
+                max_hits = None, ppos = None, scale = 1000):
+    """Order hits by descending percent identity within each query (queries
+    in order of appearance), retain the top `max_hits` per query, then
+    apply the threshold masks"""
+
+    if not len(hits):
+        return hits
+    q_codes = pd.factorize(hits['query'])[0]
+    pidents = hits['pident'].to_numpy()
+    order = np.lexsort((-pidents, q_codes)) # stable
+    hits = hits.iloc[order].reset_index(drop = True)
+    pidents = pidents[order]
+
+    mask = np.ones(len(hits), dtype = bool)
+    if max_hits:
+        q_codes = q_codes[order]
+        starts = np.concatenate([[0], np.flatnonzero(np.diff(q_codes)) + 1])
+        ranks = np.arange(len(hits)) \
+              - np.repeat(starts, np.diff(np.append(starts, len(hits))))
+        mask &= ranks < max_hits
+    mask &= np.trunc(hits['bitscore'].to_numpy()) > bitscore
+    mask &= np.trunc(1000 * pidents) > scale * pident
+    mask &= hits['evalue'].to_numpy() <= evalue
+    if ppos is not None:
+        mask &= np.trunc(1000 * hits['ppos'].to_numpy()) > scale * ppos
+
+    return hits[mask]
+
 
 def parseOutput(algorithm, ome, file_, bitscore = 0, pident = 0, 
                 evalue = 0, max_hits = None, ppos = 0, scale = 1000):
+    hits = filter_hits(read_hits(file_), bitscore, pident, evalue,
+                       max_hits, ppos, scale)
+    return ome, hits
 
-    ome_results = [ome, []]
-    if os.path.exists( file_ ):
-        with open( file_, 'r' ) as raw:
-            data = [x.rstrip().split('\t') for x in raw if x.rstrip()]
-        byq = defaultdict(list)
-        for d in data:
-            byq[d[0]].append(d)
-        # sort by percent identity (we denote everything before here as a homolog)
-        for q, data in byq.items():
-            d = sorted(data, key = lambda x: float(x[2]), reverse = True)
-            if max_hits:
-                d = d[:max_hits]
-            for i in d:
-                if int(float(i[-1])) > bitscore \
-                  and int(1000*float(i[2])) > scale * pident \
-                  and float(i[-2]) <= evalue and int(1000*float(i[3])) > scale * ppos:
-                    ome_results[-1].append(i)
-    return ome_results
 
 def parseOutput_mmseqs(algorithm, ome, file_, bitscore = 0, pident = 0, 
                 evalue = 0, max_hits = None, ppos = None):
+    hits = filter_hits(read_hits(file_, ppos = False), bitscore, pident, 
+                       evalue, max_hits, None, 100000)
+    return ome, hits
 
-    ome_results = [ome, []]
-    if os.path.exists( file_ ):
-        with open( file_, 'r' ) as raw:
-            data = [x.rstrip().split('\t') for x in raw if x.rstrip()]
-        byq = defaultdict(list)
-        for d in data:
-            byq[d[0]].append(d)
-        # sort by percent identity (we denote everything before here as a homolog)
-        for q, data in byq.items():
-            d = sorted(data, key = lambda x: float(x[2]), reverse = True)
-            if max_hits:
-                d = d[:max_hits]
-            for i in d:
-                if int(float(i[-1])) > bitscore \
-                  and int(1000*float(i[2])) > 100000 * pident \
-                  and float(i[-2]) <= evalue:
-                    ome_results[-1].append(i)
-    return ome_results
+
+def star_parse(parse_args):
+    """Call a report parser on pool.imap arguments: (parser, *args)"""
+    return parse_args[0](*parse_args[1:])
+
+
+def merge_hits(parse_res, hits_path = None):
+    """Concatenate per-ome parsed hits into one table with an ome column,
+    writing each ome's hits to `hits_path` as they arrive"""
+
+    ome_hits = []
+    if hits_path:
+        with open(hits_path + '.tmp', 'w') as out:
+            out.write('ome\t' + '\t'.join(hit_cols) + '\n')
+    for ome, hits in parse_res:
+        if not len(hits):
+            continue
+        hits.insert(0, 'ome', ome)
+        ome_hits.append(hits)
+        if hits_path:
+            hits.reindex(columns = ['ome'] + hit_cols).to_csv(
+                hits_path + '.tmp', sep = '\t', header = False, 
+                index = False, mode = 'a'
+                )
+    if hits_path:
+        os.replace(hits_path + '.tmp', hits_path)
+    if ome_hits:
+        return pd.concat(ome_hits, ignore_index = True)
+    return pd.DataFrame(columns = ['ome'] + hit_cols)
+
+
+def compile_hits(hits, skip = []):
+    """{query: {ome: [[subject, start, end]]}} from a merged hits table"""
+
+    output_res = {}
+    for query, ome, subject, start, end in zip(
+        hits['query'], hits['ome'], hits['subject'], hits['start'], hits['end']
+        ):
+        if query not in output_res:
+            output_res[query] = {}
+        if ome not in output_res[query]:
+            output_res[query][ome] = []
+        output_res[query][ome].append([subject, start, end])
+
+    for query in skip:
+        del output_res[query]
+
+    return output_res
 
 
 def compileResults( res_dict, skip = [] ):
@@ -488,67 +1269,275 @@ def compileResults( res_dict, skip = [] ):
 
     return output_res
 
-def comp_mmseq_acc2fa(db, biotype, output_res, coords = False, skip = None):
+def comp_mmseq_acc2fa(output_res, coords = False):
+    """{query: {ome: [accessions]}} with `acc[START:END]` coordinates"""
  
-    cmd_tuples = []
-    fa_dict = {ome: row['faa'] for ome, row in db.set_index().items()}
+    q_accs = {}
     for q, ome_dict in output_res.items():
-        q_accs = []
-        if coords:
-            for ome, hit_list in ome_dict.items():
-                for hit, start, end in hit_list:
-                    q_accs.append(f'{hit}[{start}:{end}]')
-        else:
-            for ome, hit_list in ome_dict.items():
-                for hit, null0, null1 in hit_list:
-                    q_accs.append(f'{hit}')
-            
-        cmd_tuples.append((db, q, q_accs,))
+        q_accs[q] = {}
+        for ome, hit_list in ome_dict.items():
+            if coords:
+                q_accs[q][ome] = [f'{hit}[{start}:{end}]' \
+                                  for hit, start, end in hit_list]
+            else:
+                q_accs[q][ome] = [hit for hit, null0, null1 in hit_list]
   
-    return cmd_tuples 
-
-def mmseq_acc2fa(db, q, q_accs):
-    return q, acc2fa_db(db, q_accs)
-
-def comp_blast_acc2fa( db, biotype, output_res, coords = False, skip = None ):
-
-    acc2fa_cmds, db = {}, db.set_index('ome')
-    if coords or biotype == 'assembly':
-        for query in output_res:
-            if skip:
-                continue
-            acc2fa_cmds[query] = []
-            for i in output_res[query]:
-                accs = []
-                for hit in output_res[query][i]:
-                    accs.append(hit[0] + '[' + hit[1] + '-' + hit[2] + ']')
-                if biotype == 'assembly':
-                    acc2fa_cmds[query].append(
-                        [accs, db[i][biotype]]
-                        )
-                else:
-                    acc2fa_cmds[query].append(
-                        [accs, db[i][biotype]]
-                        )
-    else:
-        for query in output_res:
-            if skip:
+    return q_accs 
+
+def comp_blast_acc2fa(output_res, coords = False):
+    """{query: {ome: [accessions]}} with `acc[START-END]` coordinates"""
+
+    q_accs = {}
+    for query, ome_dict in output_res.items():
+        q_accs[query] = {}
+        for ome, hit_list in ome_dict.items():
+            if coords:
+                q_accs[query][ome] = [hit[0] + '[' + hit[1] + '-' + hit[2] + ']' \
+                                      for hit in hit_list]
+            else:
+                q_accs[query][ome] = list(dict.fromkeys(hit[0] for hit in hit_list))
+
+    return q_accs
+
+
+def read_search_manifest(report_dir):
+    """{ome: {'exit', 'size', 'md5'}} of completed searches from the
+    compacted manifest and the completion log appended since"""
+    manifest = {}
+    if os.path.isfile(report_dir + 'manifest.json'):
+        manifest = read_json(report_dir + 'manifest.json')
+    if os.path.isfile(report_dir + 'manifest.log'):
+        with open(report_dir + 'manifest.log', 'r') as raw:
+            for line in raw:
+                try:
+                    ome, info = json.loads(line)
+                except ValueError: # interrupted write
+                    continue
+                manifest[ome] = info
+    return manifest
+
+
+def log_search_manifest(report_dir, ome, exit):
+    """Record an ome's search exit status and report size/checksum"""
+    info = {'exit': exit}
+    report = report_dir + ome + '.tsv'
+    if not exit:
+        info['size'] = os.path.getsize(report)
+        info['md5'] = checksum(report, 'md5')
+    with open(report_dir + 'manifest.log', 'a') as out:
+        out.write(json.dumps([ome, info]) + '\n')
+        out.flush()
+        os.fsync(out.fileno())
+    return info
+
+
+def write_search_manifest(report_dir, manifest):
+    """Atomically compact the manifest and completion log"""
+    write_json(manifest, report_dir + 'manifest.json.tmp')
+    os.replace(report_dir + 'manifest.json.tmp', report_dir + 'manifest.json')
+    if os.path.isfile(report_dir + 'manifest.log'):
+        os.remove(report_dir + 'manifest.log')
+
+
+def report_complete(report, info):
+    if info.get('exit') or not os.path.isfile(report):
+        return False
+    elif os.path.getsize(report) != info['size']:
+        return False
+    return checksum(report, 'md5') == info['md5']
+
+
+def finish_report(report_dir, ome, exit, manifest = None):
+    """Move a successful ome's temporary report into place and record it"""
+    if not exit:
+        try:
+            os.replace(report_dir + ome + '.tsv.tmp', report_dir + ome + '.tsv')
+        except FileNotFoundError:
+            exit = 1
+    info = log_search_manifest(report_dir, ome, int(exit))
+    if manifest is not None:
+        manifest[ome] = info
+
+
+def hit_cache_dir():
+    """Content-addressed search hit cache in the MTDB data directory, or None
+    if it cannot be written"""
+    data_dir = format_path('$MYCOGFF3/../')
+    cache_dir = data_dir + 'hitcache/'
+    if not os.path.isdir(cache_dir):
+        if not os.access(data_dir, os.W_OK):
+            return None
+        os.makedirs(cache_dir, exist_ok = True)
+    elif not os.access(cache_dir, os.W_OK):
+        return None
+    return cache_dir
+
+
+def hit_cache_params(*params):
+    """Hash of the search parameters that determine a report"""
+    return hashlib.sha256(json.dumps(params).encode()).hexdigest()
+
+
+def seq_hash(seq):
+    return hashlib.sha256(seq.upper().encode()).hexdigest()
+
+
+def ome_checksums(ome2fa, cache_dir):
+    """{ome: md5} of each fasta, memoized on path, size, and modification
+    time"""
+    memo_path = cache_dir + 'checksums.json'
+    try:
+        memo = read_json(memo_path)
+    except (FileNotFoundError, ValueError):
+        memo = {}
+    ome2md5, update = {}, False
+    for ome, fa in ome2fa.items():
+        stat = os.stat(fa)
+        if fa in memo and memo[fa][:2] == [stat.st_size, stat.st_mtime]:
+            ome2md5[ome] = memo[fa][2]
+        else:
+            ome2md5[ome] = checksum(fa, 'md5')
+            memo[fa] = [stat.st_size, stat.st_mtime, ome2md5[ome]]
+            update = True
+    if update:
+        tmp_path = f'{memo_path}.{os.getpid()}.tmp'
+        write_json(memo, tmp_path)
+        os.replace(tmp_path, memo_path)
+    return ome2md5
+
+
+def hit_cache_path(cache_dir, q_hash, ome_md5, params):
+    key = hashlib.sha256(f'{q_hash}\t{ome_md5}\t{params}'.encode()).hexdigest()
+    return f'{cache_dir}{key[:2]}/{key}.tsv'
+
+
+def plan_hit_cache(rundb, biotype, query, report_dir, cache_dir, params):
+    """Look up each query/ome pair in the hit cache. Reports of fully cached
+    omes are written to `report_dir` as temporary reports, and the cached 
+    rows of partially cached omes are copied aside so they cannot be 
+    evicted before their search completes. Outputs [(query subset fasta,
+    [omes])] grouped by the queries each ome misses, {ome: {query: cache
+    path}}, and the fully cached omes"""
+
+    query_dict = fa2dict(query)
+    q_hashes = {q: seq_hash(v['sequence']) for q, v in query_dict.items()}
+    ome2fa = {ome: row[biotype] for ome, row in rundb.set_index('ome').items() \
+              if row[biotype]}
+    ome2md5 = ome_checksums(ome2fa, cache_dir)
+
+    cache_paths, missing, cached = {}, defaultdict(list), []
+    for ome, md5 in ome2md5.items():
+        cache_paths[ome], ome_missing, ome_rows = {}, [], []
+        for q, q_hash in q_hashes.items():
+            cache_path = hit_cache_path(cache_dir, q_hash, md5, params)
+            cache_paths[ome][q] = cache_path
+            try:
+                os.utime(cache_path) # least recently used eviction
+                with open(cache_path, 'r') as raw:
+                    ome_rows.extend(f'{q}\t{row}' for row in raw)
+            except FileNotFoundError: # absent or evicted
+                ome_missing.append(q)
+        if ome_missing:
+            missing[tuple(ome_missing)].append(ome)
+            with open(report_dir + ome + '.cache.tmp', 'w') as out:
+                out.write(''.join(ome_rows))
+        else:
+            with open(report_dir + ome + '.tsv.tmp', 'w') as out:
+                out.write(''.join(ome_rows))
+            cached.append(ome)
+
+    groups = []
+    for qs, omes in missing.items():
+        if len(qs) == len(query_dict):
+            groups.append((query, omes))
+            continue
+        q_path = report_dir + 'query.' \
+               + hashlib.md5('\n'.join(qs).encode()).hexdigest() + '.fa'
+        with open(q_path, 'w') as out:
+            out.write(dict2fa({q: query_dict[q] for q in qs}))
+        groups.append((q_path, omes))
+
+    return groups, cache_paths, cached
+
+
+def cache_report(report_dir, ome, cache_paths, searched = set()):
+    """Store the rows of an ome's temporary report in the cache by query, 
+    and append the cached rows that were set aside when planning. Outputs
+    the bytes added to the cache"""
+
+    report = report_dir + ome + '.tsv.tmp'
+    q_rows, added = defaultdict(list), 0
+    if searched:
+        with open(report, 'r') as raw:
+            for line in raw:
+                q, row = line.split('\t', 1)
+                q_rows[q].append(row)
+    for q in searched:
+        cache_path = cache_paths[q]
+        if not os.path.isdir(os.path.dirname(cache_path)):
+            os.makedirs(os.path.dirname(cache_path), exist_ok = True)
+        with open(f'{cache_path}.{os.getpid()}.tmp', 'w') as out:
+            out.write(''.join(q_rows[q]))
+        stat = os.stat(f'{cache_path}.{os.getpid()}.tmp')
+        added += max(stat.st_blocks * 512, stat.st_size)
+        os.replace(f'{cache_path}.{os.getpid()}.tmp', cache_path)
+
+    if os.path.isfile(report_dir + ome + '.cache.tmp'):
+        with open(report, 'a') as out, \
+            open(report_dir + ome + '.cache.tmp', 'r') as raw:
+            shutil.copyfileobj(raw, out)
+        os.remove(report_dir + ome + '.cache.tmp')
+
+    return added
+
+
+def write_cache_size(cache_dir, size):
+    write_json({'size': size}, f'{cache_dir}size.json.{os.getpid()}.tmp')
+    os.replace(f'{cache_dir}size.json.{os.getpid()}.tmp', 
+               cache_dir + 'size.json')
+
+
+def evict_hit_cache(cache_dir, max_size, added = None):
+    """Remove the least recently used cache entries until the cache is
+    under `max_size` bytes. The cache size is kept in a ledger, and the
+    cache is only scanned once the `added` bytes bring it over `max_size`"""
+
+    with file_lock(cache_dir + 'size.lock'):
+        try:
+            size = read_json(cache_dir + 'size.json')['size'] 
+        except (FileNotFoundError, ValueError, KeyError, TypeError):
+            size = None
+        if size is not None and added is not None \
+            and size + added <= max_size:
+            write_cache_size(cache_dir, size + added)
+            return 0
+
+        entries, size = [], 0
+        for sub_dir in os.scandir(cache_dir):
+            if not sub_dir.is_dir():
                 continue
-            acc2fa_cmds[query] = []
-            for i in output_res[query]:
-                accs = []
-                for hit in output_res[query][i]:
-                    subject = hit[0]
-                    accs.append(subject)
-                if accs:
-                    try:
-                        acc2fa_cmds[query].append( [
-                            list(set(accs)), db[i][biotype]
-                            ] )
-                    except KeyError:
-                        eprint('\t' + i + ' not in db')
-
-    return acc2fa_cmds
+            for entry in os.scandir(sub_dir.path):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError: # removed by another run
+                    continue
+                e_size = max(stat.st_blocks * 512, stat.st_size)
+                entries.append((stat.st_mtime, e_size, entry.path))
+                size += e_size
+
+        removed = 0
+        if size > max_size:
+            for mtime, e_size, path in sorted(entries):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                size -= e_size
+                removed += 1
+                if size <= max_size:
+                    break
+        write_cache_size(cache_dir, size)
+    return removed
 
 
 def prepOutput(out_dir):
@@ -607,6 +1596,9 @@ def db2searchLog(report_dir, blast, query, max_hits,
                 reports = collect_files(report_dir, 'tsv')
                 for r in reports:
                     os.remove(r)
+                for r in ['manifest.json', 'manifest.log']:
+                    if os.path.isfile(report_dir + r):
+                        os.remove(report_dir + r)
                 reparse = True
             prev = True
         elif log_list1[1] != log_list0[1] and log_list1[3:] != log_list0[3:]:
@@ -634,11 +1626,23 @@ def prepare_search_run(
     report_dir = log_list0[0]
     if prev:
   #      reparse = False
-        reports = collect_files(report_dir, 'tsv')
-        finished = {
-            os.path.basename(x)[:-4] for x in reports \
-            if os.path.getsize(x) > 0
-            }
+        for tmp_report in collect_files(report_dir, 'tsv.tmp'):
+            os.remove(tmp_report)
+        manifest = read_search_manifest(report_dir)
+        if manifest:
+            finished = {
+                ome for ome, info in manifest.items() \
+                if report_complete(report_dir + ome + '.tsv', info)
+                }
+            write_search_manifest(report_dir, 
+                                  {k: v for k, v in manifest.items() \
+                                   if k in finished})
+        else: # reports predating the manifest
+            reports = collect_files(report_dir, 'tsv')
+            finished = {
+                os.path.basename(x)[:-4] for x in reports \
+                if os.path.getsize(x) > 0
+                }
         rundb, checkdb = mtdb({}).set_index('ome'), db.set_index('ome')
         for ome, val in checkdb.items():
             if ome not in finished:
@@ -652,9 +1656,9 @@ def prepare_search_run(
 def prep_mmseq_output(rundb, report_dir, queries, convert = False):
     ome_res = defaultdict(str)
     for i, q in enumerate(queries):
-        if not os.path.isfile(f'{report_dir}{q}.tsv'):
+        if not os.path.isfile(query_report(report_dir, q)):
             continue
-        with open(f'{report_dir}{q}.tsv', 'r') as raw:
+        with open(query_report(report_dir, q), 'r') as raw:
             base = os.path.basename(q)
             if not convert:
                 for line in raw:
@@ -669,7 +1673,7 @@ def prep_mmseq_output(rundb, report_dir, queries, convert = False):
                     ome_res[ome] += '\t'.join(line_d) + '\n'
     
     for ome, out_str in ome_res.items():
-        with open(f'{report_dir}{ome}.tsv', 'r') as out:
+        with open(f'{report_dir}{ome}.tsv', 'w') as out:
             out.write(out_str.rstrip())
 
     
@@ -703,31 +1707,104 @@ def ObyOsearch(
     db, rundb, blast, seq_type, report_dir, biotype,
     query, hsps, max_hits, evalue, cpus,
     bitscore, pident, coverage, diamond, search_arg,
-    reparse = False, ppos = 0
+    reparse = False, ppos = 0, hits_path = None, merged = False,
+    cache_dir = None, cache_size = None
     ):
+    scale = 100000
     if len(rundb) > 0:
-        print('\nSearching on an ome-by-ome basis', flush = True)
-        if diamond:
-            db_tups, search_tups = comp_diamond_tups(
-                rundb, diamond, blast, seq_type, report_dir, biotype, query,
-                hsps = hsps, evalue = evalue,
-                coverage = coverage*100, search_args = search_arg,
-                )
-            db_outs = multisub(db_tups, processes = cpus)
-            print(f'\t{len(search_tups)} searches to run', flush = True)
-            search_outs = multisub(search_tups, processes = cpus, 
-                                    verbose = 2, injectable = True)
-            scale = 100000
+        manifest = read_search_manifest(report_dir)
+        if diamond and merged:
+            run_omes = [x for i, x in enumerate(rundb['ome']) if rundb[biotype][i]]
+            print('\nSearching merged DIAMOND db', flush = True)
+            if merged_dmnd_search(
+                rundb, diamond, blast, report_dir, query, hsps = hsps,
+                evalue = evalue, coverage = coverage*100, 
+                search_args = search_arg, cpus = cpus
+                ):
+                sys.exit(10)
+            for ome in run_omes:
+                finish_report(report_dir, ome, 0, manifest)
         else:
-            search_tups = comp_blast_tups(
-                rundb, blast, seq_type, 
-                report_dir, biotype, query, 
-                hsps = hsps, evalue = evalue,
-                coverage = coverage*100, search_args = search_arg
-                )
-            search_outs = multisub(search_tups, processes = cpus, 
-                                    verbose = 2, shell = True, injectable = True)
-            scale = 100000
+            cache_paths, searched = {}, {}
+            if cache_dir:
+                params = hit_cache_params(blast, bool(diamond), hsps, evalue,
+                                          coverage, search_arg)
+                groups, cache_paths, cached = plan_hit_cache(
+                    rundb, biotype, query, report_dir, cache_dir, params
+                    )
+                for ome in cached:
+                    finish_report(report_dir, ome, 0, manifest)
+                print(f'\t{len(cached)} omes retrieved from hit cache', 
+                      flush = True)
+            else:
+                groups = [(query, list(rundb['ome']))]
+
+            print('\nSearching on an ome-by-ome basis', flush = True)
+            # DIAMOND threads per search so concurrent searches fill `cpus`
+            search_threads = max(1, cpus // max(1, sum(len(x[1]) for x in groups)))
+            search_tups, db_tups, run_omes = [], [], []
+            for q_path, omes in groups:
+                q_rundb, checkdb = mtdb({}).set_index('ome'), rundb.set_index('ome')
+                for ome in omes:
+                    q_rundb[ome] = checkdb[ome]
+                q_rundb = q_rundb.reset_index()
+                if diamond:
+                    q_db_tups, q_search_tups = comp_diamond_tups(
+                        q_rundb, diamond, blast, seq_type, report_dir, biotype,
+                        q_path, hsps = hsps, evalue = evalue,
+                        coverage = coverage*100, search_args = search_arg,
+                        threads = search_threads
+                        )
+                    db_tups.extend(q_db_tups)
+                else:
+                    q_search_tups = comp_blast_tups(
+                        q_rundb, blast, seq_type, 
+                        report_dir, biotype, q_path, 
+                        hsps = hsps, evalue = evalue,
+                        coverage = coverage*100, search_args = search_arg
+                        )
+                search_tups.extend(q_search_tups)
+                q_omes = [x for i, x in enumerate(q_rundb['ome']) \
+                          if q_rundb[biotype][i]]
+                run_omes.extend(q_omes)
+                if q_path != query:
+                    searched.update({ome: set(fa2dict(q_path)) for ome in q_omes})
+                else:
+                    searched.update({ome: set(cache_paths.get(ome, {})) \
+                                     for ome in q_omes})
+            rundb = rundb.set_index('ome')
+            db_sizes = [rundb[ome][biotype] for ome in run_omes] # largest first
+            rundb = rundb.reset_index()
+
+            cache_added = {'size': 0}
+            def checkpoint(i, res):
+                ome = run_omes[i]
+                if cache_dir and not res['exit'] \
+                    and os.path.isfile(report_dir + ome + '.tsv.tmp'):
+                    cache_added['size'] += cache_report(report_dir, ome, 
+                                                        cache_paths[ome], 
+                                                        searched[ome])
+                finish_report(report_dir, ome, res['exit'], manifest)
+
+            print(f'\t{len(search_tups)} searches to run', flush = True)
+            if diamond:
+                db_outs = multisub(db_tups, processes = cpus, cpus = cpus,
+                                   threads = 2, sizes = db_sizes)
+                search_outs = multisub(search_tups, processes = cpus, cpus = cpus,
+                                       threads = search_threads,
+                                       sizes = db_sizes, verbose = 2, 
+                                       injectable = True, callback = checkpoint)
+            else:
+                search_outs = multisub(search_tups, processes = cpus, cpus = cpus,
+                                       sizes = db_sizes, verbose = 2, shell = True,
+                                       injectable = True, callback = checkpoint)
+            if cache_dir and cache_size is not None:
+                evict_hit_cache(cache_dir, cache_size, cache_added['size'])
+        write_search_manifest(report_dir, manifest)
+        failed = [ome for ome in manifest if manifest[ome]['exit']]
+        if failed:
+            eprint(f'\tWARNING: {len(failed)} searches failed and will be ' \
+                 + 'rerun upon resuming', flush = True)
    
     # prepare report parsing commands for multiprocessing
     parse_tups = []
@@ -740,17 +1817,19 @@ def ObyOsearch(
 
     print('\nParsing reports', flush = True)
     with mp.get_context('spawn').Pool(processes = cpus) as pool:
-        results = pool.starmap(parseOutput, tuple(parse_tups))
-    results_dict = {x[0]: x[1] for x in results}
+        # merge each report as it is parsed rather than after all complete
+        hits = merge_hits(pool.imap(star_parse, 
+                                    ((parseOutput, *x) for x in parse_tups)),
+                          hits_path)
 
-    return results_dict
+    return hits
 
 
 def mmseqs_mngr(
     db, rundb, mmseqs, report_dir, biotype,
     query, max_hits, evalue, cpus,
     bitscore, pident, coverage, search_arg,
-    convert = False, reparse = False
+    convert = False, reparse = False, hits_path = None
     ):
 
     run_mmseq(
@@ -771,10 +1850,11 @@ def mmseqs_mngr(
                 bitscore, pident, evalue, max_hits])
 
     with mp.get_context('spawn').Pool(processes = cpus) as pool:
-        results = pool.starmap(parseOutput_mmseqs, tuple(parse_tups))
-    results_dict = {x[0]: x[1] for x in results}
+        hits = merge_hits(pool.imap(star_parse, 
+                                    ((parseOutput_mmseqs, *x) for x in parse_tups)),
+                          hits_path)
 
-    return results_dict
+    return hits
 
 
 
@@ -908,26 +1988,24 @@ def mmseqs_main(
 
 
 
-    rundb, reparse = prepare_search_run(
+    rundb, reparse, report_dir = prepare_search_run(
         db, report_dir, mmseqs, query, 
         max_hits, evalue, out_dir, bitscore, pident,
-        coverage
+        coverage, None
         )
-    results_dict = mmseqs_mngr(
+    hits = mmseqs_mngr(
         db, rundb, mmseqs, report_dir, biotype,
         query, max_hits, evalue, cpus,
         bitscore, pident, coverage, search_arg,
-        convert = convert, reparse = reparse
+        convert = convert, reparse = reparse, hits_path = out_dir + 'hits.tsv'
         )
 
     print('\nCompiling fastas', flush = True)
-    output_res = compileResults(results_dict, skip)
-    output_fas = {}
-    acc2fa_cmds = comp_mmseq_acc2fa(db, biotype, output_res, 
-                                    coords = coordinate, skip = None)
-    with mp.get_context('spawn').Pool(processes = cpus) as pool:
-        results = pool.starmap(mmseq_acc2fa, acc2fa_cmds)
-    output_fas = {q: v for q, v in results}
+    output_res = compile_hits(hits, skip)
+    q_accs = comp_mmseq_acc2fa(output_res, coords = coordinate)
+    output_fas = bulk_acc2fa(q_accs, {ome: row['faa'] \
+                                      for ome, row in db.set_index('ome').items()},
+                             cpus = cpus)
     
     return output_fas
 
@@ -940,7 +2018,8 @@ def blast_main(
     pident = 0, coverage = None,
     cpus = 1, force = False,
     skip = [], diamond = None, coordinate = False,
-    search_arg = [], ppos = 0
+    search_arg = [], ppos = 0, merged_dmnd = False, hit_cache = True,
+    cache_size = 10
     ):
 
        
@@ -985,32 +2064,28 @@ def blast_main(
             pident = pident, max_hits = max_hits,
             ppos = ppos
             )
+        output_res = compileResults(results_dict, skip)
     else:
         rundb, reparse, report_dir = prepare_search_run(
             db, report_dir, blast, query, 
             max_hits, evalue, out_dir, bitscore, pident,
             coverage, ppos
             )
-        results_dict = ObyOsearch(
+        hits = ObyOsearch(
             db, rundb, blast, None, report_dir, biotype,
             query, hsps, max_hits, evalue, cpus,
             bitscore, pident, coverage, diamond, search_arg,
-            reparse = reparse, ppos = ppos
+            reparse = reparse, ppos = ppos, hits_path = out_dir + 'hits.tsv',
+            merged = merged_dmnd, cache_dir = hit_cache_dir() if hit_cache else None,
+            cache_size = cache_size * 10**9
             )
+        output_res = compile_hits(hits, skip)
 
     print('\nCompiling fastas', flush = True)
-    output_res = compileResults(results_dict, skip)
-    output_fas = {}
-    acc2fa_cmds = comp_blast_acc2fa(db, biotype, output_res, 
-                             coords = coordinate, skip = None)
-    queryfa = fa2dict(query)
-    for query1, cmd in acc2fa_cmds.items():
-        output_fas[query1] = {}
-        print('\t' + query1, flush = True)
-        with mp.get_context('spawn').Pool(processes = cpus) as pool:
-            results = pool.starmap(acc2fa_fa, acc2fa_cmds[query1])
-        for x in results:
-            output_fas[query1].update(x)
+    q_accs = comp_blast_acc2fa(output_res, coords = coordinate)
+    output_fas = bulk_acc2fa(q_accs, {ome: row[biotype] \
+                                      for ome, row in db.set_index('ome').items()},
+                             mtdb_coords = False, cpus = cpus)
 
     return output_fas
 
@@ -1042,6 +2117,8 @@ def cli():
         help = '[mmseqs] Subject sequence type {aa, nt}')
     sa_arg.add_argument('--diamond', action = 'store_true',
         help = '[blast] Use diamond. Not recommended for ome-by-ome')
+    sa_arg.add_argument('--merged_db', action = 'store_true',
+        help = '[diamond] Search one cached DIAMOND db of all omes')
 
     p_arg = parser.add_argument_group('Search parameters')
     p_arg.add_argument('-e', '--evalue', help = 'E value threshold, e.g. ' \
@@ -1065,12 +2142,20 @@ def cli():
         help = '[mmseqs] Additional search arguments in quotes')
     p_arg.add_argument('--acc', action = 'store_true', default = False, \
         help = '[hmmer] Extract accessions instead of queries (Pfam)' )
+    p_arg.add_argument('--shard', action = 'store_true', 
+        help = '[hmmer] Search concatenated proteome shards, one per CPU')
+    p_arg.add_argument('--report', action = 'store_true',
+        help = '[hmmer] Output full-text hmmsearch reports per ome')
 
     r_arg = parser.add_argument_group('Runtime options')
     r_arg.add_argument('-v', '--verbose', action = 'store_true')
     r_arg.add_argument('-o', '--output')
     r_arg.add_argument('-c', '--cpu', type = int)
     r_arg.add_argument('--ram', help = 'Useful for mmseqs: e.g. 10M or 5G')
+    r_arg.add_argument('--no_cache', action = 'store_true',
+        help = '[blast] Do not use or update the MTDB hit cache')
+    r_arg.add_argument('--cache_size', type = float, default = 10,
+        help = '[blast] Max hit cache GB; DEFAULT: 10')
 
     #parser.add_argument( '-c', '--coverage', type = float, help = 'Query coverage +/-, e.g. 0.5' )
 #    parser.add_argument('-f', '--force', action = 'store_true', help = 'Force ome-by-ome blast')
@@ -1109,6 +2194,9 @@ def cli():
             sys.exit(4)
         del deps[0]
         deps.append('diamond')
+    elif args.merged_db:
+        eprint('\nERROR: --merged_db requires --diamond', flush = True)
+        sys.exit(4)
 
     # mmseqs-specific 
     if args.algorithm == 'mmseqs':
@@ -1167,7 +2255,10 @@ def cli():
         'Min bitscore': args.bitscore, 'Min identity': args.identity,
         'Min positives': args.positives,
         'Coordinate extract': args.coordinate, 'Iterations': args.iterations,
-        'HMM accession': args.acc, 'Diamond': args.diamond,
+        'HMM accession': args.acc, 'HMM shards': args.shard,
+        'HMM reports': args.report,
+        'Diamond': args.diamond,
+        'Merged DIAMOND db': args.merged_db, 'Hit cache': not args.no_cache,
         'Output': output, 'CPUs': cpu
         }
     start_time = intro('db2search', args_dict)
@@ -1179,7 +2270,8 @@ def cli():
         output_fas = hmmer_main(db, queries, output, 
              args.acc, args.max_hits, args.query_thresh,
              evalue = evalue, bitscore = args.bitscore, binary = args.algorithm,
-             coords = args.coordinate, verbose = args.verbose, cpu = cpu)    
+             coords = args.coordinate, verbose = args.verbose, cpu = cpu,
+             shard = args.shard, report = args.report)    
     # run blast mode
     elif 'blast' in args.algorithm.lower():
         output_fas = blast_main( 
@@ -1187,7 +2279,10 @@ def cli():
             bitscore = args.bitscore, pident = args.identity,
             max_hits = args.max_hits, cpus = cpu, force = True,
             search_arg = manual_cmd, coordinate = args.coordinate, 
-            coverage = args.query_thresh, ppos = args.positives
+            coverage = args.query_thresh, ppos = args.positives,
+            diamond = 'diamond' if args.diamond else None, 
+            merged_dmnd = args.merged_db, hit_cache = not args.no_cache,
+            cache_size = args.cache_size
             )
     # run mmseqs
     else:
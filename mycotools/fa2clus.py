@@ -9,6 +9,7 @@ import os
 import re
 import sys
 import copy
+import bisect
 import shutil
 import string
 import random
@@ -16,7 +17,10 @@ import tempfile
 import argparse
 import itertools
 import subprocess
+import numpy as np
 import pandas as pd
+from scipy import sparse
+from scipy.sparse.csgraph import minimum_spanning_tree
 from collections import defaultdict
 from mycotools.lib.kontools import multisub, findExecs, format_path, \
     eprint, vprint, read_json, write_json, mkOutput, fmt_float
@@ -32,7 +36,7 @@ class ClusterParameterError(Exception):
 def run_mmseqs(fa_path, res_base, wrk_dir, algorithm = 'mmseqs easy-linclust',
                  min_id = 0.3, clus_const = 0.5, cpus = 1, verbose = False):
     res_path = res_base + '_cluster.tsv'
-    tmp_dir = os.path.dirname(res_path) + '/tmp/'
+    tmp_dir = res_base + '_tmp/'
     if verbose:
         stdout, stderr = None, None
     else:
@@ -61,6 +65,67 @@ def run_mmseqs(fa_path, res_base, wrk_dir, algorithm = 'mmseqs easy-linclust',
         shutil.rmtree(tmp_dir)
     return res_path
 
+def run_mmseqs_cmd(cmd, verbose = False):
+    if verbose:
+        stdout, stderr = None, None
+    else:
+        stdout = subprocess.DEVNULL
+        stderr = subprocess.DEVNULL
+    mmseqs_exit = subprocess.call([str(x) for x in cmd], 
+                                  stdout = stdout, stderr = stderr)
+    if mmseqs_exit:
+        raise ClusteringError('Clustering failed: ' + str(mmseqs_exit) \
+                            + ' ' + str(cmd))
+
+
+def mmseqs_aln(fa_path, aln_base, algorithm = 'mmseqs easy-linclust',
+               clus_const = 0.5, cpus = 1, verbose = False):
+    """Build the sequence db and all-vs-all alignment of `fa_path` at
+    coverage `clus_const` once; identity thresholds are applied afterward
+    by mmseqs_clust"""
+
+    seq_db, aln_db = aln_base + '.seqdb', aln_base + '.aln'
+    if os.path.isfile(aln_db + '.index'):
+        return seq_db, aln_db
+    mmseqs, pref_db = algorithm.split(' ')[0], aln_base + '.pref'
+    run_mmseqs_cmd([mmseqs, 'createdb', fa_path, seq_db,
+                    '--createdb-mode', '0'], verbose)
+    if algorithm.endswith('linclust'):
+        run_mmseqs_cmd([mmseqs, 'kmermatcher', seq_db, pref_db,
+                        '--threads', cpus, '--cov-mode', '0',
+                        '-c', clus_const], verbose)
+    else:
+        run_mmseqs_cmd([mmseqs, 'prefilter', seq_db, seq_db, pref_db,
+                        '--threads', cpus, '-s', '7.5'], verbose)
+    run_mmseqs_cmd([mmseqs, 'align', seq_db, seq_db, pref_db, aln_db + '_tmp',
+                    '--threads', cpus, '--compressed', '1',
+                    '--cov-mode', '0', '-c', clus_const, '-e', '0.1',
+                    '--alignment-mode', '3', '--min-seq-id', '0'], verbose)
+    run_mmseqs_cmd([mmseqs, 'rmdb', pref_db], verbose)
+    run_mmseqs_cmd([mmseqs, 'mvdb', aln_db + '_tmp', aln_db], verbose)
+    return seq_db, aln_db
+
+
+def mmseqs_clust(seq_db, aln_db, res_base, min_id = 0.3, 
+                 mmseqs = 'mmseqs', cpus = 1, verbose = False):
+    """Cluster a precomputed alignment at `min_id` identity"""
+
+    res_path = res_base + '_cluster.tsv'
+    flt_db, clu_db = res_base + '.aln', res_base + '.clu'
+    run_mmseqs_cmd([mmseqs, 'filterdb', aln_db, flt_db,
+                    '--filter-column', '3', '--comparison-operator', 'ge',
+                    '--comparison-value', fmt_float(min_id),
+                    '--threads', cpus], verbose)
+    run_mmseqs_cmd([mmseqs, 'clust', seq_db, flt_db, clu_db,
+                    '--threads', cpus], verbose)
+    run_mmseqs_cmd([mmseqs, 'createtsv', seq_db, seq_db, clu_db,
+                    res_path + '.tmp'], verbose)
+    os.replace(res_path + '.tmp', res_path)
+    for db in [flt_db, clu_db]:
+        run_mmseqs_cmd([mmseqs, 'rmdb', db], verbose)
+    return res_path
+
+
 def parse_mmseqs_clus(res_path):
     derivations = defaultdict(list)
     with open(res_path, 'r') as raw:
@@ -124,53 +189,79 @@ def runDmnd(
             )
     return outputFile, dmndCode
 
+class DistanceGraph:
+    """Sparse symmetric distance matrix of integer-coded sequences. Only
+    edges are stored (upper triangle, CSR); absent pairs are `missing`
+    distance apart. Zero distances are stored as the smallest positive float
+    because sparse graphs treat zeros as absent edges"""
+
+    zero = np.finfo(float).tiny
+
+    def __init__(self, labels, rows, cols, dists, missing = 1.0):
+        self.labels, self.missing = list(labels), missing
+        n = len(self.labels)
+        i, j = np.minimum(rows, cols), np.maximum(rows, cols)
+        dists = np.asarray(dists, dtype = float)
+        # retain the minimum distance of reciprocal/duplicate hits
+        order = np.lexsort((dists, j, i))
+        i, j, dists = i[order], j[order], dists[order]
+        first = np.ones(len(i), dtype = bool)
+        first[1:] = (i[1:] != i[:-1]) | (j[1:] != j[:-1])
+        dists = np.where(dists[first] > 0, dists[first], self.zero)
+        self.matrix = sparse.coo_matrix((dists, (i[first], j[first])),
+                                        shape = (n, n)).tocsr()
+
+    def __len__(self):
+        return len(self.labels)
+
+    def dense(self):
+        """n x n DataFrame with `missing` filled and a zero diagonal"""
+        mtx = np.full((len(self), len(self)), self.missing)
+        coo = self.matrix.tocoo()
+        dists = np.where(coo.data > self.zero, coo.data, 0.0)
+        mtx[coo.row, coo.col] = dists
+        mtx[coo.col, coo.row] = dists
+        np.fill_diagonal(mtx, 0.0)
+        return pd.DataFrame(mtx, index = self.labels, columns = self.labels)
+
+
+def read_dist_edges(file_, labels = None):
+    """Integer-code the first two columns of a tab-delimited distance file.
+    Outputs sorted labels, query indices, subject indices, and values of
+    the non-self edges; sequences with only a self distance are labeled"""
+    edges = pd.read_csv(file_, sep = '\t', header = None, usecols = [0, 1, 2],
+                        names = ['q', 's', 'v'], 
+                        dtype = {'q': str, 's': str, 'v': float})
+    labels, codes = np.unique(np.concatenate([edges['q'].values, 
+                                              edges['s'].values]),
+                              return_inverse = True)
+    rows, cols = codes[:len(edges)], codes[len(edges):]
+    other = rows != cols
+    return labels, rows[other], cols[other], edges['v'].values[other]
+
+
 def rd_dmnd_distmtx( outputFile, minVal, pid = True ):
-    """Read a diamond output as a distance matrix"""
-
-    dist_dict = {}
-    with open(outputFile, 'r') as raw:
-        if pid:
-            for line in raw:
-                q, s, v0 = line.rstrip().split('\t')
-                v = round(float(v0))
-                if q == s:
-                    continue
-                if v > minVal:
-                    if q not in dist_dict:
-                        dist_dict[q] = {}
-                        dist_dict[q][q] = 0.0
-                    if s not in dist_dict:
-                        dist_dict[s] = {}
-                        dist_dict[s][s] = 0.0
-                    dist_dict[q][s] = 100 - v
-                    dist_dict[s][q] = 100 - v
-            distance_matrix = pd.DataFrame(dist_dict).sort_index(1).sort_index(0).fillna(100)
-        else:
-             for line in raw:
-                q, s, v0 = line.rstrip().split('\t')
-                v = float(v0)
-                if q == s:
-                    continue
-                if v > minVal:
-                    if q not in dist_dict:
-                        dist_dict[q] = {}
-                        dist_dict[q][q] = 0.0
-                    if s not in dist_dict:
-                        dist_dict[s] = {}
-                        dist_dict[s][s] = 0.0
-             distance_matrix = pd.DataFrame(dist_dict).sort_index(1).sort_index(0).fillna(0)
+    """Read a diamond output as a sparse DistanceGraph of hits above 
+    `minVal`; identity is converted to distance (100 - pident)/100, 
+    bitscore is min-max normalized to 1 - score. Sequences without a 
+    passing hit are singletons"""
 
+    labels, rows, cols, vals = read_dist_edges(outputFile)
+    if pid:
+        vals = np.round(vals)
+    passing = vals > minVal
+    rows, cols, vals = rows[passing], cols[passing], vals[passing]
 
     if pid:
-        distance_matrix /= 100
+        dists = (100 - vals) / 100
+    elif len(vals):
+        minV, maxV = vals.min(), vals.max()
+        denom = (maxV - minV) or 1
+        dists = 1 - (vals - minV) / denom
     else:
-        minV, maxV = min(distance_matrix), max(distance_matrix)
-        denom = maxV - minV
-        distance_matrix -= minV
-        distance_matrix /= denom
-        distance_matrix = 1 - distance_matrix
+        dists = vals
 
-    return distance_matrix #, outMatrix
+    return DistanceGraph(labels, rows, cols, dists, missing = 1.0)
 
 def runUsearch( fasta, output, clus_var, cpus = 1, verbose = False ):
 
@@ -193,29 +284,13 @@ def runUsearch( fasta, output, clus_var, cpus = 1, verbose = False ):
 
 def rd_usrch_distmtx( dis_path, sep = '\t' ):
     '''Imports a distance matrix with each line formatted as `organism $SEP organism $SEP distance`.
-    - this is equivalent to the `-tabbedout` argument in `usearch -calc_distmx`. The function 
-    compiles a dictionary with the information and reciprocal information for each organism in each
-    line, then converts this dictionary of dictionaries into a pandas dataframe. As a distance matrix,
-    NA values are converted to maximum distance (1).'''
-
-    distance_matrix = pd.DataFrame()
-    with open( dis_path, 'r' ) as raw:
-        data = raw.read()
-    prepData = [ x.rstrip() for x in data.split('\n') if x != '' ]
-
-    dist_dict = {}
-    for line in prepData:
-        vals = line.split( sep )
-        if vals[0] not in dist_dict:
-            dist_dict[ vals[0] ] = {}
-        if vals[1] not in dist_dict:
-            dist_dict[ vals[1] ] = {}
-        dist_dict[ vals[0] ][ vals[1] ] = float(vals[2])
-        dist_dict[ vals[1] ][ vals[0] ] = float(vals[2])
-
-    distance_matrix = pd.DataFrame( dist_dict ).sort_index(0).sort_index(1)
-
-    return distance_matrix.fillna( 1.0 )
+    - this is equivalent to the `-tabbedout` argument in `usearch -calc_distmx`. The function
+    integer-codes each organism into a sparse DistanceGraph; absent pairs are maximum 
+    distance (1).'''
+
+    labels, rows, cols, dists = read_dist_edges(dis_path)
+
+    return DistanceGraph(labels, rows, cols, dists, missing = 1.0)
 
 def scikitaggd( distance_matrix, maxDist = 0.6, linkage = 'single' ):
     '''Performs agglomerative clustering and extracts the cluster labels, then sorts according to
@@ -270,18 +345,64 @@ def runMCL(distMat, inflation):
 
     return clusters
 
+def sparse_single_linkage(dist_graph):
+    '''SciPy linkage matrix of single-linkage clustering from the minimum
+    spanning tree of a sparse DistanceGraph; unconnected components join at
+    the missing distance.'''
+
+    n = len(dist_graph)
+    mst = minimum_spanning_tree(dist_graph.matrix).tocoo()
+    order = np.argsort(mst.data, kind = 'stable')
+    edges = [(mst.row[k], mst.col[k], mst.data[k]) for k in order]
+    edges = [(i, j, d if d > dist_graph.zero else 0.0) for i, j, d in edges]
+    edges.extend((0, j, dist_graph.missing) for j in range(1, n))
+
+    parent, node, size = list(range(n)), list(range(n)), [1 for x in range(n)]
+    def find(x):
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    linkage_matrix, new_node = [], n
+    for i, j, d in edges:
+        ri, rj = find(i), find(j)
+        if ri == rj:
+            continue
+        parent[rj] = ri
+        size[ri] += size[rj]
+        linkage_matrix.append([min(node[ri], node[rj]), max(node[ri], node[rj]),
+                               d, size[ri]])
+        node[ri] = new_node
+        new_node += 1
+        if new_node == 2*n - 1:
+            break
+
+    return np.array(linkage_matrix, dtype = float)
+
+
+def aggd_linkage(dist_graph, method = 'single', dense_max = 2000):
+    '''Linkage matrix of a DistanceGraph. Single linkage of more than 
+    `dense_max` sequences is computed on the sparse graph, otherwise the
+    condensed dense matrix is used.'''
+
+    if method == 'single' and len(dist_graph) > dense_max:
+        return sparse_single_linkage(dist_graph)
+    squareform_matrix = squareform(dist_graph.dense().values)
+    return hierarchy.linkage(squareform_matrix, method)
+
+
 def scipyaggd( distMat, maxDist, method = 'single' ):
     '''Performs agglomerative clustering using SciPy and extracts the cluster labels, then sorts
     according to cluster number.'''
 
-    squareform_matrix = squareform(distMat.values)
-    linkage_matrix = hierarchy.linkage(squareform_matrix, method)
+    linkage_matrix = aggd_linkage(distMat, method)
     tree = hierarchy.to_tree(linkage_matrix)
     fcluster = hierarchy.fcluster(
         linkage_matrix, maxDist, 
         criterion = 'distance'
         )
-    clusters = getClusterLabels(distMat.index, fcluster)
+    clusters = getClusterLabels(distMat.labels, fcluster)
 
     return clusters, tree
 
@@ -309,7 +430,8 @@ def readLog(log_path, newLog):
         newLog['iterations'] = oldLog['iterations']
         newLog['successes'] = oldLog['successes']
         for i in newLog['iterations']:
-            i['cluster'] = tuple(i['cluster'])
+            if 'cluster' in i:
+                i['cluster'] = tuple(i['cluster'])
         for i in newLog['successes']:
             i['cluster'] = tuple(i['cluster'])
     elif newLog['distance_matrix']:
@@ -332,210 +454,241 @@ def sort_iterations(iterations, reverse = True):
                     }], key = lambda x: (x['size'], x['cluster_variable']),
                     reverse = reverse)
 
+def gallop_search(pred, start, last):
+    """Lowest index of [0, `last`] at which a monotone (False then True)
+    `pred` holds, galloping from `start` and then bisecting; `last` + 1 if
+    it never holds"""
+
+    if pred(start):
+        lo, hi, step = -1, start, 1
+        while hi > 0:
+            i = max(hi - step, 0)
+            if pred(i):
+                hi, step = i, step*2
+            else:
+                lo = i
+                break
+    else:
+        lo, hi, step = start, last + 1, 1
+        while lo < last:
+            i = min(lo + step, last)
+            if pred(i):
+                hi = i
+                break
+            lo, step = i, step*2
+    while hi - lo > 1:
+        mid = (lo + hi) // 2
+        if pred(mid):
+            hi = mid
+        else:
+            lo = mid
+    return hi
+
+
 def cluster_iter_mmseqs(params, min_seq, max_seq, clus_const, clus_var,
                interval, min_var, max_var, log_dict, log_path, 
                focal_gene = None, verbose = False, spacer = '\t', 
                cpus = 1):
+    """Gallop then bisect the minimum identity in `interval` steps between
+    `min_var` and `max_var` for the largest focal gene cluster of `min_seq`
+    to `max_seq` genes. The alignment is computed once, so each step only
+    reruns mmseqs clust"""
 
-    oldDirection, attempt = None, 0
+    if not min_var <= clus_var <= max_var:
+        write_json(log_dict, log_path)
+        raise ClusterParameterError('failed to run with given parameters')
     if focal_gene:
         res_base = params['dir'] + 'working/' + focal_gene
     else:
         res_base = params['dir'] + 'working/' \
                  + re.sub(r'\.[^\.]+$', '', params['fa']) 
-    while clus_var >= min_var and clus_var <= max_var:
-        attempt += 1
+    aln_base = res_base + '_c' + str(round(clus_const*1000) / 1000)
+    steps = int(round((max_var - min_var) / interval))
+    grid = [round((min_var + i*interval)*1000) / 1000 for i in range(steps + 1)]
+    start = min(range(len(grid)), key = lambda i: abs(grid[i] - clus_var))
+
+    dbs, evals = [], {}
+    def focal_size(i):
+        if i in evals:
+            return evals[i]['size']
         name = '_c' + str(round(clus_const*1000) / 1000) \
-             + '_v' + str(round(clus_var*1000) / 1000)
-        res_info = res_base + name
-        res_path = res_info + '_cluster.tsv'
+             + '_v' + str(grid[i])
+        res_path = res_base + name + '_cluster.tsv'
         if not os.path.isfile(res_path):
-            run_mmseqs(params['fa'], res_info, 
-                       params['dir'] + 'working/',
-                       algorithm = params['bin'],
-                       min_id = clus_var, verbose = verbose,
-                       clus_const = params['clus_const'], cpus = cpus)
+            if not dbs:
+                dbs.extend(mmseqs_aln(params['fa'], aln_base, params['bin'],
+                                      params['clus_const'], cpus, verbose))
+            mmseqs_clust(dbs[0], dbs[1], res_base + name, grid[i],
+                         mmseqs = params['bin'].split(' ')[0], cpus = cpus,
+                         verbose = verbose)
         cluster_dict, clusters = parse_mmseqs_clus(res_path)
         cluster = cluster_dict[clusters[focal_gene]]
-        focal_len = len(cluster) 
-
-        vprint('\nITERATION ' + str(attempt) + ': ' + focal_gene \
-             + ' cluster size: ' + str(focal_len), flush = True, v = verbose)
-        vprint('Cluster parameter: ' + str(clus_var), flush = True, v = verbose)
-        iteration_dict = {'size': focal_len, 'cluster_variable': clus_var,
-                          'cluster': tuple(cluster)}
-        log_dict['iterations'].append(iteration_dict)
-        log_dict['iterations'] = sort_iterations(log_dict['iterations'])
-        if focal_len >= min_seq: # if greater than minimum sequences
-            if max_seq: # if there is a max set of sequences
-                if focal_len <= max_seq: # if less than max sequences
-                    vprint(spacer + '\tSUCCESS!', flush = True, v = verbose)
-                    exit_code = 0
-                    direction = -1
-                    log_dict['successes'].append(iteration_dict)
-                    log_dict['successes'] = \
-                        sort_iterations(log_dict['successes'])
-                else: # descend
-                    direction = 1
-            else: # no max sequences, minimum is met, this was successful
-                vprint(spacer + '\tSUCCESS!', flush = True, v = verbose)
-                exit_code = 0
-                log_dict['successes'].append(iteration_dict)
-                log_dict['successes'] = sort_iterations(log_dict['successes'])
-                break
-        else: # need to increase cluster size
-            direction = -1
-
-        if oldDirection: # if there is an older iteration
-            if direction != oldDirection: # if the direction switched
-                diff_len = ofocal_len - focal_len
-                if oldDirection * -1 == diff_len/abs(diff_len):
-                # percent ID change is congruent with the size change, which should
-                # not be the case, i.e. decreasing % ID shouldn't decrease
-                # module size
-                    pass
-                elif log_dict['successes']:
-                    # grab the largest success
-                    cluster = log_dict['successes'][0]['cluster']
-                    exit_code = 0
-                    break
-                else:
-                    eprint(spacer + 'WARNING: Overshot - ' \
-                         + 'could not find parameters using current interval', 
-                           flush = True)
-                    iteration = extract_closest_cluster(log_dict['iterations'],
-                                                        min_seq, max_seq)
-                    cluster = iteration['cluster']
-                    exit_code = 2
-                    break
-        else: # set the old iteration direction detail
-            oldDirection = direction
-            exit_code = 1
-#         clus_const += (interval*direction)
-
-        ofocal_len = copy.copy(focal_len)
-        oclus_var = copy.copy(clus_var)
-        clus_var += (interval*direction)
-
-        # clus_var should be to 3 significant figures
-        clus_var = round(clus_var * 100)/100
-        # adjust the clus_vareter based on the direction it should change
-        if oclus_var != min_var and oclus_var != max_var:
-            if clus_var < min_var: # set as minimum value if it descends below
-                clus_var = min_var
-            elif clus_var > max_var: # set as maximum if it ascends above
-                clus_var = max_var
+        vprint('\nITERATION ' + str(len(evals) + 1) + ': ' + focal_gene \
+             + ' cluster size: ' + str(len(cluster)), flush = True, v = verbose)
+        vprint('Cluster parameter: ' + str(grid[i]), flush = True, v = verbose)
+        evals[i] = {'size': len(cluster), 'cluster_variable': grid[i],
+                    'cluster': tuple(cluster)}
+        return len(cluster)
+
+    # focal cluster size decreases with increasing minimum identity
+    if max_seq:
+        best = gallop_search(lambda i: focal_size(i) <= max_seq, 
+                             start, steps)
+        if best > steps: # cannot descend to the maximum
+            best, exit_code = steps, 1
+        elif focal_size(best) >= min_seq:
+            exit_code = 0
+        else:
+            exit_code = 2
+    else:
+        offset = gallop_search(lambda i: focal_size(start - i) >= min_seq,
+                               0, start)
+        if offset > start: # cannot ascend to the minimum
+            best, exit_code = 0, 1
+        else:
+            best, exit_code = start - offset, 0
+    focal_size(best)
+
+    iterations = list(evals.values())
+    log_dict['iterations'] = sort_iterations(log_dict['iterations'] + iterations)
+    if exit_code == 0:
+        vprint(spacer + '\tSUCCESS!', flush = True, v = verbose)
+        successes = [x for x in iterations if x['size'] >= min_seq \
+                     and (not max_seq or x['size'] <= max_seq)]
+        log_dict['successes'] = sort_iterations(log_dict['successes'] + successes)
+        cluster = evals[best]['cluster']
+    elif exit_code == 2:
+        eprint(spacer + 'WARNING: Overshot - ' \
+             + 'could not find parameters using current interval', 
+               flush = True)
+        cluster = extract_closest_cluster(iterations, min_seq, max_seq)['cluster']
+    else:
+        cluster = evals[best]['cluster']
 
     write_json(log_dict, log_path)
+    return cluster, log_dict, exit_code
+
+
+def focal_cut_sizes(linkage_matrix, labels, focal_gene):
+    """Heights at which the focal gene's cluster grows, its size at each, 
+    and the nodes merged into it, from one pass over the linkage matrix.
+    Merges at the same height are one cut, so they are collapsed"""
+
+    n = len(labels)
     try:
-        return cluster, log_dict, exit_code
-    except UnboundLocalError: # cluster not defined, didn't enter while loop
-        raise ClusterParameterError('failed to run with given parameters')
+        node = labels.index(focal_gene)
+    except ValueError: # focal gene not in the distance matrix
+        raise KeyError(focal_gene)
+    heights, sizes, merged = [0.0], [1], [[node]]
+    for k, (a, b, h, size) in enumerate(linkage_matrix):
+        if a == node or b == node:
+            h = max(float(h), heights[-1]) # guard inversions
+            if h == heights[-1]: # fcluster takes every merge at a height
+                sizes[-1] = int(size)
+                merged[-1].append(int(b if a == node else a))
+            else:
+                heights.append(h)
+                sizes.append(int(size))
+                merged.append([int(b if a == node else a)])
+            node = n + k
+
+    return heights, sizes, merged
+
+
+def node_leaves(linkage_matrix, node, n):
+    leaves, stack = [], [node]
+    while stack:
+        node = stack.pop()
+        if node < n:
+            leaves.append(node)
+        else:
+            stack.extend(int(x) for x in linkage_matrix[node - n][:2])
+    return leaves
+
 
 def cluster_iter_aggclus(params, min_seq, max_seq, clus_const, clus_var,
                 interval, min_var, max_var, log_dict, log_path, 
                 focal_gene = None, verbose = False, spacer = '\t', 
                 cpus = 1):
+    """Build the linkage once and read the focal gene's cluster size at every
+    cut height between `min_var` and `max_var`. The largest cluster of
+    `min_seq` to `max_seq` genes is found by bisecting the cuts, and each
+    candidate cut is logged"""
 
-    oldDirection, attempt = None, 0
     if focal_gene:
         res_base = params['dir'] + 'working/' + focal_gene
     else:
         res_base = params['dir'] + 'working/' \
                  + re.sub(r'\.[^\.]+$', '', params['fa']) 
-    while clus_var >= min_var and clus_var <= max_var:
-        attempt += 1
-        if 100 - round(100*clus_var) < round(100*clus_const):
-            break
-        name = '_c' + str(round(clus_const*1000) / 1000) \
-             + '_v' + str(round(clus_var*1000) / 1000)
-        clusters, tree = scipyaggd(params['dist'],
-                                   float(clus_var), 
-                                   params['link']) # cluster
-        newick = getNewick(tree, "", tree.dist, list(params['dist'].index))
-        write_data(newick, clusters, res_base + name)
-
-        cluster_dict = defaultdict(list) # could be more efficient by grabbing in getClusterLabels
-        for gene, index in clusters.items(): # create a dictionary clusID:
-            # [genes]
-            cluster_dict[index].append(gene)
+    # the maximum distance cannot exceed the minimum connection
+    max_var = min(max_var, (100 - round(100*clus_const))/100)
+    if not min_var <= clus_var <= max_var:
+        write_json(log_dict, log_path)
+        raise ClusterParameterError('failed to run with given parameters')
 
-        try:
-            cluster = cluster_dict[clusters[focal_gene]]
-            focal_len = len(cluster) 
-        except KeyError: # focal gene not in output
-            focal_len = 0
-            cluster = None
-            newick = ''
-
-
-        vprint('\nITERATION ' + str(attempt) + ': ' + focal_gene \
-             + ' cluster size: ' + str(focal_len), flush = True, v = verbose)
-        vprint('Cluster parameter: ' + str(clus_var), flush = True, v = verbose)
-        iteration_dict = {'size': focal_len, 'cluster_variable': clus_var,
-                          'cluster': tuple(cluster), 'tree': newick}
-        log_dict['iterations'].append(iteration_dict)
-        log_dict['iterations'] = sort_iterations(log_dict['iterations'])
-        if focal_len >= min_seq: # if greater than minimum sequences
-            if max_seq: # if there is a max set of sequences
-                if focal_len <= max_seq: # if less than max sequences
-                    vprint(spacer + '\tSUCCESS!', flush = True, v = verbose)
-                    exit_code = 0
-                    direction = -1
-                    log_dict['successes'].append(iteration_dict)
-                    log_dict['successes'] = \
-                        sort_iterations(log_dict['successes'])
-                else: # descend
-                    direction = 1
-            else: # no max sequences, minimum is met, this was successful
-                vprint(spacer + '\tSUCCESS!', flush = True, v = verbose)
-                exit_code = 0
-                log_dict['successes'].append(iteration_dict)
-                log_dict['successes'] = \
-                    sort_iterations(log_dict['successes'])
-                break
-        else: # need to increase cluster size
-            exit_code = 1
-            direction = -1
-
-        if oldDirection: # if there is an older iteration
-            if direction != oldDirection: # if the direction switched
-                if log_dict['successes']:
-                    # sort by the largest success
-                    cluster = log_dict['successes'][0]['cluster']
-                    newick = log_dict['successes'][0]['tree']
-                    exit_code = 0
-                else:
-                    eprint(spacer + 'WARNING: Overshot - ' \
-                         + 'could not find parameters using current interval', 
-                           flush = True)
-                    iteration = extract_closest_cluster(log_dict['iterations'],
-                                                        min_seq, max_seq)
-                    cluster = iteration['cluster']
-                    newick = iteration['tree']
-                    exit_code = 2
-                break
-        else: # set the old iteration direction detail
-            oldDirection = direction
-#         clus_const += (interval*direction)
-
-        oclus_var = copy.copy(clus_var)
-        clus_var -= (interval*direction)
-
-        # clus_var should be to 3 significant figures
-        clus_var = round(clus_var * 100)/100
-        # adjust the clus_vareter based on the direction it should change
-        if oclus_var != min_var and oclus_var != max_var:
-            if clus_var < min_var: # set as minimum value if it descends below
-                clus_var = min_var
-            elif clus_var > max_var: # set as maximum if it ascends above
-                clus_var = max_var
+    labels = params['dist'].labels
+    linkage_matrix = aggd_linkage(params['dist'], params['link'])
+    tree = hierarchy.to_tree(linkage_matrix)
+    newick = getNewick(tree, "", tree.dist, labels)
+    heights, sizes, merged = focal_cut_sizes(linkage_matrix, labels, focal_gene)
+
+    # candidate cuts are where the focal cluster grows within range
+    lo_i = bisect.bisect_right(heights, min_var) - 1
+    hi_i = bisect.bisect_right(heights, max_var) - 1
+    cut_vars = [max(heights[i], min_var) for i in range(len(heights))]
+    if max_seq:
+        k = bisect.bisect_right(sizes, max_seq, lo_i, hi_i + 1) - 1
+        success = k >= lo_i and sizes[k] >= min_seq
+    else:
+        start_i = max(bisect.bisect_right(heights, clus_var) - 1, lo_i)
+        k = bisect.bisect_left(sizes, min_seq, start_i, hi_i + 1)
+        success = k <= hi_i
+
+    # every logged cut carries its members for downstream size filters
+    members, iterations = [], []
+    for i in range(hi_i + 1):
+        for node in merged[i]:
+            members.extend(node_leaves(linkage_matrix, node, len(labels)))
+        if i >= lo_i:
+            iterations.append({'size': sizes[i], 
+                               'cluster_variable': cut_vars[i],
+                               'cluster': tuple(labels[x] for x in sorted(members))})
+    vprint(f'\n{len(iterations)} candidate cuts: {focal_gene} cluster size ' \
+         + f'{sizes[lo_i]}-{sizes[hi_i]}', flush = True, v = verbose)
+    log_dict['iterations'] = sort_iterations(log_dict['iterations'] + iterations)
+
+    if success:
+        vprint(spacer + '\tSUCCESS!', flush = True, v = verbose)
+        exit_code = 0
+        if max_seq:
+            successes = [x for x in iterations \
+                         if min_seq <= x['size'] <= max_seq]
+        else:
+            successes = [x for x in iterations if x['size'] == sizes[k]][:1]
+        log_dict['successes'] = sort_iterations(log_dict['successes'] + successes)
+        iteration = [x for x in iterations if x['size'] == sizes[k]][0]
+    elif sizes[hi_i] < min_seq: # cannot reach the minimum
+        exit_code = 1
+        iteration = iterations[-1]
+    else:
+        eprint(spacer + 'WARNING: Overshot - ' \
+             + 'could not find parameters using current interval', 
+               flush = True)
+        exit_code = 2
+        iteration = extract_closest_cluster(iterations, min_seq, max_seq)
+
+    cut = iteration['cluster_variable']
+    vprint('Cluster parameter: ' + str(cut) + '; size: ' \
+         + str(iteration['size']), flush = True, v = verbose)
+    fcluster = hierarchy.fcluster(linkage_matrix, cut, criterion = 'distance')
+    clusters = getClusterLabels(labels, fcluster)
+    name = '_c' + str(round(clus_const*1000) / 1000) \
+         + '_v' + str(round(cut*1000) / 1000)
+    write_data(newick, clusters, res_base + name)
+    cluster = [x for x in labels if clusters[x] == clusters[focal_gene]]
 
     write_json(log_dict, log_path)
-    try:
-        return cluster, newick, log_dict, exit_code
-    except UnboundLocalError: # cluster not defined, didn't enter while loop
-        raise ClusterParameterError('failed to run with given parameters')
+    return cluster, newick, log_dict, exit_code
 
 
 def main(
@@ -633,7 +786,7 @@ def main(
                                        float(clus_var), 
                                        param_dict['link']) # cluster
             newick = getNewick(tree, "", tree.dist, 
-                               list(param_dict['dist'].index))
+                               param_dict['dist'].labels)
             write_data(newick, clusters, res_base)
             return clusters, None, None, log_dict
         else:
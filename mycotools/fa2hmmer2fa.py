@@ -1,7 +1,5 @@
 #!/usr/bin/env python3
 
-# NEED to ditch extracthmm and move to simplified output parsing
-
 import os
 import re
 import sys
@@ -9,10 +7,10 @@ import argparse
 import datetime
 import subprocess
 import multiprocessing as mp
-from mycotools.extractHmmsearch import main as exHmm, grabNames
-from mycotools.extractHmmAcc import main as extr_hmm
-from mycotools.db2search import compAcc2fa
-from mycotools.acc2fa import famain as acc2fa
+from collections import defaultdict
+from mycotools.utils.extractHmmsearch import parse_domtblout, hmm_lengths
+from mycotools.utils.extractHmmAcc import main as extr_hmm
+from mycotools.acc2fa import bulk_acc2fa
 from mycotools.lib.kontools import intro, outro, findExecs, eprint, format_path
 from mycotools.lib.dbtools import mtdb, primaryDB
 from mycotools.lib.biotools import dict2fa
@@ -28,10 +26,19 @@ def runextractHmmAcc(hmm, accession, output):
     return output
 
 
-def runHmmer(fasta, hmm, output, cpu = 1, binary = 'hmmsearch'):
+def runHmmer(fasta, hmm, output, cpu = 1, binary = 'hmmsearch', 
+             report = None):
 
-    hmm_status = subprocess.call([
-        binary, '-o', output, '--cpu', str(cpu), hmm, fasta
+    if binary == 'nhmmer':
+        tbl_arg = '--tblout'
+    else:
+        tbl_arg = '--domtblout'
+    if report:
+        report_args = ['-o', report]
+    else:
+        report_args = ['-o', os.devnull, '--noali']
+    hmm_status = subprocess.call([binary] + report_args + [
+        tbl_arg, output, '--cpu', str(cpu), hmm, fasta
         ], stdout = subprocess.PIPE,
         stderr = subprocess.PIPE
         )
@@ -40,56 +47,46 @@ def runHmmer(fasta, hmm, output, cpu = 1, binary = 'hmmsearch'):
 
 
 def run_extract_hmm(
-    hmm_out, top_hits, cov_threshold, evalue, query = True, acc = None
+    hmm_tbl, hmm_path, top_hits, cov_threshold, evalue, accession = False,
+    nhmmer = False
     ):
+    """{query: {ome: [[seq, start, end]]}} of a --domtblout/--tblout"""
 
-    with open(hmm_out, 'r') as raw:
-        data = raw.read()
-    accs = grabNames( data, query = query )
-    if len(accs) > 1:
-        hmm_data = exHmm(
-            data, True, top_hits, cov_threshold, evalue, query = query
-            )
+    if nhmmer:
+        qlens = hmm_lengths(hmm_path)
     else:
-        hmm_data = exHmm(
-            data, list(accs)[0], top_hits, cov_threshold, evalue, query =
-            query
-            )
-    
-    return hmm_data
-
-
-def parse_hmm_data(hmm_data):
-
-    output_res = {}
-    for query in hmm_data:
-        output_res[query] = {}
-        for v in hmm_data[query][1].split('\n'):
-            if v.startswith('#') or not v.rstrip():
-                continue
-            data = [x.rstrip() for x in v.split('\t')]
-            seq = data[0]
-            start = data[-5]
-            end = data[-4]
-            ome = re.search(r'(.*?)\_', seq)[1]
-            if ome not in output_res[query]:
-                output_res[query][ome] = []
-            output_res[query][ome].append([seq, start, end])
+        qlens = None
+    hmm_data = parse_domtblout(
+        hmm_tbl, accession = accession, best = top_hits, 
+        threshold = cov_threshold, evalue = evalue, 
+        group = lambda x: x[:x.find('_')], nhmmer = nhmmer, qlens = qlens
+        )
+
+    output_res = defaultdict(dict)
+    for ome, q_dict in hmm_data.items():
+        for query, hits in q_dict.items():
+            output_res[query][ome] = [list(x) for x in hits]
 
     return output_res
 
 
 def run_acc2fa(db, biotype, output_res, subhit = True, cpu = 1):
 
-    acc2fa_cmds = compAcc2fa(db, biotype, output_res, subhit)
-    output_fas = {}
-    for query in acc2fa_cmds:
-        print('\t' + query, flush = True)
-        with mp.get_context('spawn').Pool(processes = cpu) as pool:
-            results = pool.starmap(acc2fa, acc2fa_cmds[query])
-        output_fas[query] = '\n'.join([dict2fa(x) for x in results])
+    q_accs = {}
+    for query, ome_dict in output_res.items():
+        q_accs[query] = {}
+        for ome, hits in ome_dict.items():
+            if subhit:
+                q_accs[query][ome] = list(dict.fromkeys(
+                    f'{x[0]}[{x[1]}:{x[2]}]' for x in hits
+                    ))
+            else:
+                q_accs[query][ome] = list(dict.fromkeys(x[0] for x in hits))
+    q_fas = bulk_acc2fa(q_accs, {ome: row[biotype] \
+                                 for ome, row in db.set_index('ome').items()},
+                        cpus = cpu)
 
-    return output_fas
+    return {query: dict2fa(fa) for query, fa in q_fas.items()}
 
 
 def outputFas(output_fas, output_dir, fastaname):
@@ -102,7 +99,7 @@ def outputFas(output_fas, output_dir, fastaname):
 def main(
     db, binary, fasta_path, hmm_path, out_dir, accession, 
     top_hits = None, cov_threshold = None, evalue = None,
-    cpu = 1, accession_search = False, subhit = True 
+    cpu = 1, accession_search = False, subhit = True, report = False
     ):
 
     if binary == 'nhmmer':
@@ -127,18 +124,20 @@ def main(
         hmm_cpu = cpu - 1
     else:
         hmm_cpu = cpu
-    hmmer_out = out_dir + 'hmmer.out'
+    hmmer_tbl = out_dir + 'hmmer.domtbl'
+    if report:
+        report = out_dir + 'hmmer.out'
     print('\nRunning ' + binary, flush = True)
-    if runHmmer(fasta_path, hmm_path, hmmer_out, cpu = hmm_cpu, binary = binary):
+    if runHmmer(fasta_path, hmm_path, hmmer_tbl, cpu = hmm_cpu, binary = binary,
+                report = report):
         eprint('\tERROR: ' + binary + ' failed', flush = True)
         sys.exit(2)
     
     print('\nParsing output', flush = True)
-    hmm_data = run_extract_hmm(
-        hmmer_out, top_hits, cov_threshold, evalue, 
-        not accession_search, accession
+    output_res = run_extract_hmm(
+        hmmer_tbl, hmm_path, top_hits, cov_threshold, evalue, 
+        accession = accession_search, nhmmer = binary == 'nhmmer'
         )
-    output_res = parse_hmm_data(hmm_data)
 
     print('\nCompiling fastas', flush = True)
     output_fas = run_acc2fa(db, biotype, output_res, subhit = subhit, cpu = cpu)
@@ -163,6 +162,7 @@ def cli():
         '-a', '--accession', action = 'store_true', help = 'Extract accession, not query, from .hmm'
         )
     parser.add_argument('-o', '--output', help = 'Output directory')
+    parser.add_argument('--report', action = 'store_true', help = 'Output full-text report')
     parser.add_argument('--cpu', default = 1, type = int)
     args = parser.parse_args()
 
@@ -201,8 +201,9 @@ def cli():
 
     output_fas = main(
         mtdb(format_path(args.mtdb)), args.binary, args.fasta, args.hmm, out_dir, args.query,
-        cov_threshold = args.coverage, evalue = args.evalue, cpu = args.cpu,
-        accession_search = args.accession, subhit = not args.whole
+        cov_threshold = args.coverage, evalue = evalue, cpu = args.cpu,
+        accession_search = args.accession, subhit = not args.whole,
+        report = args.report
         )
     fastaname = re.sub(r'\.fa[^\.]*$', '', os.path.basename(os.path.abspath(args.fasta)))
     outputFas(output_fas, out_dir, fastaname)
@@ -96,7 +96,8 @@ def run_mf(clipkit_files, out_dir, constraint = False,
         [x.extend(['-g', constraint]) for x in cmds]
     if scripts:
         return {os.path.basename(v): cmds[i] for i, v in enumerate(clipkit_files)}
-    multisub(cmds, verbose = verbose, processes = concurrent_cmds)
+    multisub(cmds, verbose = verbose, processes = max(concurrent_cmds, 1),
+             cpus = cpus, threads = cpus_per_cmd, sizes = clipkit_files)
 
     models = {}
     for f_ in clipkit_files:
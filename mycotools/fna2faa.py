@@ -3,25 +3,33 @@
 import sys
 from Bio.Seq import Seq
 from mycotools.lib.kontools import format_path, stdin2str, sys_start
-from mycotools.lib.biotools import fa2dict, dict2fa
+from mycotools.lib.biotools import iter_fasta, dict2fa
 
 def cli():
     usage = 'Input nucleotide fasta ("-" for stdin), translate to protein fasta'
     args = sys_start(sys.argv[1:], usage, 1)
     if args[0] == '-':
         data = stdin2str()
+        if data.startswith('>'):
+            fna = iter_fasta(data, file_ = False)
+        else:
+            fna = [('input', '', ''.join(data.split()))]
     else:
-        with open(format_path(args[0]), 'r') as raw:
-            data = raw.read()
-    if data.startswith('>'):
-        fna = fa2dict(data, file_ = False)
-    else:
-        fna = {'input': {'sequence': data, 'description': ''}}
+        fna_path = format_path(args[0])
+        with open(fna_path, 'r') as raw:
+            is_fasta = raw.read(1) == '>'
+        if is_fasta:
+            fna = iter_fasta(fna_path)
+        else:
+            with open(fna_path, 'r') as raw:
+                fna = [('input', '', ''.join(raw.read().split()))]
 
-    faa = {k: {'sequence': Seq(v['sequence']).translate(), 
-               'description': v['description']} \
-           for k, v in fna.items()}
-    print(dict2fa(faa))
+    for acc, descrip, seq in fna:
+        if not seq:
+            continue
+        faa = {acc: {'sequence': str(Seq(seq).translate()), 
+                     'description': descrip}}
+        print(dict2fa(faa).rstrip(), flush = True)
     sys.exit(0)
 
 
@@ -5,7 +5,7 @@ import sys
 import argparse
 from Bio.Seq import Seq
 from mycotools.lib.dbtools import mtdb, primaryDB
-from mycotools.lib.biotools import fa2dict, gff2list, gff3Comps, dict2fa
+from mycotools.lib.biotools import iter_fasta, gff2list, gff3Comps, dict2fa
 from mycotools.lib.kontools import format_path, sys_start, eprint, stdin2str
 
 def sortGene(sorting_group):
@@ -562,6 +562,13 @@ def aamain( gff_dicts, assem_dict, spacer = '\t' ):
 
     return genes_fa_dict
 
+
+def stream_contigs(assembly_path, seqids):
+    """only retain the assembly contigs that are referenced in the gff"""
+    return {contig: {'sequence': seq, 'description': descrip} \
+            for contig, descrip, seq in iter_fasta(assembly_path) \
+            if contig in seqids and seq}
+
             
 def cli():
 
@@ -586,30 +593,32 @@ def cli():
     else:
         input_gff = gff2list(format_path(args.gff))
     if args.assembly:
-        assembly_dicts = {'input': fa2dict( format_path(args.assembly) )}
+        assembly_paths = {'input': format_path(args.assembly)}
         gff_dicts = {'input': input_gff}
     else:
         db = mtdb(primaryDB()).set_index('ome')
-        gff_dicts, assembly_dicts = {}, {}
+        gff_dicts, assembly_paths = {}, {}
         try:
             for line in input_gff:
                 gene = re.search(gff3Comps()['Alias'], line['attributes'])[1]
                 ome = re.search( r'(.*?)_', gene )[1]
                 if ome not in gff_dicts:
                     gff_dicts[ome] = []
-                    assembly_dicts[ome] = fa2dict(db[ome]['fna'])
+                    assembly_paths[ome] = db[ome]['fna']
                 gff_dicts[ome].append(line)
         except IndexError:
             eprint('\nERROR: ' + args.gff + ' is incompatible with MycotoolsDB', flush = True)
             sys.exit(1)
         
-    if args.protein:
-        for ome in gff_dicts:
-            print(dict2fa(aamain(gff_dicts[ome], assembly_dicts[ome])), flush = True)
-    else:
-        for ome in assembly_dicts:
+    for ome, assembly_path in assembly_paths.items():
+        assembly_dict = stream_contigs(
+            assembly_path, set(x['seqid'] for x in gff_dicts[ome])
+            )
+        if args.protein:
+            print(dict2fa(aamain(gff_dicts[ome], assembly_dict)), flush = True)
+        else:
             print(dict2fa(
-                ntmain(gff_dicts[ome], assembly_dicts[ome], not args.noncoding, not args.all_flanks, args.intergenic, args.plusminus)
+                ntmain(gff_dicts[ome], assembly_dict, not args.noncoding, not args.all_flanks, args.intergenic, args.plusminus)
                 ), flush = True)
 
     sys.exit(0)
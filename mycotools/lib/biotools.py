@@ -2,8 +2,11 @@
 
 # NEED to convert gff list to appropriate types
 
+import os
 import re
 import sys
+import numpy as np
+from collections.abc import Mapping
 from mycotools.lib.kontools import eprint
 
 aa_weights = {
@@ -69,50 +72,181 @@ def reverse_complement(seq):
     return new_seq
 
 
-def fa2dict(fasta_input, file_ = True):
-    fasta_dict = {}
+def iter_fasta(fasta_input, file_ = True):
+    """Stream a fasta file (or string if not `file_`) and yield
+    (accession, description, sequence) for each record.
+    Sequence lines are gathered in a list and joined once per record"""
+
     if file_:
-        with open(fasta_input, 'r') as fasta:
-            str_fasta = ''
-            for line in fasta:
-                data = line.rstrip()
-                if data.startswith('>'):
-                    str_fasta += '\n' + data.rstrip() + '\n'
-                elif data:
-                    str_fasta += data
-                # concatenates the prep string with the prepped line from the fasta file
-        str_fasta = str_fasta.lstrip()
+        fasta = open(fasta_input, 'r')
     else:
-        str_fasta = fasta_input
-
-    # extracts 0) seq ID and description and 1) sequence
-    extracted = re.findall( r'(^>[^\n]*)\n([^>]*)', str_fasta, re.M)
-
-    # adds a new dictionary for each gene
-    for val in extracted:
-        step1 = val[0]
-        step2 = re.search(r'^>([^ ]*)', step1)
-        gene = step2[1]
-        step3 = re.search(r' (.*)', step1)
-        if step3:
-            descrip = step3[1]
-        else:
-            descrip = ''
-
-        seq = val[1]
-        if seq:
-            if seq[-1] == '\n' or seq[-1] == '\r':
-                seq = seq.rstrip()
-        else:
-            continue
+        fasta = iter(fasta_input.splitlines())
+    try:
+        acc, descrip, seq_lines = None, '', []
+        for line in fasta:
+            data = line.rstrip()
+            if data.startswith('>'):
+                if acc is not None:
+                    yield acc, descrip, ''.join(seq_lines)
+                space_i = data.find(' ')
+                if space_i > -1:
+                    acc, descrip = data[1:space_i], data[space_i+1:]
+                else:
+                    acc, descrip = data[1:], ''
+                seq_lines = []
+            elif data and acc is not None:
+                seq_lines.append(data)
+        if acc is not None:
+            yield acc, descrip, ''.join(seq_lines)
+    finally:
+        if file_:
+            fasta.close()
 
-        # prepares dictionaries for each gene with description, seq, rvcmpl_seq, and codons
-        fasta_dict[gene] = {}
-        if descrip != '\n':
-            fasta_dict[gene]['description'] = descrip
-        fasta_dict[gene]['sequence'] = seq
 
-    return fasta_dict
+def fa2dict(fasta_input, file_ = True):
+    # records without sequence are skipped
+    return {acc: {'description': descrip, 'sequence': seq} \
+            for acc, descrip, seq in iter_fasta(fasta_input, file_) if seq}
+
+
+def index_fasta(fa_path, idx_path = None, write = True):
+    """Build a samtools faidx-compatible offset index of `fa_path`:
+    {acc: (length, offset, linebases, linewidth)}. Records must be wrapped
+    at a uniform line length; raises ValueError otherwise. Writes the index
+    to `idx_path` (DEFAULT: `fa_path`.fai) if `write` and entries exist"""
+
+    if not idx_path:
+        idx_path = fa_path + '.fai'
+    index = {}
+    acc, offset, length, linebases, linewidth, short = None, 0, 0, 0, 0, False
+    pos = 0
+    with open(fa_path, 'rb') as raw:
+        for line in raw:
+            next_pos = pos + len(line)
+            if line.startswith(b'>'):
+                if acc is not None:
+                    index[acc] = (length, offset, linebases, linewidth)
+                acc = line[1:].rstrip().split(b' ', 1)[0].decode()
+                offset, length, linebases, linewidth = next_pos, 0, 0, 0
+                short = False
+            elif acc is not None:
+                bases = len(line.rstrip(b'\r\n'))
+                if not bases:
+                    short = True
+                    pos = next_pos
+                    continue
+                elif short or (linebases and bases > linebases):
+                    raise ValueError('irregular line length: ' + acc \
+                                   + ' ' + fa_path)
+                if not linebases:
+                    linebases, linewidth = bases, len(line)
+                elif bases < linebases or len(line) != linewidth:
+                    short = True # only the final line may be shorter
+                length += bases
+            pos = next_pos
+    if acc is not None:
+        index[acc] = (length, offset, linebases, linewidth)
+
+    if write and index:
+        try:
+            with open(idx_path + '.tmp', 'w') as out:
+                for acc, entry in index.items():
+                    out.write(acc + '\t' + '\t'.join(str(x) for x in entry) \
+                            + '\n')
+            os.replace(idx_path + '.tmp', idx_path)
+        except OSError: # unwritable directory, keep the index in memory
+            pass
+
+    return index
+
+
+def read_fai(idx_path):
+    index = {}
+    with open(idx_path, 'r') as raw:
+        for line in raw:
+            d = line.rstrip().split('\t')
+            index[d[0]] = tuple(int(x) for x in d[1:5])
+    return index
+
+
+class IndexedFasta(Mapping):
+    """Random-access fasta reader backed by a faidx offset index. Loads
+    `fa_path`.fai if it is newer than the fasta, otherwise (re)builds it.
+    Behaves like a read-only fa2dict output, and `fetch` retrieves python
+    slice coordinates without reading the whole record"""
+
+    def __init__(self, fa_path, idx_path = None, write = True):
+        self.path = fa_path
+        if not idx_path:
+            idx_path = fa_path + '.fai'
+        if os.path.isfile(idx_path) \
+            and os.path.getmtime(idx_path) >= os.path.getmtime(fa_path):
+            self.index = read_fai(idx_path)
+        else:
+            self.index = index_fasta(fa_path, idx_path, write = write)
+        self.handle = open(fa_path, 'rb')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __del__(self):
+        try:
+            self.close()
+        except AttributeError: # failed before the handle opened
+            pass
+
+    def close(self):
+        if not self.handle.closed:
+            self.handle.close()
+
+    def __len__(self):
+        return len(self.index)
+
+    def __iter__(self):
+        return iter(self.index)
+
+    def __contains__(self, acc):
+        return acc in self.index
+
+    def __getitem__(self, acc):
+        return {'description': self.description(acc),
+                'sequence': self.fetch(acc)}
+
+    def length(self, acc):
+        return self.index[acc][0]
+
+    def description(self, acc):
+        offset = self.index[acc][1]
+        end, window = offset - 1, 256 # header ends with the newline at -1
+        while True:
+            start = max(0, end - window)
+            self.handle.seek(start)
+            chunk = self.handle.read(end - start)
+            i = chunk.rfind(b'\n')
+            if i > -1 or not start:
+                header = chunk[i+1:].rstrip().decode()
+                break
+            window *= 2
+        if ' ' in header:
+            return header[header.find(' ')+1:]
+        else:
+            return ''
+
+    def fetch(self, acc, start = None, end = None):
+        length, offset, linebases, linewidth = self.index[acc]
+        start, end, null = slice(start, end).indices(length)
+        if end <= start:
+            return ''
+        byte_start = offset + (start // linebases) * linewidth \
+                   + start % linebases
+        byte_end = offset + ((end - 1) // linebases) * linewidth \
+                 + (end - 1) % linebases + 1
+        self.handle.seek(byte_start)
+        seq = self.handle.read(byte_end - byte_start)
+        return seq.translate(None, b'\r\n').decode()
 
 
 # truncates sequences based on inputted lenght
@@ -213,6 +347,295 @@ def gff2list(gff_info, path = True, error = True):
     return gff_list_dict
 
 
+strand_codes = {'.': 0, '+': 1, '-': -1, '?': 2}
+strand_chars = {v: k for k, v in strand_codes.items()}
+
+class GffTable():
+    """Columnar GFF3 representation. start, end, strand (+: 1, -: -1, .: 0,
+    ?: 2), and phase (.: -1) are NumPy arrays; seqid, source, and type are
+    categorical codes into the `seqids`, `sources`, and `types` lists; the
+    Alias, ID, and Parent attributes are pre-parsed into parallel arrays
+    ('' if absent). Indexing with an integer or iterating returns gff2list()
+    dict rows for backward compatibility; indexing with a slice, mask, or
+    index array returns a GffTable subset"""
+
+    def __init__(self, seqid, source, type_, start, end, score, strand, 
+                 phase, attributes, alias, id_, parent,
+                 seqids, sources, types):
+        self.seqid, self.source, self.type = seqid, source, type_
+        self.start, self.end, self.score = start, end, score
+        self.strand, self.phase, self.attributes = strand, phase, attributes
+        self.alias, self.id, self.parent = alias, id_, parent
+        self.seqids, self.sources, self.types = seqids, sources, types
+
+    def __len__(self):
+        return len(self.start)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.row(i)
+
+    def __getitem__(self, i):
+        if isinstance(i, (int, np.integer)):
+            return self.row(i)
+        else:
+            return self.subset(i)
+
+    def row(self, i):
+        if self.phase[i] < 0:
+            phase = '.'
+        else:
+            phase = str(self.phase[i])
+        return {
+            'seqid': self.seqids[self.seqid[i]], 
+            'source': self.sources[self.source[i]],
+            'type': self.types[self.type[i]],
+            'start': int(self.start[i]), 'end': int(self.end[i]),
+            'score': self.score[i], 
+            'strand': strand_chars[int(self.strand[i])],
+            'phase': phase, 'attributes': self.attributes[i]
+            }
+
+    def subset(self, i):
+        return GffTable(
+            self.seqid[i], self.source[i], self.type[i], self.start[i],
+            self.end[i], self.score[i], self.strand[i], self.phase[i],
+            self.attributes[i], self.alias[i], self.id[i], self.parent[i],
+            self.seqids, self.sources, self.types
+            )
+
+    def to_list(self):
+        return list(self)
+
+    def type_mask(self, *types):
+        codes = [i for i, v in enumerate(self.types) if v in set(types)]
+        return np.isin(self.type, codes)
+
+    def seqid_mask(self, seqid):
+        try:
+            return self.seqid == self.seqids.index(seqid)
+        except ValueError: # seqid not in table
+            return np.zeros(len(self), dtype = bool)
+
+
+def gff2table(gff_info, path = True):
+    """Parse a GFF3 path (or string if not `path`) into a GffTable"""
+
+    comps = gff3Comps()
+    alias_comp, id_comp, par_comp = re.compile(comps['Alias']), \
+        re.compile(comps['id']), re.compile(comps['par'])
+    seqid2code, source2code, type2code = {}, {}, {}
+    seqid, source, type_, start, end, score, strand, phase, attributes, \
+        alias, id_, parent = [], [], [], [], [], [], [], [], [], [], [], []
+
+    if path:
+        data = open(gff_info, 'r')
+    else:
+        data = iter(gff_info.split('\n'))
+    try:
+        for line in data:
+            if not line.rstrip('\r\n') or line.startswith('#'):
+                continue
+            col_list = line.rstrip('\r\n').split('\t')
+            try:
+                seqid.append(seqid2code.setdefault(col_list[0], 
+                                                   len(seqid2code)))
+                source.append(source2code.setdefault(col_list[1], 
+                                                     len(source2code)))
+                type_.append(type2code.setdefault(col_list[2],
+                                                  len(type2code)))
+                start.append(int(col_list[3]))
+                end.append(int(col_list[4]))
+                score.append(col_list[5])
+                strand.append(strand_codes.get(col_list[6], 0))
+                if col_list[7].isdigit():
+                    phase.append(int(col_list[7]))
+                else:
+                    phase.append(-1)
+                attrs = col_list[8]
+            except IndexError:
+                raise IndexError(str(len(col_list)) + '/9 expected tab-' \
+                                + 'delimitted fields: ' + str(col_list))
+            except ValueError:
+                raise ValueError(str(col_list[3:5]) + ' invalid integer ' \
+                                + 'conversion: ' + str(col_list))
+            attributes.append(attrs)
+            for comp, col in [(alias_comp, alias), (id_comp, id_), 
+                              (par_comp, parent)]:
+                res = comp.search(attrs)
+                if res:
+                    col.append(res[1])
+                else:
+                    col.append('')
+    finally:
+        if path:
+            data.close()
+
+    return GffTable(
+        np.array(seqid, dtype = np.int32), np.array(source, dtype = np.int32),
+        np.array(type_, dtype = np.int32), np.array(start, dtype = np.int64),
+        np.array(end, dtype = np.int64), np.array(score, dtype = object),
+        np.array(strand, dtype = np.int8), np.array(phase, dtype = np.int8),
+        np.array(attributes, dtype = object), np.array(alias, dtype = object),
+        np.array(id_, dtype = object), np.array(parent, dtype = object),
+        list(seqid2code.keys()), list(source2code.keys()), 
+        list(type2code.keys())
+        )
+
+
+class AnnotationCache():
+    """Binary per-genome annotation summary of a curated MTDB GFF3: genes
+    (Alias) ordered by lowest CDS coordinate per contig, each gene's sorted
+    CDS coordinates and strand, and each gene's RNA GFF row. Build with 
+    build_annotation_cache() and load with load_annotation_cache()"""
+
+    def __init__(self, contigs, contig_offsets, genes, strands, coords, 
+                 coord_offsets, rna_rows):
+        self.contigs, self.contig_offsets = contigs, contig_offsets
+        self.genes, self.strands, self.rna_rows = genes, strands, rna_rows
+        self.coords, self.coord_offsets = coords, coord_offsets
+        self.gene2i = {gene: i for i, gene in enumerate(self.genes.tolist())}
+        self._cds_dict, self._gene2contig = None, None
+
+    def contig_genes(self):
+        """{contig: [ordered genes]}"""
+        genes = self.genes.tolist()
+        return {contig: genes[self.contig_offsets[i]:self.contig_offsets[i+1]] \
+                for i, contig in enumerate(self.contigs.tolist())}
+
+    def gene_coords(self, gene):
+        i = self.gene2i[gene]
+        return self.coords[self.coord_offsets[i]:self.coord_offsets[i+1]].tolist()
+
+    def cds_dict(self, accs_list = []):
+        """acc2locus.compileCDS_mycotools() output:
+        cds_dict = {contig: {protein: [sorted_coords]}}, acc2seqid. The
+        cds_dict is built once and shared by subsequent calls, so it must
+        not be modified"""
+
+        if self._cds_dict is None:
+            self._cds_dict, self._gene2contig = {}, {}
+            coords = self.coords.tolist()
+            coord_offsets = self.coord_offsets.tolist()
+            for contig, genes in self.contig_genes().items():
+                self._cds_dict[contig] = {}
+                for gene in genes:
+                    i = self.gene2i[gene]
+                    self._cds_dict[contig][gene] = \
+                        coords[coord_offsets[i]:coord_offsets[i+1]]
+                    self._gene2contig[gene] = contig
+        accs = sorted({x for x in accs_list if x in self._gene2contig},
+                      key = self.gene2i.get) # genome order
+        acc2seqid = {gene: self._gene2contig[gene] for gene in accs}
+        return self._cds_dict, acc2seqid
+
+    def rna_row(self, gene):
+        """gff2list() row of the gene's RNA entry, None if it has none"""
+        row = str(self.rna_rows[self.gene2i[gene]])
+        if not row:
+            return None
+        col_list = row.split('\t')
+        return {
+            'seqid': col_list[0], 'source': col_list[1], 'type': col_list[2],
+            'start': int(col_list[3]), 'end': int(col_list[4]), 
+            'score': col_list[5], 'strand': col_list[6], 
+            'phase': col_list[7], 'attributes': col_list[8]
+            }
+
+
+def build_annotation_cache(gff_path, cache_path = None, write = True,
+                           spacer = '\t'):
+    """Summarize `gff_path` into an AnnotationCache and write it to
+    `cache_path` (DEFAULT: `gff_path`.cache.npz) with the GFF3's size and
+    modification time for validation"""
+
+    if not cache_path:
+        cache_path = gff_path + '.cache.npz'
+    gff_stat = os.stat(gff_path)
+    gff = gff2table(gff_path)
+
+    cds = gff[gff.type_mask('CDS')]
+    if not all(cds.alias):
+        eprint(spacer + 'WARNING: ' + os.path.basename(gff_path) \
+             + ' has proteins in gff with no Alias', flush = True)
+        cds = cds[cds.alias != '']
+    # sort CDSs by contig then lowest coordinate, so the first occurrence of
+    # a protein on a contig is its lowest coordinate
+    order = np.lexsort((np.minimum(cds.start, cds.end), cds.seqid))
+
+    contig_genes, gene_coords, gene_strands = {}, {}, {}
+    for i in order:
+        contig, gene = cds.seqids[cds.seqid[i]], cds.alias[i]
+        if gene not in gene_coords:
+            if contig not in contig_genes:
+                contig_genes[contig] = []
+            contig_genes[contig].append(gene)
+            gene_coords[gene] = []
+            gene_strands[gene] = cds.strand[i]
+        gene_coords[gene].extend([int(cds.start[i]), int(cds.end[i])])
+
+    rna_rows = {}
+    for i in np.nonzero(gff.type_mask(*[x for x in gff.types if 'RNA' in x]))[0]:
+        if gff.alias[i]: # the final RNA entry of a gene is retained
+            rna_rows[gff.alias[i]] = '\t'.join(str(x) for x in gff.row(i).values())
+
+    genes, contig_offsets, coords, coord_offsets = [], [0], [], [0]
+    for contig, c_genes in contig_genes.items():
+        for gene in c_genes:
+            genes.append(gene)
+            coords.extend(sorted(gene_coords[gene]))
+            coord_offsets.append(len(coords))
+        contig_offsets.append(len(genes))
+
+    ann_cache = AnnotationCache(
+        np.array(list(contig_genes.keys()), dtype = str), 
+        np.array(contig_offsets, dtype = np.int64),
+        np.array(genes, dtype = str), 
+        np.array([gene_strands[x] for x in genes], dtype = np.int8),
+        np.array(coords, dtype = np.int64),
+        np.array(coord_offsets, dtype = np.int64),
+        np.array([rna_rows.get(x, '') for x in genes], dtype = str)
+        )
+
+    if write:
+        try:
+            with open(cache_path + '.tmp', 'wb') as out:
+                np.savez(
+                    out, gff_size = gff_stat.st_size, 
+                    gff_mtime = gff_stat.st_mtime,
+                    contigs = ann_cache.contigs, 
+                    contig_offsets = ann_cache.contig_offsets,
+                    genes = ann_cache.genes, strands = ann_cache.strands,
+                    coords = ann_cache.coords,
+                    coord_offsets = ann_cache.coord_offsets,
+                    rna_rows = ann_cache.rna_rows
+                    )
+            os.replace(cache_path + '.tmp', cache_path)
+        except OSError: # unwritable directory, keep the cache in memory
+            pass
+
+    return ann_cache
+
+
+def load_annotation_cache(gff_path, cache_path = None, write = True):
+    """Load the AnnotationCache of `gff_path` if it is current, otherwise
+    (re)build it"""
+
+    if not cache_path:
+        cache_path = gff_path + '.cache.npz'
+    gff_stat = os.stat(gff_path)
+    if os.path.isfile(cache_path):
+        with np.load(cache_path) as cache:
+            if int(cache['gff_size']) == gff_stat.st_size \
+                and float(cache['gff_mtime']) == gff_stat.st_mtime:
+                return AnnotationCache(
+                    cache['contigs'], cache['contig_offsets'], 
+                    cache['genes'], cache['strands'], cache['coords'],
+                    cache['coord_offsets'], cache['rna_rows']
+                    )
+    return build_annotation_cache(gff_path, cache_path, write = write)
+
+
 def list2gff(gff_list, ver = 3):
 
     if ver:
@@ -11,19 +11,201 @@ import time
 import base64
 import getpass
 import hashlib
+import weakref
 import datetime
 from Bio import Entrez
 from urllib.error import HTTPError
 from io import StringIO
 from collections import defaultdict
+from collections.abc import MutableMapping
 from mycotools.lib.kontools import collect_files, eprint, format_path, \
     read_json, write_json
+from mycotools.lib.biotools import index_fasta, load_annotation_cache
+
+
+class lazy_tax(MutableMapping):
+    '''
+    Taxonomy dictionary of an MTDB row that is decoded from its JSON string,
+    and completed with the row's genus, species, and strain, upon first
+    access
+    '''
+    __slots__ = ('_raw', '_tax')
+
+    def __init__(self, taxonomy_string, genus = '', species = '', strain = ''):
+        self._raw = (taxonomy_string, genus, species, strain)
+        self._tax = None
+
+    def decode(self):
+        if self._tax is None:
+            taxonomy_string, genus, species, strain = self._raw
+            self._tax = read_tax(taxonomy_string)
+            self._tax['genus'] = genus
+            self._tax['species'] = genus + ' ' + species
+            self._tax['strain'] = strain
+        return self._tax
+
+    def __reduce__(self):
+        if self._tax is None: # pickle without decoding
+            return (lazy_tax, self._raw)
+        return (dict, (self._tax,))
+
+    def __getitem__(self, k):
+        return self.decode()[k]
+    def __setitem__(self, k, v):
+        self.decode()[k] = v
+    def __delitem__(self, k):
+        del self.decode()[k]
+    def __contains__(self, k):
+        return k in self.decode()
+    def __iter__(self):
+        return iter(self.decode())
+    def __len__(self):
+        return len(self.decode())
+    def __eq__(self, other):
+        if isinstance(other, lazy_tax):
+            other = other.decode()
+        return self.decode() == other
+    def __repr__(self):
+        return repr(self.decode())
+    def keys(self):
+        return self.decode().keys()
+    def values(self):
+        return self.decode().values()
+    def items(self):
+        return self.decode().items()
+    def copy(self):
+        return dict(self.decode())
+
+
+class mtdb_store:
+    '''
+    Shared state of a column mtdb's lists: the indexed views reading them,
+    and cached row positions of indexed columns. The first edit of a list
+    gives each view its own copy of the columns and clears the positions
+    '''
+    __slots__ = ('views', 'positions')
+
+    def __init__(self):
+        self.views = weakref.WeakSet()
+        self.positions = {}
+
+    def write(self):
+        if self.positions:
+            self.positions.clear()
+        if self.views:
+            for view in list(self.views):
+                view.own()
+
+
+class mtdb_column(list):
+    '''
+    Column list of an mtdb that notifies its store before each edit
+    '''
+    __slots__ = ('_store',)
+
+    def __init__(self, values = (), store = None):
+        super().__init__(values)
+        self._store = store
+
+    def __reduce__(self): # copies are plain lists
+        return (list, (list(self),))
+
+def _column_edit(name):
+    edit = getattr(list, name)
+    def column_edit(self, *args, **kwargs):
+        self._store.write()
+        return edit(self, *args, **kwargs)
+    column_edit.__name__ = name
+    return column_edit
+
+for _name in ('__setitem__', '__delitem__', '__iadd__', '__imul__', 'append',
+              'extend', 'insert', 'pop', 'remove', 'clear', 'sort', 'reverse'):
+    setattr(mtdb_column, _name, _column_edit(_name))
+
+
+class mtdb_view(object):
+    '''
+    Columns read by the rows of an indexed mtdb. They are shared with the
+    source mtdb's `store` until either side edits them
+    '''
+    __slots__ = ('columns', 'store', '__weakref__')
+
+    def __init__(self, columns, store = None):
+        self.columns, self.store = columns, store
+        if store is not None:
+            store.views.add(self)
+
+    def own(self):
+        if self.store is not None:
+            self.columns = {c: list(v) for c, v in self.columns.items()}
+            self.store.views.discard(self)
+            self.store = None
+
+
+class mtdb_row(MutableMapping):
+    '''
+    Row of an indexed mtdb that reads through to the view's columns; the
+    indexed column is excluded. Keys outside of the columns are kept on
+    the row alone and are not carried into `reset_index`
+    '''
+    __slots__ = ('_view', '_i', '_index', '_extra')
+
+    def __init__(self, view, i, index):
+        self._view, self._i, self._index = view, i, index
+        self._extra = None
+
+    def _is_column(self, k):
+        return k != self._index and k in self._view.columns
+
+    def __getitem__(self, k):
+        if self._is_column(k):
+            return self._view.columns[k][self._i]
+        elif self._extra is not None:
+            return self._extra[k]
+        raise KeyError(k)
+    def __setitem__(self, k, v):
+        if self._is_column(k):
+            self._view.own() # copy on write
+            self._view.columns[k][self._i] = v
+        else:
+            if self._extra is None:
+                self._extra = {}
+            self._extra[k] = v
+    def __delitem__(self, k):
+        if self._extra is None or k not in self._extra:
+            raise TypeError('mtdb row columns cannot be deleted')
+        del self._extra[k]
+    def __contains__(self, k):
+        return self._is_column(k) \
+            or (self._extra is not None and k in self._extra)
+    def __iter__(self):
+        for k in self._view.columns:
+            if k != self._index:
+                yield k
+        if self._extra is not None:
+            yield from self._extra
+    def __len__(self):
+        return sum(1 for k in self)
+    def __repr__(self):
+        return repr(self.copy())
+    def __reduce__(self): # only the row is pickled
+        return (dict, (self.copy(),))
+    def copy(self):
+        row = {k: self[k] for k in self}
+        if isinstance(row.get('taxonomy'), lazy_tax):
+            row['taxonomy'] = row['taxonomy'].copy()
+        return row
 
 
 class mtdb(dict):
     '''
     MycotoolsDB (mtdb) class. Designed to support high throughput "pandas-like"
     interface without the overhead of pandas.
+    Indexed rows are mtdb_row views that read the source's column lists
+    until either side edits them, when the view takes its own copy, so an
+    index and its source never share edits. Row positions of indexed 
+    columns are cached until the columns are edited. Adding or removing 
+    keys of an indexed mtdb detaches it from its columns.
     '''
     columns = [
        'ome', 'genus', 'species', 'strain', 'taxonomy',
@@ -60,6 +242,50 @@ class mtdb(dict):
         else:
             super().__init__(mtdb.db2df(self, db, add_paths = add_paths))
         self.index = index
+        self._columns = None
+        self._store = mtdb_store()
+        if not index: # track edits of the column lists
+            for k, v in dict.items(self):
+                if isinstance(v, list):
+                    dict.__setitem__(self, k, mtdb_column(v, self._store))
+
+    def __reduce__(self): # pickle/copy the data, not the views
+        if self.index:
+            data = {}
+            for k, v in self.items():
+                if isinstance(v, list):
+                    data[k] = [dict(x.items()) for x in v]
+                else:
+                    data[k] = dict(v.items())
+        else:
+            data = {k: list(v) for k, v in self.items()}
+        return (mtdb, (data, self.index))
+
+    def _detach(self):
+        """Key-level edits separate an indexed mtdb from its columns"""
+        self._columns = None
+
+    def __setitem__(self, k, v):
+        self._detach()
+        super().__setitem__(k, v)
+    def __delitem__(self, k):
+        self._detach()
+        super().__delitem__(k)
+    def pop(self, *args):
+        self._detach()
+        return super().pop(*args)
+    def popitem(self):
+        self._detach()
+        return super().popitem()
+    def setdefault(self, *args):
+        self._detach()
+        return super().setdefault(*args)
+    def update(self, *args, **kwargs):
+        self._detach()
+        super().update(*args, **kwargs)
+    def clear(self):
+        self._detach()
+        super().clear()
 
     def mtdb2pd(self):
         import pandas as pd
@@ -82,61 +308,102 @@ class mtdb(dict):
         return db
         
     def db2df(self, db_path, add_paths = True):
-        df = defaultdict(list)
-        if os.stat(db_path).st_size == 0:
+        db_path = format_path(db_path)
+        db_stat = os.stat(db_path)
+        if db_stat.st_size == 0:
             return {x: [] for x in mtdb.columns}
-        with open(format_path(db_path), 'r') as raw:
-            data = [x.rstrip().split('\t') for x in raw if not x.startswith('#')]
-        columns = self.columns
-        for entry in data:
-            [df[c].append('') for c in columns] # add a blank entry to each
-            # column
-            for i, d in enumerate(entry):
-                df[columns[i]][-1] = d
-            try:
-                df['taxonomy'][-1] = read_tax(
-                    df['taxonomy'][-1]
-                    )
-            except json.decoder.JSONDecodeError:
-                print(df['taxonomy'][-1])
-                sys.exit()
-            df['taxonomy'][-1]['genus'] = df['genus'][-1]
-            df['taxonomy'][-1]['species'] = \
-                df['genus'][-1] + ' ' + df['species'][-1]
-            df['taxonomy'][-1]['strain'] = \
-                df['strain'][-1]
+        df = mtdb.read_snapshot(db_path, db_stat)
+        if df is None:
+            with open(db_path, 'r') as raw:
+                data = [x.rstrip().split('\t') for x in raw if not x.startswith('#')]
+            columns, col_len = self.columns, len(self.columns)
+            # row-wise, then transpose rows into columns
+            data = [(x + [''] * (col_len - len(x)))[:col_len] for x in data]
+            df = {c: list(v) for c, v in zip(columns, zip(*data))}
+            if not df:
+                df = {c: [] for c in columns}
+            mtdb.write_snapshot(db_path, db_stat, df)
+        # taxonomy is decoded from JSON when first accessed
+        df['taxonomy'] = [
+            lazy_tax(t, g, s, st) for t, g, s, st in zip(
+                df['taxonomy'], df['genus'], df['species'], df['strain']
+                )
+            ]
         
         if not add_paths:
             return df
         try:
+            connected = not {'MYCOFNA', 'MYCOFAA', 'MYCOGFF3'}.difference(
+                set(os.environ.keys())
+                )
+            if connected:
+                fna_dir, faa_dir, gff_dir = os.environ['MYCOFNA'], \
+                    os.environ['MYCOFAA'], os.environ['MYCOGFF3']
             for i, ome in enumerate(df['ome']): 
-                if not df['fna'][i]:
-                    if {'MYCOFNA', 'MYCOFAA', 'MYCOGFF3'}.difference(set(os.environ.keys())):
+                if not df['fna'][i] or df['fna'][i] == ome + '.fna':
+                    if not connected:
                         raise FileNotFoundError('You are not connected to a primary MTDB. ' \
                                               + 'Standalone databases need absolute paths')
-                    df['fna'][i] = os.environ['MYCOFNA'] + ome + '.fna'
-                    df['faa'][i] = os.environ['MYCOFAA'] + ome + '.faa'
-                    df['gff3'][i] = os.environ['MYCOGFF3'] + ome + '.gff3'
-                elif df['fna'][i] == ome + '.fna':
-                    if {'MYCOFNA', 'MYCOFAA', 'MYCOGFF3'}.difference(set(os.environ.keys())):
-                        raise FileNotFoundError('You are not connected to a primary MTDB. ' \
-                                              + 'Standalone databases need absolute paths')
-                    df['fna'][i] = os.environ['MYCOFNA'] + ome + '.fna'
-                    df['faa'][i] = os.environ['MYCOFAA'] + ome + '.faa'
-                    df['gff3'][i] = os.environ['MYCOGFF3'] + ome + '.gff3'
+                    df['fna'][i] = fna_dir + ome + '.fna'
+                    df['faa'][i] = faa_dir + ome + '.faa'
+                    df['gff3'][i] = gff_dir + ome + '.gff3'
         except KeyError:
             eprint('ERROR: MycotoolsDB not in path, cannot delineate biofile paths', flush = True)
     
         return df
 
+    @staticmethod
+    def snapshot_path(db_path):
+        '''JSON snapshots of parsed MTDBs are maintained for those in the
+        primary MTDB directory ($MYCODB)'''
+        if 'MYCODB' not in os.environ:
+            return None
+        elif os.path.dirname(db_path) \
+            != os.path.abspath(format_path('$MYCODB')).rstrip('/'):
+            return None
+        return db_path + '.snap.json'
+
+    @staticmethod
+    def read_snapshot(db_path, db_stat):
+        '''Columns of a snapshot that matches the MTDB's size and
+        modification time and shares its owner, otherwise None'''
+        snap_path = mtdb.snapshot_path(db_path)
+        if not snap_path:
+            return None
+        try:
+            if os.stat(snap_path).st_uid != db_stat.st_uid:
+                return None
+            with open(snap_path, 'r') as raw:
+                snapshot = json.load(raw)
+            if snapshot['size'] == db_stat.st_size \
+                and snapshot['mtime'] == db_stat.st_mtime:
+                return snapshot['df']
+        except (OSError, KeyError, TypeError, ValueError):
+            pass
+        return None
+
+    @staticmethod
+    def write_snapshot(db_path, db_stat, df):
+        snap_path = mtdb.snapshot_path(db_path)
+        if not snap_path:
+            return
+        tmp_path = f'{snap_path}.{os.getpid()}.tmp'
+        try:
+            with open(tmp_path, 'w') as out:
+                json.dump({
+                    'size': db_stat.st_size, 'mtime': db_stat.st_mtime,
+                    'df': df
+                    }, out)
+            os.replace(tmp_path, snap_path)
+        except OSError: # unwritable directory
+            if os.path.isfile(tmp_path):
+                os.remove(tmp_path)
+
     def df2db(self, db_path = None, headers = False):
-        df = copy.copy(self)
-        df = df.reset_index()
-        output = mtdb(
-            {k: v for k,v in sorted(self.set_index('ome').items(), key = lambda x: x[0])},
-            index = 'ome'
-            ) 
-        # does this work if its not an inplace change
+        # rows are copied to plain dicts before paths are abbreviated
+        output = {
+            k: v.copy() for k,v in sorted(self.set_index('ome').items(), key = lambda x: x[0])
+            }
         paths = {
             'faa': [os.environ['MYCOFAA'], '.faa'],
             'fna': [os.environ['MYCOFNA'], '.fna'],
@@ -152,7 +419,7 @@ class mtdb(dict):
                             paths[file_type][0] + ome + paths[file_type][1], ''
                             ) # abbreviate when possible
                     if output[ome]['taxonomy']:
-                        output[ome]['taxonomy'] = json.dumps(output[ome]['taxonomy'])
+                        output[ome]['taxonomy'] = json.dumps(dict(output[ome]['taxonomy']))
                     else:
                         output[ome]['taxonomy'] = '{}'
                     if not output[ome]['published']:
@@ -172,75 +439,94 @@ class mtdb(dict):
                     output[ome][file_type] = output[ome][file_type].replace(
                         paths[file_type][0] + ome + paths[file_type][1], ''
                         ) # abbreviate when possible
+                tax = dict(output[ome]['taxonomy'])
                 for rank in ['species', 'genus', 'strain']:
                     try:
-                        del output[ome]['taxonomy'][rank]
+                        del tax[rank]
                     except KeyError:
                         pass
-                output[ome]['taxonomy'] = json.dumps(output[ome]['taxonomy'])
+                output[ome]['taxonomy'] = json.dumps(tax)
                 print(ome + '\t' + \
                     '\t'.join([str(output[ome][x]) for x in output[ome]]), flush = True
                     )
 
     def set_index(self, column = 'ome', inplace = False):
-        data, retry, error, df, columns = {}, bool(column), False, copy.copy(self), copy.copy(self.columns)
+        '''Index the mtdb on `column`: {value: {other_col: row_value}} for
+        unique columns (ome, assembly_acc, and biofile paths), otherwise
+        {value: [{other_col: row_value}, ...]}. Rows read the source's
+        columns until either is edited, so the index shares no edits with
+        its source'''
+
         if not column:
-            return df.reset_index()
-        while retry:
-            oldCol = set()
-            try:
-                columns.pop(columns.index(column))
-            except (ValueError, IndexError) as e:
-                df = df.reset_index() #will this actually reset the index
-                columns.pop(columns.index(column))
-            try:
-                df[column]
-            except KeyError:
-                df = df.reset_index()
-            if len(df[column]) == 0:
-                return mtdb({}, index = column)
-            if column in \
-                {'assembly_acc', 'ome', 'fna', 'gff3', 'faa'}: # if it's unique
-                for i, v in enumerate(df[column]):
-                    data[v] = {}
-                    for head in columns:
-                        data[v][head] = df[head][i]
+            return self.reset_index()
+        elif self.index == column:
+            return self
+
+        source = self.reset_index() if self.index else self
+        if column not in source:
+            eprint('\nERROR: invalid column', flush = True)
+            return self
+        store = source._store
+        # untracked lists cannot notify the view of edits, so are copied
+        view_columns = mtdb_view({
+            c: v if isinstance(v, mtdb_column) and v._store is store \
+            else list(v) for c, v in dict.items(source)
+            }, store)
+        keys = view_columns.columns[column]
+        unique = column in {'assembly_acc', 'ome', 'fna', 'gff3', 'faa'}
+        cached = store.positions.get(column)
+        if cached is not None and cached[0] is keys:
+            positions = cached[1]
+        else:
+            if unique:
+                positions = {v: i for i, v in enumerate(keys)}
             else:
-                for i, v in enumerate(df[column]):
-                    if v not in data:
-                        data[v] = []
-                    data[v].append({})
-                    for head in columns:
-                        try:
-                            data[v][-1][head] = df[head][i]
-                        except KeyError: # if an index exists
-                            if error:
-                                eprint('\nERROR: invalid column', flush = True)
-                                return self
-                            df = df.reset_index()
-                            error = True
-                            break
-
-            retry = False
-        return mtdb(data, column)
+                positions = defaultdict(list)
+                for i, v in enumerate(keys):
+                    positions[v].append(i)
+            if isinstance(keys, mtdb_column):
+                store.positions[column] = (keys, positions)
+
+        if not keys:
+            view = mtdb({}, index = column)
+        else:
+            if unique:
+                data = {v: mtdb_row(view_columns, i, column) \
+                        for v, i in positions.items()}
+            else:
+                data = {v: [mtdb_row(view_columns, i, column) for i in x] \
+                        for v, x in positions.items()}
+            view = mtdb(data, column)
+            # collapsed redundant values of a unique column cannot be reset
+            # from the columns
+            if not unique or len(data) == len(keys):
+                view._columns = view_columns
+
+        if inplace:
+            dict.clear(self)
+            dict.update(self, view)
+            self.index, self._columns = column, view._columns
+            return self
+        return view
 
     def reset_index(self):
-        df = copy.copy(self)
-        if df.index:
-            data = {x: [] for x in mtdb().columns}
-            data[df.index] = list(df.keys())
-            if df.index in {'assembly_acc', 'ome', 'biosample', 'fna', 'gff3', 'faa'}:
-                for key in df:
-                    for otherCol in df[key]:
-                        data[otherCol].append(df[key][otherCol])
-            else:
-                for key in df:
-                    for v in df[key]:
-                        for otherCol in v:
-                            data[otherCol].append(v[otherCol])
-            return mtdb(data, index = None)
-        else:
-            return df
+        '''Return the column view of the mtdb: {column: [values]}'''
+
+        if not self.index:
+            return self
+        elif self._columns is not None: # no key edits, the columns are current
+            return mtdb(dict(self._columns.columns))
+
+        data = {x: [] for x in mtdb().columns}
+        for key, rows in self.items():
+            if not isinstance(rows, list): # unique index
+                rows = [rows]
+            for row in rows:
+                data[self.index].append(key)
+                for otherCol in row:
+                    if otherCol in data and otherCol != self.index:
+                        data[otherCol].append(row[otherCol])
+        return mtdb(data, index = None)
 
     def append(self, info = {}):
 #        if any(x not in set(self.columns) for x in info):
@@ -725,6 +1011,45 @@ def assimilate_tax(db, tax_dicts, ome_index = 'ome', forbid={'no rank', 'superki
 
     return db
 
+def index_mtdb_fastas(db, omes = None, spacer = '\t'):
+    """Build/refresh the faidx offset indices of the assemblies and
+    proteomes in `db` (optionally limited to `omes`) for random access"""
+
+    db = db.set_index('ome')
+    if omes is None:
+        omes = set(db.keys())
+    for ome in sorted(omes):
+        for file_type in ['fna', 'faa']:
+            fa_path = db[ome][file_type]
+            if os.path.isfile(fa_path + '.fai') \
+                and os.path.getmtime(fa_path + '.fai') \
+                >= os.path.getmtime(fa_path):
+                continue
+            try:
+                index_fasta(fa_path)
+            except FileNotFoundError:
+                eprint(spacer + 'WARNING: ' + ome + ' missing ' + file_type,
+                       flush = True)
+            except ValueError: # irregular line lengths, will use fa2dict
+                eprint(spacer + 'WARNING: ' + ome + ' ' + file_type \
+                     + ' cannot be indexed', flush = True)
+
+def cache_mtdb_annotations(db, omes = None, spacer = '\t'):
+    """Build/refresh the binary annotation caches (gene order, CDS 
+    coordinates, Alias) of the GFF3s in `db` (optionally limited to `omes`)"""
+
+    db = db.set_index('ome')
+    if omes is None:
+        omes = set(db.keys())
+    for ome in sorted(omes):
+        try: # only rebuilds stale caches
+            load_annotation_cache(db[ome]['gff3'])
+        except FileNotFoundError:
+            eprint(spacer + 'WARNING: ' + ome + ' missing gff3', flush = True)
+        except (IndexError, ValueError):
+            eprint(spacer + 'WARNING: ' + ome + ' gff3 cannot be cached',
+                   flush = True)
+
 def mtdb_disconnect(config, mtdb_config_file = format_path('~/.mycotools/config.json')):
     config['active'] = False
     write_json(config, mtdb_config_file)
@@ -7,10 +7,14 @@ import glob
 import gzip
 import json
 import shutil
+import time
+import fcntl
 import tarfile
+import threading
 import subprocess
 from tqdm import tqdm
 from datetime import datetime
+from contextlib import contextmanager
 
 def checksum(path, cmd = 'sha256', ref = ''):
     if not isinstance(path, list):
@@ -182,6 +186,35 @@ def write_json(obj, json_path, compress = False, indent = 1, **kwargs):
             json.dump(obj, json_out, indent = indent, **kwargs)
 
 
+@contextmanager
+def file_lock(lock_path, shared = False, blocking = True):
+    '''Hold an advisory lock on `lock_path` (shared or exclusive) for the
+    context; yields False if the lock file cannot be created or opened, or
+    if not `blocking` and the lock is held elsewhere'''
+    try:
+        lock = open(lock_path, 'a')
+    except PermissionError: # read-only directory, shared locks still work
+        try:
+            lock = open(lock_path, 'r')
+        except OSError:
+            lock = None
+    except OSError:
+        lock = None
+    if lock is None:
+        yield False
+        return
+    try:
+        try:
+            fcntl.flock(lock, (fcntl.LOCK_SH if shared else fcntl.LOCK_EX) \
+                            | (0 if blocking else fcntl.LOCK_NB))
+        except BlockingIOError:
+            yield False
+            return
+        yield True
+    finally:
+        lock.close() # closing releases the lock
+
+
 def gunzip( gzip_file, remove = True, spacer = '\t' ):
     '''gunzips gzip_file and removes if successful'''
 
@@ -718,7 +751,7 @@ class Subqueue():
             raise TypeError('invalid arguments type: ' + str(type(args)))
         self.complete = False
         self.shell = shell
-        self.status = [-1 for x in args]
+        self.status = [-1 for x in self.args]
         self.exit = -1
 
     def open(self):
@@ -747,33 +780,237 @@ def run_subqueue(i, args, shell = False, verbose = False, injectable = False):
 #    return [], -420
 
 
+def schedule_subs(args_lists, processes = 1, cpus = None, threads = 1,
+                  sizes = None, shell = False, verbose = False, 
+                  injectable = False, status = True, callback = None):
+    """
+    Inputs: list of Subqueue arguments, max concurrent `processes`, total
+    `cpus` budget, CPU `threads` requested by each command (int or list),
+    input `sizes` of each command (bytes or file paths)
+    Outputs: [{'exit': first nonzero return code, 'status': return codes,
+    'time': wall seconds, 'threads': threads}] in input order; 
+    `callback(i, result)` is called serially from the calling thread as each
+    command completes.
+    Commands are launched from lightweight threads, largest input first. A
+    command starts when fewer than `processes` are running and its threads
+    fit the remaining `cpus` budget; a command requesting more than `cpus`
+    runs alone. If `callback` raises, no further commands are started or
+    reported, and the exception is reraised once running commands finish
+    """
+
+    if isinstance(threads, int):
+        threads = [threads for x in args_lists]
+    if cpus is None:
+        cpus = sum(sorted(threads, reverse = True)[:processes])
+    order = list(range(len(args_lists)))
+    if sizes:
+        sizes = [x if isinstance(x, int) else \
+                 (os.path.getsize(x) if x and os.path.isfile(x) else 0) \
+                 for x in sizes]
+        order.sort(key = lambda i: sizes[i], reverse = True)
+
+    results = [None for x in args_lists]
+    running = {'processes': 0, 'threads': 0}
+    queue, finished, errors, workers = order[::-1], [], [], []
+    cond = threading.Condition()
+    progress = tqdm(total = len(args_lists)) if status else None
+
+    def run(i):
+        start = time.time()
+        exit, status = 1, []
+        try:
+            s = Subqueue(args_lists[i], shell = shell, verbose = verbose,
+                         injectable = injectable)
+            s.open()
+            status = s.status
+            exit = next((x for x in status if x), 0) # first failing code
+        except OSError: # missing executable
+            exit = 127
+        except Exception: # malformed command fails without stalling the queue
+            exit = 1
+        finally:
+            results[i] = {'exit': exit, 'status': status, 
+                          'time': time.time() - start, 'threads': threads[i]}
+            with cond:
+                running['processes'] -= 1
+                running['threads'] -= threads[i]
+                finished.append(i)
+                cond.notify_all()
+
+    def fits(i):
+        return running['processes'] < max(processes, 1) \
+            and (not running['processes'] \
+            or running['threads'] + threads[i] <= cpus)
+
+    while True:
+        launch = []
+        with cond:
+            cond.wait_for(lambda: finished or not running['processes'] \
+                          or (queue and not errors and fits(queue[-1])))
+            done, finished[:] = finished[:], []
+            while queue and not errors and fits(queue[-1]):
+                i = queue.pop()
+                running['processes'] += 1
+                running['threads'] += threads[i]
+                launch.append(i)
+            idle = not running['processes'] and not finished
+        for i in launch:
+            worker = threading.Thread(target = run, args = (i,))
+            worker.start()
+            workers.append(worker)
+        # completions are reported outside of the lock
+        for i in done:
+            if progress is not None:
+                progress.update(1)
+            if callback and not errors:
+                try:
+                    callback(i, results[i])
+                except Exception as e:
+                    errors.append(e)
+        if idle and (errors or not queue):
+            break
+
+    for worker in workers:
+        worker.join()
+    if progress is not None:
+        progress.close()
+    if errors:
+        raise errors[0]
+
+    return results
+
+
 def multisub(args_lists, processes = 1, shell = False, 
-             verbose = False, injectable = False, status = True):
-    import multiprocessing as mp
+             verbose = False, injectable = False, status = True,
+             cpus = None, threads = 1, sizes = None, callback = None):
     '''
     Inputs: list of arguments, integer of processes, subprocess `shell` bool
-    Outputs: launches and monitors subprocesses and returns list of exit 
-    information
-    If processes are too few, opt to default. While there are entries in the
-    `args_lists`: 
-        while there are less entries in `running` than max processes
-    and arguments remaining in the `args_lists`: Popen the first argument in 
-    the list, append the subprocess information and command to `running` and
-    delete the argument from `args_lists`. 
-        If there are still args in the args_lists, for each index in running
-        grab the handle, poll if it is done, and if it is done output the 
-        return code and stdin information to outputs and delete the index
-        from `running`.
-        IF there are not arguments in args_lists, wait until all processes
-        are complete before exiting the function.
+    Outputs: list of exit information for each argument
+    Launches the arguments via `schedule_subs`, optionally within a `cpus`
+    budget of `threads` per command and largest `sizes` first
     '''
-    if not status:
-        with mp.Pool(processes = processes) as pool:
-            exit_pre = pool.starmap(run_subqueue, ((i, x, shell, verbose, injectable) \
-                                                    for i, x in enumerate(args_lists)))
-    else:
-        with mp.Pool(processes = processes) as pool:
-            exit_pre = pool.starmap(run_subqueue, tqdm([(i, x, shell, verbose, injectable) \
-                                                    for i, x in enumerate(args_lists)], 
-                                                    total = len(args_lists)))
-    return [exit for i, exit in sorted(exit_pre, key = lambda x: x[0])]
+    results = schedule_subs(args_lists, processes = processes, cpus = cpus,
+                            threads = threads, sizes = sizes, shell = shell,
+                            verbose = verbose, injectable = injectable,
+                            status = status, callback = callback)
+    return [x['exit'] for x in results]
+
+
+def schedule_dag(tasks, cpus = 1):
+    '''
+    Inputs: {name: {'func': callable, 'args': list, 'deps': [names],
+    'threads': maximum threads, 'weight': estimated cost, 'main': bool}},
+    total `cpus` budget
+    Outputs: {name: return value}
+    Each task is called as `func(*args, cpus = threads)` once its `deps`
+    complete. Ready tasks on the longest remaining weighted path start first
+    and split the free `cpus` evenly up to their `threads`. Tasks that 
+    return False skip their dependents (recorded False). `main` tasks run on
+    the calling thread, e.g. for GUI libraries; the rest run on lightweight
+    threads. The first exception raised by a task is reraised once running 
+    tasks finish
+    '''
+
+    children = {name: [] for name in tasks}
+    waiting = {name: set(task.get('deps', [])) for name, task in tasks.items()}
+    for name, deps in waiting.items():
+        for dep in deps:
+            children[dep].append(name)
+
+    # topological order to compute the longest weighted path to a sink
+    order, todo = [], [name for name, deps in waiting.items() if not deps]
+    indegree = {name: len(deps) for name, deps in waiting.items()}
+    while todo:
+        name = todo.pop()
+        order.append(name)
+        for child in children[name]:
+            indegree[child] -= 1
+            if not indegree[child]:
+                todo.append(child)
+    if len(order) != len(tasks):
+        raise ValueError('task dependencies are cyclic')
+    levels = {}
+    for name in reversed(order):
+        levels[name] = tasks[name].get('weight', 1) \
+                     + max([levels[x] for x in children[name]], default = 0)
+
+    cpus = max(cpus, 1)
+    results, errors, finished = {}, [], []
+    ready = [name for name, deps in waiting.items() if not deps]
+    running = {'tasks': 0, 'threads': 0}
+    cond = threading.Condition()
+
+    def run(name, threads):
+        task = tasks[name]
+        try:
+            res, exc = task['func'](*task.get('args', []), cpus = threads), None
+        except Exception as e:
+            res, exc = False, e
+        with cond:
+            finished.append((name, threads, res, exc))
+            cond.notify_all()
+
+    def complete(name, res):
+        results[name] = res
+        if res is False:
+            skips = list(children[name])
+            while skips:
+                skip = skips.pop()
+                if skip not in results:
+                    results[skip] = False
+                    skips.extend(children[skip])
+            return
+        for child in children[name]:
+            waiting[child].discard(name)
+            if not waiting[child] and child not in results:
+                ready.append(child)
+
+    while True:
+        main_task = None
+        with cond:
+            cond.wait_for(lambda: finished or not running['tasks'] \
+                          or (ready and not errors \
+                              and (running['threads'] < cpus \
+                              or any(tasks[x].get('main') for x in ready))))
+            while finished:
+                name, threads, res, exc = finished.pop()
+                running['tasks'] -= 1
+                running['threads'] -= threads
+                if exc is not None:
+                    errors.append(exc)
+                complete(name, res)
+            if errors:
+                if not running['tasks']:
+                    raise errors[0]
+                continue
+            ready.sort(key = lambda x: (bool(tasks[x].get('main')), levels[x]))
+            while ready:
+                if tasks[ready[-1]].get('main'):
+                    main_task = ready.pop()
+                    break
+                free = cpus - running['threads']
+                if free < 1 and running['tasks']:
+                    break
+                name = ready.pop()
+                share = -(-free // (len(ready) + 1)) # ceiling
+                threads = max(min(tasks[name].get('threads', 1), share), 1)
+                running['tasks'] += 1
+                running['threads'] += threads
+                threading.Thread(target = run, args = (name, threads)).start()
+            if main_task is None and not ready and not running['tasks']:
+                break
+        if main_task is not None:
+            try:
+                res = tasks[main_task]['func'](
+                    *tasks[main_task].get('args', []), cpus = 1
+                    )
+            except Exception as e:
+                with cond:
+                    errors.append(e)
+                    if not running['tasks']:
+                        raise
+                    continue
+            with cond:
+                complete(main_task, res)
+
+    return results
@@ -3,7 +3,8 @@
 import os
 import sys
 import argparse
-from mycotools.lib.dbtools import loginCheck, primaryDB, mtdb
+from mycotools.lib.dbtools import loginCheck, primaryDB, mtdb, \
+    index_mtdb_fastas, cache_mtdb_annotations
 from mycotools.lib.kontools import format_path, read_json, collect_files
 
 # NEED delete database feature
@@ -22,6 +23,10 @@ def rm_outdated(omes, yes = False):
             ome = ome_prep[:-4]
         elif ome_prep.endswith('.fna'):
             ome = ome_prep[:-4]
+        elif ome_prep.endswith(('.faa.fai', '.fna.fai')):
+            ome = ome_prep[:-8]
+        elif ome_prep.endswith('.gff3.cache.npz'):
+            ome = ome_prep[:-15]
         else: # safer to preserve independent placements
             continue
         if ome not in omes:
@@ -80,6 +85,10 @@ def cli():
     parser.add_argument('-r', '--restrict', 
                         help = 'Restrict assembly accessions file, formatted: ' \
                              + '<ACCESSION>\t<SOURCE>\t[REASON]')
+    parser.add_argument('-i', '--index', action = 'store_true',
+                        help = 'Index fastas for random access')
+    parser.add_argument('-b', '--build_cache', action = 'store_true',
+                        help = 'Build binary GFF3 annotation caches')
     parser.add_argument('-y', '--yes', help = 'Answer yes', action = 'store_true')
     args = parser.parse_args()
 
@@ -97,6 +106,10 @@ def cli():
         restrictions(db, restricted, yes = args.yes)
     if args.clear_cache:
         rm_outdated(mtdb(primaryDB())['ome'], args.yes)
+    if args.index:
+        index_mtdb_fastas(mtdb(primaryDB()))
+    if args.build_cache:
+        cache_mtdb_annotations(mtdb(primaryDB()))
 
     sys.exit(0)
 
@@ -29,8 +29,9 @@ from Bio import Entrez
 from collections import defaultdict
 from mycotools.lib.dbtools import db2df, df2db, gather_taxonomy, assimilate_tax, \
     primaryDB, loginCheck, log_editor, mtdb, mtdb_connect, \
-    mtdb_initialize
-from mycotools.lib.kontools import intro, outro, format_path, eprint, prep_output, collect_files, read_json, write_json
+    mtdb_initialize, index_mtdb_fastas, cache_mtdb_annotations
+from mycotools.lib.kontools import intro, outro, format_path, eprint, prep_output, collect_files, read_json, write_json, \
+    schedule_subs
 from mycotools.lib.biotools import fa2dict, gff2list
 from mycotools.ncbiDwnld import esearch_ncbi, esummary_ncbi, main as ncbiDwnld
 from mycotools.jgiDwnld import main as jgiDwnld
@@ -39,6 +40,7 @@ from mycotools.utils.jgi2db import main as jgi2db
 from mycotools.predb2mtdb import main as predb2mtdb
 from mycotools.assemblyStats import main as assStats
 from mycotools.annotationStats import main as annStats
+from mycotools.db2search import refresh_mmseqs_searchdbs
 
 def mycocosmTermsAndConditions(config):
 
@@ -416,10 +418,33 @@ def checkBiofile( row, biotype ):
 
     return code
 
+mycocosm_catalog_url = 'https://mycocosm.jgi.doe.gov/ext-api/mycocosm/catalog/' + \
+    'download-group?flt=&seq=all&pub=all&grp=fungi&srt=released&ord=desc'
+ncbi_report_url = 'https://ftp.ncbi.nlm.nih.gov/genomes/GENOME_REPORTS/'
+
+def prefetch_tables(ncbi_file, mycocosm_file = None, group = 'eukaryotes'):
+    """Concurrently download the NCBI genome report and MycoCosm catalog
+    that are not already present"""
+    cmds = []
+    if not os.path.isfile(ncbi_file):
+        cmds.append((('curl', '-s', ncbi_report_url + group + '.txt', 
+                      '-o', ncbi_file + '.tmp', '&&'),
+                     ('mv', ncbi_file + '.tmp', ncbi_file)))
+    if mycocosm_file and not os.path.isfile(mycocosm_file):
+        cmds.append((('curl', '-s', mycocosm_catalog_url, 
+                      '-o', mycocosm_file + '.tmp', '&&'),
+                     ('mv', mycocosm_file + '.tmp', mycocosm_file)))
+    if cmds:
+        results = schedule_subs(cmds, processes = len(cmds), injectable = True,
+                                status = False)
+        for cmd, res in zip(cmds, results):
+            if res['exit']: # the table's download function will retry
+                eprint('\tWARNING: ' + cmd[0][2] + ' download failed (' \
+                     + f'{res["time"]:.1f}s)', flush = True)
+
 def dwnld_mycocosm(
     out_file,
-    mycocosm_url = 'https://mycocosm.jgi.doe.gov/ext-api/mycocosm/catalog/' + \
-        'download-group?flt=&seq=all&pub=all&grp=fungi&srt=released&ord=desc'
+    mycocosm_url = mycocosm_catalog_url
     ):
 
     if not os.path.isfile(out_file):
@@ -437,7 +462,7 @@ def dwnld_mycocosm(
 
 def dwnld_ncbi_table( 
     ncbi_file,
-    ncbi_url = 'https://ftp.ncbi.nlm.nih.gov/genomes/GENOME_REPORTS/',
+    ncbi_url = ncbi_report_url,
     group = 'eukaryotes'
     ):
 
@@ -553,10 +578,9 @@ def rm_ncbi_overlap(ncbi_df, mycocosm_df, ncbi2jgi, fails = set(), api = 3):
             else:
                 fails.add(row['assembly_acc'])
 
-    ncbi_jgi_overlap = pd.DataFrame()
-    for i in reversed(todel):
-        ncbi_jgi_overlap = pd.concat([ncbi_jgi_overlap, ncbi_df.loc[i]])
-        ncbi_df = ncbi_df.drop(i)
+    # slice the overlap by index once rather than concatenating row-by-row
+    ncbi_jgi_overlap = ncbi_df.loc[todel]
+    ncbi_df = ncbi_df.drop(todel)
 
     
     return ncbi_df, jgi2ncbi, jgi2biosample, fails, ncbi_jgi_overlap
@@ -588,14 +612,17 @@ def prepare_ref_db(ref_db, date):
 
 
 def internal_redundancy_check(db):
-    db = mtdb.pd2mtdb(db).set_index()
-    ncbi_db = {k: v for k,v in db.items() if v['source'] == 'ncbi'}
-    jgi_db = {k: v for k,v in db.items() if v['source'] == 'jgi'}
-
-    ncbi_accs = defaultdict(list)
-    for ome, row in ncbi_db.items():
-        ass_acc = row['assembly_acc'][:row['assembly_acc'].find('.')]
-        ncbi_accs[ass_acc].append(ome)
+    col_db = mtdb.pd2mtdb(db)
+    # group accessions from the columns and look rows up by the ome index
+    ncbi_accs, jgi_accs = defaultdict(list), defaultdict(list)
+    for ome, source, ass_acc in zip(col_db['ome'], col_db['source'], 
+                                    col_db['assembly_acc']):
+        if source == 'ncbi':
+            ncbi_accs[ass_acc[:ass_acc.find('.')]].append(ome)
+        elif source == 'jgi':
+            jgi_accs[ass_acc].append(ome)
+    db, todel = col_db.set_index('ome'), set()
+
     red_ncbi = {k: v for k, v in ncbi_accs.items() if len(v) > 1}
     for ass_acc, omes in red_ncbi.items():
         omes = sorted(omes, reverse = True) # large ome number to small
@@ -603,7 +630,7 @@ def internal_redundancy_check(db):
         for ome in omes:
             try:
                 acc_ver = int(
-                    ncbi_db[ome]['assembly_acc'][ncbi_db[ome]['assembly_acc'].find('.')+1:]
+                    db[ome]['assembly_acc'][db[ome]['assembly_acc'].find('.')+1:]
                     )
             except ValueError:
                 acc_ver = 0
@@ -611,22 +638,16 @@ def internal_redundancy_check(db):
         max_ver = max(accs.keys())
         for ver, omes in accs.items():
             if ver != max_ver:
-                for ome in omes:
-                    del db[ome]
+                todel.update(omes)
             else:
-                for ome in omes[1:]:
-                    del db[ome]
+                todel.update(omes[1:])
 
-    jgi_accs = defaultdict(list)
-    for ome, row in jgi_db.items():
-        ass_acc = row['assembly_acc']
-        jgi_accs[ass_acc].append(ome)
     red_jgi = {k: v for k,v in jgi_accs.items() if len(v) > 1}
     for ass_acc, omes in red_jgi.items():
         omes = sorted(omes, reverse = True)
         accs = defaultdict(list)
         for ome in omes:
-            acc_ver = jgi_db[ome]['version'].replace('v','').replace('V','')
+            acc_ver = db[ome]['version'].replace('v','').replace('V','')
             try:
                 ver = int(float(acc_ver))
             except ValueError:
@@ -635,13 +656,13 @@ def internal_redundancy_check(db):
         max_ver = max(accs.keys())
         for ver, omes in accs.items():
             if ver != max_ver:
-                for ome in omes:
-                    del db[ome]
+                todel.update(omes)
             else:
-                for ome in omes[1:]:
-                    del db[ome]
+                todel.update(omes[1:])
     
-    return db2df(db.reset_index())
+    col_db = db.reset_index()
+    keep = [i for i, ome in enumerate(col_db['ome']) if ome not in todel]
+    return db2df(mtdb({k: [v[i] for i in keep] for k, v in col_db.items()}))
 
 
 def ref_update(
@@ -806,6 +827,9 @@ def rogue_update(
     else:
         api = 3
     ncbi_db_path = update_path + date + '.ncbi.mtdb'
+    prefetch_tables(update_path + date + '.ncbi.tsv', 
+                    update_path + date + '.mycocosm.csv' if jgi else None,
+                    group = group)
     pre_ncbi_df0 = dwnld_ncbi_table(update_path + date + '.ncbi.tsv',
                                    group = group) 
     pre_ncbi_df1 = prep_ncbi_names(pre_ncbi_df0)
@@ -983,6 +1007,10 @@ def rm_outdated(omes):
             ome = ome_prep[:-4]
         elif ome_prep.endswith('.fna'):
             ome = ome_prep[:-4]
+        elif ome_prep.endswith(('.faa.fai', '.fna.fai')):
+            ome = ome_prep[:-8]
+        elif ome_prep.endswith('.gff3.cache.npz'):
+            ome = ome_prep[:-15]
         else: # safer to preserve independent placements
             continue 
         if ome not in omes:
@@ -1054,6 +1082,8 @@ def db2primary(addDB, refDB, save = False, combined = False):
     addDB = addDB.set_index()
     for ome, row in addDB.items():
         refDB[ome] = row
+    index_mtdb_fastas(addDB)
+    cache_mtdb_annotations(addDB)
 
     return refDB.reset_index(), updates
     
@@ -1198,6 +1228,7 @@ def main():
 
 
         new_mtdb.df2db(new_db_path)
+        refresh_mmseqs_searchdbs(new_mtdb)
 
 
 #        if update_omes and args.clear_cache:
@@ -1317,6 +1348,7 @@ def main():
         except FileNotFoundError:
             pass
         shutil.move(new_path + '.tmp', new_path)
+        refresh_mmseqs_searchdbs(full_mtdb)
         rm_raw_data(update_path)
         eprint('\nGathering assembly statistics', flush = True)
         assStats(primaryDB(), format_path('$MYCODB/../data/assemblyStats.tsv'), 1)
@@ -0,0 +1,110 @@
+#! /usr/bin/env python3
+
+"""Benchmark db2microsyntree.parse_loci's NumPy window pair generator
+against the legacy per-window sorted(set()) implementation on MTDB genomes"""
+
+import sys
+import time
+import random
+import argparse
+import tempfile
+import tracemalloc
+import numpy as np
+from itertools import combinations
+from mycotools.lib.kontools import format_path, eprint
+from mycotools.lib.dbtools import mtdb, primaryDB
+from mycotools.lib.biotools import load_annotation_cache
+from mycotools.db2microsyntree import parse_loci, compile_cds, \
+    compile_homolog_groups, encode_pairs
+
+
+def parse_loci_legacy(gff_path, ome, gene2hg, window = 6):
+    """previous parse_loci(): sorted(set()) per window, combinations of each"""
+
+    ann_cache = load_annotation_cache(gff_path)
+    hg_dict = compile_cds(ann_cache, gene2hg)
+    pairs = []
+    for scaf, hgs in hg_dict.items(): # for each contig
+        windows = [sorted(set([x for x in hgs[i:i+window+1] \
+                               if x is not None])) \
+                   for i in range(len(hgs) - window + 1)]
+        for w in windows:
+            pairs.extend([x for x in combinations(w, 2)])
+
+    out_pairs = set(pairs) # unique pairs of OGs
+    if not out_pairs:
+        return ome, np.array([], dtype = np.int64)
+    pair_arr = np.array(list(out_pairs), dtype = np.int64)
+    return ome, np.unique(encode_pairs(pair_arr[:, 0], pair_arr[:, 1]))
+
+
+def time_func(func, gff_path, ome, gene2hg, window):
+    tracemalloc.start()
+    start = time.perf_counter()
+    res = func(gff_path, ome, gene2hg, window)[1]
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return res, elapsed, peak
+
+
+def main(db, gene2hg, omes, window):
+    """Time each implementation per ome, verifying identical output.
+    Outputs [[ome, pairs, legacy_s, numpy_s, legacy_MB, numpy_MB]]"""
+
+    results = []
+    for ome in omes:
+        gff_path = db[ome]['gff3']
+        load_annotation_cache(gff_path) # exclude cache building
+        old_res, old_t, old_mem = time_func(parse_loci_legacy, gff_path,
+                                            ome, gene2hg, window)
+        new_res, new_t, new_mem = time_func(parse_loci, gff_path,
+                                            ome, gene2hg, window)
+        if not np.array_equal(old_res, new_res):
+            raise ValueError(ome + ' pairs differ between implementations')
+        results.append([ome, len(new_res), old_t, new_t,
+                        old_mem/1000000, new_mem/1000000])
+
+    return results
+
+
+def cli():
+    parser = argparse.ArgumentParser(
+        description = 'Benchmark db2microsyntree locus pair enumeration'
+        )
+    parser.add_argument('-i', '--input', required = True,
+        help = 'Homology groups: OrthoFinder Orthogroups.txt or "gene\tcluster#"')
+    parser.add_argument('-d', '--db', default = primaryDB(),
+        help = 'MycotoolsDB. DEFAULT: masterdb')
+    parser.add_argument('-n', '--number', type = int, default = 10,
+        help = 'Random genomes to benchmark. DEFAULT: 10')
+    parser.add_argument('-w', '--window', default = 5, type = int,
+        help = 'Max genes +/- for locus window. DEFAULT: 5 (11 gene window)')
+    args = parser.parse_args()
+
+    db = mtdb(format_path(args.db)).set_index('ome')
+    ome2i, gene2hg, i2ome, hg2gene = compile_homolog_groups(
+        format_path(args.input), tempfile.gettempdir() + '/', set(db.keys())
+        )
+    omes = sorted(ome2i.keys())
+    if len(omes) > args.number:
+        omes = sorted(random.sample(omes, args.number))
+    if not omes:
+        eprint('\nERROR: no MTDB genomes in homology groups', flush = True)
+        sys.exit(1)
+
+    results = main(db, gene2hg, omes, args.window*2+1)
+    print('#ome\tpairs\tlegacy_s\tnumpy_s\tlegacy_MB\tnumpy_MB', flush = True)
+    for res in results:
+        print('\t'.join([res[0], str(res[1])] \
+                      + ['{:.4f}'.format(x) for x in res[2:]]), flush = True)
+    old_t, new_t = sum(x[2] for x in results), sum(x[3] for x in results)
+    print(f'#total\t{sum(x[1] for x in results)}\t{old_t:.4f}\t{new_t:.4f}' \
+        + f'\t{max(x[4] for x in results):.4f}\t{max(x[5] for x in results):.4f}',
+          flush = True)
+    eprint(f'\n{old_t/new_t:.1f}x speedup', flush = True)
+    sys.exit(0)
+
+
+if __name__ == '__main__':
+    cli()
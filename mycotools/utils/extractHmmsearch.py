@@ -4,6 +4,7 @@ import os
 import re
 import sys
 import argparse
+from collections import defaultdict
 from mycotools.lib.kontools import intro, outro, file2list, format_path, mkOutput
 
 def grab_names(data, query = False):
@@ -103,7 +104,7 @@ def grab_hits(data, threshold = None, evalue = None, bitscore = None,
             new_passSeq = set()
             out_hits, out_aligns = [], []
             for hit in hit_list:
-                if int(10**200 * float(hit[1])) < int(10**200 * float(evalue)):
+                if float(hit[1]) < float(evalue):
                     out_hits.append(hit)
                     new_passSeq.add(hit[0])
             for align in aln_list:
@@ -147,6 +148,92 @@ def grab_hits(data, threshold = None, evalue = None, bitscore = None,
     return hit_str, aln_str
 
 
+# column indices of hmmsearch --domtblout and nhmmer --tblout
+domtbl_cols = {'query': 3, 'qacc': 4, 'qlen': 5, 'seq_e': 6, 'seq_score': 7,
+               'hmm_from': 15, 'hmm_to': 16, 'ali_from': 17, 'ali_to': 18,
+               'fields': 22}
+nhmmer_cols = {'query': 2, 'qacc': 3, 'qlen': None, 'seq_e': 12, 
+               'seq_score': 13, 'hmm_from': 4, 'hmm_to': 5, 'ali_from': 6,
+               'ali_to': 7, 'fields': 15}
+
+
+def hmm_lengths(hmm_path):
+    """{NAME: LENG, ACC: LENG} of each profile in an .hmm file"""
+
+    lengths, names = {}, []
+    with open(hmm_path, 'r') as raw:
+        for line in raw:
+            if line.startswith(('NAME', 'ACC ')):
+                names.append(line.split()[1])
+            elif line.startswith('LENG'):
+                for name in names:
+                    lengths[name] = int(line.split()[1])
+            elif line.startswith('//'):
+                names = []
+
+    return lengths
+
+
+def parse_domtblout(domtbl, accession = False, best = None, threshold = None,
+                    evalue = None, bitscore = None, group = None,
+                    e_scale = None, nhmmer = False, qlens = None):
+    """
+    Inputs: hmmsearch --domtblout (nhmmer --tblout) path, key by query 
+    `accession`, `best` hits to retain, query coverage `threshold`, max 
+    sequence `evalue`, min sequence `bitscore`, `group` function to bin 
+    targets (e.g. by ome), {group: factor} to rescale sequence E-values of 
+    each bin, and {query: length} for nhmmer coverage
+    Outputs: {group: {query: ((target, aliFrom, aliTo),)}}, ordered by
+    descending sequence score
+    """
+
+    c = nhmmer_cols if nhmmer else domtbl_cols
+    hits = defaultdict(lambda: defaultdict(dict))
+    with open(domtbl, 'r') as raw:
+        for line in raw:
+            if line.startswith('#'):
+                continue
+            d = line.split(maxsplit = c['fields'])
+            if len(d) < c['fields']:
+                continue
+            if accession and d[c['qacc']] != '-':
+                query = d[c['qacc']]
+            else:
+                query = d[c['query']]
+            if threshold:
+                qlen = qlens[d[c['query']]] if nhmmer else int(d[c['qlen']])
+                if int(d[c['hmm_to']]) - int(d[c['hmm_from']]) + 1 \
+                    < threshold * qlen:
+                    continue
+            grp = group(d[0]) if group else None
+            q_hits = hits[grp][query]
+            if d[0] not in q_hits:
+                seq_e = float(d[c['seq_e']])
+                if e_scale:
+                    seq_e *= e_scale[grp]
+                if (evalue and seq_e >= evalue) \
+                    or (bitscore and float(d[c['seq_score']]) < bitscore):
+                    q_hits[d[0]] = None
+                else:
+                    q_hits[d[0]] = [float(d[c['seq_score']]), []]
+            if q_hits[d[0]] is not None:
+                q_hits[d[0]][1].append((d[0], int(d[c['ali_from']]), 
+                                        int(d[c['ali_to']]),))
+
+    out = {}
+    for grp, q_dict in hits.items():
+        out[grp] = {}
+        for query, t_dict in q_dict.items():
+            t_hits = sorted((x for x in t_dict.values() if x is not None),
+                            key = lambda x: x[0], reverse = True)
+            if best:
+                t_hits = t_hits[:best]
+            if t_hits:
+                out[grp][query] = tuple(y for x in t_hits for y in x[1])
+
+    return out
+
+
 def synthesizeHits( out_dict ):
 
     check = []
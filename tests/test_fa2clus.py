@@ -0,0 +1,147 @@
+import os
+import random
+
+import pytest
+from scipy.cluster import hierarchy
+from scipy.spatial.distance import squareform
+
+from mycotools import fa2clus
+
+
+@pytest.fixture(autouse = True)
+def scipy_globals(monkeypatch):
+    # fa2clus.main() imports these into the module for hierarchical runs
+    monkeypatch.setattr(fa2clus, 'hierarchy', hierarchy, raising = False)
+    monkeypatch.setattr(fa2clus, 'squareform', squareform, raising = False)
+
+
+@pytest.fixture
+def dist_graph(tmp_path):
+    """Seeded diamond-style identity table: dense families with sparse
+    bridges between them, so the focal cluster grows over many cuts"""
+    rand = random.Random(7)
+    genes = [f'g{i}' for i in range(60)]
+    rows = []
+    for fam in range(6):
+        members = genes[fam*10:(fam+1)*10]
+        for i, q in enumerate(members):
+            for s in members[i+1:]:
+                if rand.random() < 0.5:
+                    rows.append((q, s, rand.randint(55, 99)))
+        rows.append((q, q, 100))
+    for _ in range(25):
+        q, s = rand.sample(genes, 2)
+        rows.append((q, s, rand.randint(25, 60)))
+    dist_path = tmp_path / 'dist.tsv'
+    dist_path.write_text('\n'.join('\t'.join(map(str, x)) for x in rows) + '\n')
+    return fa2clus.rd_dmnd_distmtx(str(dist_path), 20)
+
+
+def step_and_rerun(dist_graph, focal_gene, min_seq, max_seq, clus_var,
+                   interval, min_var, max_var):
+    """Baseline iteration: cut at `clus_var`, step by `interval` toward
+    the size range, and stop when the step direction switches"""
+    linkage_matrix = fa2clus.aggd_linkage(dist_graph, 'single')
+    labels = dist_graph.labels
+    old_direction, successes, sizes = None, [], {}
+    while min_var <= clus_var <= max_var:
+        fcluster = hierarchy.fcluster(linkage_matrix, clus_var,
+                                      criterion = 'distance')
+        focal = fcluster[labels.index(focal_gene)]
+        cluster = tuple(sorted(x for x, c in zip(labels, fcluster) \
+                               if c == focal))
+        sizes[clus_var] = len(cluster)
+        if len(cluster) >= min_seq:
+            if len(cluster) <= max_seq:
+                successes.append(cluster)
+                direction = -1
+            else:
+                direction = 1
+        else:
+            direction = -1
+        if old_direction and direction != old_direction:
+            break
+        old_direction = direction
+        oclus_var = clus_var
+        clus_var = round((clus_var - interval*direction) * 100)/100
+        if oclus_var not in {min_var, max_var}:
+            clus_var = min(max(clus_var, min_var), max_var)
+    if successes:
+        return max(successes, key = len)
+
+
+def sweep(dist_graph, tmp_path, focal_gene, min_seq, max_seq, clus_var):
+    os.makedirs(tmp_path / 'working', exist_ok = True)
+    params = {'dist': dist_graph, 'link': 'single', 'dir': f'{tmp_path}/'}
+    log_dict = {'iterations': [], 'successes': []}
+    return fa2clus.cluster_iter_aggclus(
+        params, min_seq, max_seq, 0.2, clus_var, 0.01, 0.01, 1, log_dict,
+        str(tmp_path / 'log.json'), focal_gene
+        )
+
+
+@pytest.mark.parametrize('focal_gene', ['g3', 'g27', 'g55'])
+@pytest.mark.parametrize('min_seq, max_seq, clus_var', [
+    (2, 10, 0.3), (5, 25, 0.05), (10, 40, 0.6), (3, 8, 0.45), (2, 5, 0.7)
+    ])
+def test_aggclus_sweep_matches_step_and_rerun(dist_graph, tmp_path,
+                                              focal_gene, min_seq, max_seq,
+                                              clus_var):
+    expected = step_and_rerun(dist_graph, focal_gene, min_seq, max_seq,
+                              clus_var, 0.01, 0.01, 0.8)
+    cluster, newick, log_dict, exit_code = sweep(
+        dist_graph, tmp_path, focal_gene, min_seq, max_seq, clus_var
+        )
+    if expected is None:
+        assert exit_code != 0
+    else:
+        assert exit_code == 0
+        assert tuple(sorted(cluster)) == expected
+        assert log_dict['successes'][0]['size'] == len(expected)
+
+
+def test_aggclus_iterations_carry_clusters(dist_graph, tmp_path):
+    cluster, newick, log_dict, exit_code = sweep(
+        dist_graph, tmp_path, 'g3', 2, 5, 0.3
+        )
+    # outgroup detection widens the size range beyond this run's max_seq
+    assert any(x['size'] > 5 for x in log_dict['iterations'])
+    for iteration in log_dict['iterations']:
+        assert len(iteration['cluster']) == iteration['size']
+        assert 'g3' in iteration['cluster']
+
+
+@pytest.mark.parametrize('reader', [
+    lambda x: fa2clus.rd_dmnd_distmtx(x, 20),
+    fa2clus.rd_usrch_distmtx
+    ], ids = ['diamond', 'usearch'])
+def test_self_only_focal_is_singleton(tmp_path, reader):
+    dist_path = tmp_path / 'dist.tsv'
+    if reader is fa2clus.rd_usrch_distmtx:
+        rows = ['a\tb\t0.1', 'b\tc\t0.2', 'solo\tsolo\t0']
+    else:
+        rows = ['a\tb\t90', 'b\tc\t80', 'solo\tsolo\t100']
+    dist_path.write_text('\n'.join(rows) + '\n')
+    dist_graph = reader(str(dist_path))
+    assert 'solo' in dist_graph.labels
+    assert dist_graph.matrix.nnz == 2
+    cluster, newick, log_dict, exit_code = sweep(
+        dist_graph, tmp_path, 'solo', 2, 5, 0.3
+        )
+    assert cluster == ['solo']
+    assert exit_code == 1
+
+
+def test_tied_heights_are_one_cut(tmp_path):
+    # B and C join A at the same height, so no cut yields only A and B
+    dist_path = tmp_path / 'dist.tsv'
+    dist_path.write_text('A\tB\t70\nA\tC\t70\nA\tD\t50\n')
+    dist_graph = fa2clus.rd_dmnd_distmtx(str(dist_path), 20)
+    cluster, newick, log_dict, exit_code = sweep(
+        dist_graph, tmp_path, 'A', 2, 2, 0.3
+        )
+    assert exit_code == 2
+    assert not log_dict['successes']
+    assert sorted(cluster) != ['A', 'B']
+    for iteration in log_dict['iterations']:
+        assert len(iteration['cluster']) == iteration['size']